@@ -1,17 +1,58 @@
+import logging
+
 from flask import Flask
 
 # Para poder conectar front y backend
 from flask_cors import CORS
-from .config.config import CORS_ORIGINS
+# Configuración (lee también las variables de entorno del .env)
+from .config.config import ASYNC_CONFIG, CORS_ORIGINS, UPLOAD_CONFIG
+
+# Request que guarda los archivos subidos en disco temporal (sin cargarlos enteros en memoria)
+from .utils.archivos import AutodocRequest
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+
+def create_app():
+    """
+    Crea la aplicación Flask (application factory): python main.py en desarrollo, wsgi.py en producción.
+    No abre conexiones ni sesiones HTTP: el pool de la BBDD, el cliente de Graph, etc. se crean la primera
+    vez que se usan en cada proceso (ver funciones.py), así cada worker de gunicorn tiene los suyos.
+    """
+    app = Flask(__name__)
+    app.request_class = AutodocRequest
+    AutodocRequest.spool_max_size = UPLOAD_CONFIG["SPOOL_MEMORY_MAX"]
+    app.config["MAX_CONTENT_LENGTH"] = UPLOAD_CONFIG["MAX_UPLOAD_SIZE"]
+    CORS(app, resources={"/*": {"origins": CORS_ORIGINS}})  # habilita CORS
+
+    # Registrar rutas
+    from .routes.services import bp as services_bp
+    app.register_blueprint(services_bp)
+
+    # Registrar comandos de línea de comandos (flask --app main ...)
+    from .cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
 
-# Para variables de entorno
-from dotenv import load_dotenv  
+    return app
 
-# Cargar variables de entorno del .env al iniciar la app
-load_dotenv()
 
-app = Flask(__name__)
-CORS(app, resources={"/*": {"origins": CORS_ORIGINS}})  # habilita CORS
+def iniciar_servicios(app):
+    """
+    Arranca el trabajo en segundo plano de un proceso servidor: wsgi.py (cada worker de gunicorn),
+    python main.py y el arranque de cada worker del modo asyncio (app/asgi.py).
+    No se llama desde los comandos (flask --app main migrar, outbox-worker, reconciliar) ni desde
+    el proceso padre del recargador de desarrollo, que no deben programar reconciliaciones.
+    - La reconciliación periódica con SharePoint (Flask-APScheduler, ver utils/programador.py).
+    - Los workers de la outbox: los jobs pendientes o con la reserva caducada (p. ej. tras un despliegue
+      o una caída) se procesan al arrancar, sin esperar a que llegue otra escritura en modo asíncrono.
+    """
+    from .utils import funciones as funcs
+    from .utils.programador import iniciar_programador
 
-# Registrar rutas
-from .routes import services
\ No newline at end of file
+    iniciar_programador(app)
+    if ASYNC_CONFIG["WORKERS"] > 0:
+        try:
+            funcs.get_outbox_worker()
+        except Exception:
+            # Sin BBDD al arrancar: los workers arrancan con la primera escritura en modo asíncrono
+            logger.exception("[OUTBOX] Could not start the workers at boot.")
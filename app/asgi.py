@@ -0,0 +1,36 @@
+import asyncio
+import contextlib
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from . import create_app, iniciar_servicios
+from .config.config import ASGI_CONFIG
+
+
+def create_asgi_app():
+    """
+    Crea la aplicación ASGI del modo asyncio (python asgi.py, con uvicorn):
+    - Las subidas, eliminaciones y escrituras (app/routes/services_async.py) se atienden con corrutinas:
+      un proceso espera a SharePoint y a PostgreSQL en muchas peticiones a la vez sin un hilo por petición.
+    - El resto de rutas las atiende la aplicación Flask de siempre (create_app) en WSGI_THREADS hilos.
+    El pool de asyncpg y el cliente de Graph asíncrono se crean al arrancar cada worker y se cierran al pararlo,
+    junto con los recursos de Flask (funciones.cerrar_recursos).
+    """
+    from .routes.services_async import RUTAS
+    from .utils import funciones as funcs
+    from .utils import funciones_async as afuncs
+
+    @contextlib.asynccontextmanager
+    async def ciclo_de_vida(app):
+        await afuncs.iniciar()
+        await asyncio.to_thread(iniciar_servicios, aplicacion)
+        try:
+            yield
+        finally:
+            await afuncs.cerrar()
+            await asyncio.to_thread(funcs.cerrar_recursos)
+
+    aplicacion = create_app()
+    flask_app = WSGIMiddleware(aplicacion, workers=ASGI_CONFIG["WSGI_THREADS"])
+    return Starlette(routes=[*RUTAS, Mount("/", app=flask_app)], lifespan=ciclo_de_vida)
@@ -0,0 +1,43 @@
+import signal
+import click
+from flask import Blueprint
+from app.db.migrador import MigracionError
+from app.utils import funciones as funcs
+
+# -------------------- COMANDOS DE MANTENIMIENTO -------------------- #
+# Se ejecutan con: flask --app main <comando>
+bp = Blueprint("cli", __name__, cli_group=None)  # comandos en el nivel superior (sin prefijo "cli")
+
+# Aplica las migraciones pendientes del esquema (app/db/migraciones), en orden
+@bp.cli.command("migrar")
+@click.option("--dry-run", is_flag=True, help="Muestra las migraciones pendientes y el plan actual sin aplicar nada.")
+@click.option("--hasta", type=int, help="Aplica solo hasta esta versión (incluida).")
+def migrar_command(dry_run, hasta):
+    try:
+        migraciones = funcs.migrar(dry_run, hasta, informar=click.echo)
+    except MigracionError as e:
+        raise click.ClickException(str(e))
+    if migraciones and not dry_run:
+        click.echo(f"{len(migraciones)} migraciones aplicadas.")
+
+# Procesa la outbox en primer plano (proceso dedicado a los jobs de SharePoint)
+@bp.cli.command("outbox-worker")
+def outbox_worker_command():
+    worker = funcs.get_outbox_worker()
+    click.echo(f"Procesando autodoc.outbox con {worker.workers} workers (Ctrl+C para salir).")
+    # SIGTERM (docker stop, systemd): terminar los jobs en curso antes de salir
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.wait()
+    except KeyboardInterrupt:
+        worker.stop()
+
+# Ejecuta una pasada de reconciliación SharePoint -> BBDD
+@bp.cli.command("reconciliar")
+@click.option("--completo", is_flag=True, help="Descarta el deltaLink y recorre el drive entero.")
+def reconciliar_command(completo):
+    resumen = funcs.reconciliar_sharepoint(completo)
+    if resumen is None:
+        click.echo("Ya hay otra reconciliación en curso.")
+    else:
+        click.echo(f"Reconciliación terminada: {resumen}")
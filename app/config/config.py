@@ -1,13 +1,202 @@
-APP_PORT = 5000
-CORS_ORIGINS = ["http://localhost:5173"]  # frontend en desarrollo
+import os
+from dotenv import load_dotenv
+
+# Variables de entorno del .env (si existe); las que ya están definidas en el entorno tienen prioridad
+load_dotenv()
+
+
+def _entorno(nombre, defecto):
+    """
+    Valor de la variable de entorno `nombre` convertido al tipo de `defecto` (`defecto` si no está definida).
+    Las listas se indican separadas por comas y los booleanos con 1/0, true/false, yes/no u on/off.
+    """
+    valor = os.getenv(nombre, "").strip()
+    if not valor:
+        return defecto
+    try:
+        if isinstance(defecto, bool):
+            return valor.lower() in ("1", "true", "yes", "on", "si", "sí")
+        if isinstance(defecto, (int, float)):
+            return type(defecto)(valor)
+        if isinstance(defecto, list):
+            return [v.strip() for v in valor.split(",") if v.strip()]
+    except ValueError:
+        raise ValueError(f"Valor no válido en la variable de entorno {nombre}: {valor!r}")
+    return valor
+
+
+def _con_entorno(prefijo, config):
+    """
+    Cada clave del diccionario se puede sobrescribir con la variable de entorno <prefijo><CLAVE>
+    (p. ej. DB_HOST, CACHE_TTL, EXPORT_MAX_CONCURRENT).
+    """
+    return {clave: _entorno(f"{prefijo}{clave}", valor) for clave, valor in config.items()}
+
+
+APP_HOST = _entorno("APP_HOST", "0.0.0.0")
+APP_PORT = _entorno("APP_PORT", 5000)
+APP_DEBUG = _entorno("APP_DEBUG", False)  # debugger y recarga del servidor de desarrollo (python main.py)
+CORS_ORIGINS = _entorno("CORS_ORIGINS", ["http://localhost:5173"])  # frontend en desarrollo
+
+# Servidor de producción (gunicorn wsgi:app, ver gunicorn.conf.py). Variables de entorno SERVER_*.
+# Cada worker es un proceso con su propio pool de la BBDD: las conexiones a PostgreSQL serán como mucho
+# WORKERS * (DB_POOL_MAX + EXPORT_CONFIG["MAX_CONCURRENT"]), que debe quedar por debajo de max_connections.
+SERVER_CONFIG = _con_entorno("SERVER_", {
+    "WORKERS": os.cpu_count() or 1,  # procesos (uno por núcleo)
+    "THREADS": 4,                  # hilos por proceso (mejor no más que DB_POOL_MAX)
+    "TIMEOUT": 120,                # segundos sin responder antes de reiniciar un worker (subidas grandes)
+    "GRACEFUL_TIMEOUT": 30,        # segundos para terminar las requests en curso tras SIGTERM
+    "KEEPALIVE": 5,                # segundos que se mantiene abierta una conexión keep-alive
+    "MAX_REQUESTS": 0,             # reiniciar cada worker tras este número de requests (0 = nunca)
+})
 
 # Configuración de la base de datos
-DB_CONFIG = {
+DB_CONFIG = _con_entorno("", {
     "DB_HOST": "127.0.0.1",
     "DB_NAME": "autodoc_db",
     "DB_USER": "autodoc_user",
     "DB_PASS": "autodoc",
     "DB_PORT": 5432,
-    "MINCONN": 1,
-    "MAXCONN": 5,
-}
\ No newline at end of file
+    "DB_POOL_MIN": 1,              # conexiones abiertas al arrancar
+    "DB_POOL_MAX": 5,              # conexiones máximas en el pool
+    "DB_POOL_TIMEOUT": 10,         # segundos máximos esperando una conexión libre
+    "DB_POOL_PRE_PING": True,      # comprobar la conexión (SELECT 1) antes de entregarla
+    "DB_CONN_TIMEOUT": 10,         # timeout de conexión TCP con PostgreSQL
+    "DB_HOLD_WARN_MS": 500,        # avisar en el log si una conexión se retiene más tiempo
+})
+
+# Configuración de Microsoft Graph (SharePoint)
+GRAPH_CONFIG = _con_entorno("GRAPH_", {
+    "BASE_URL": "https://graph.microsoft.com/v1.0",
+    "LOGIN_URL": "https://login.microsoftonline.com",
+    "TOKEN_REFRESH_MARGIN": 300,   # segundos antes de caducar en los que se renueva el token
+    "POOL_CONNECTIONS": 10,        # hosts distintos con conexiones keep-alive
+    "POOL_MAXSIZE": 20,            # conexiones keep-alive por host
+    "CONNECT_TIMEOUT": 5,          # segundos para establecer la conexión
+    "READ_TIMEOUT": 60,            # segundos esperando respuesta de Graph
+    "MAX_RETRIES": 4,              # reintentos ante 429/5xx o errores de red
+    "BACKOFF_FACTOR": 0.5,         # espera base (se duplica en cada reintento)
+    "MAX_BACKOFF": 30,             # espera máxima entre reintentos (también limita Retry-After)
+})
+
+
+# Subida de documentos a SharePoint
+UPLOAD_CONFIG = _con_entorno("UPLOAD_", {
+    "SIMPLE_UPLOAD_MAX": 4 * 1024 * 1024,   # hasta este tamaño se usa el PUT simple /content
+    "CHUNK_SIZE": 10 * 1024 * 1024,         # tamaño de cada fragmento (múltiplo de 320 KiB)
+    "CHUNK_RETRIES": 5,                     # fallos seguidos permitidos antes de abortar la subida
+    "SPOOL_MEMORY_MAX": 1024 * 1024,        # por encima, el archivo recibido se guarda en disco temporal
+    "MAX_UPLOAD_SIZE": 1024 * 1024 * 1024,  # tamaño máximo de una petición de subida (1 GB)
+    "BATCH_WORKERS": 8,                     # subidas simultáneas a SharePoint en la subida por lotes
+    "BATCH_MAX_FILES": 500,                 # archivos máximos por petición de subida por lotes
+    "BATCH_MAX_IDS": 500,                   # IDs máximos por petición de eliminación por lotes
+    "PROGRESS_DIR": "/tmp/autodoc-subidas", # progreso de las subidas (compartido entre workers, GET /subidas/<id>)
+    "PROGRESS_TTL": 3600,                   # segundos que se conserva el progreso de una subida sin cambios
+})
+
+
+# Paginación de listados (GET /proyectos, GET /proyectos/<id>/documentos)
+PAGINATION_CONFIG = _con_entorno("PAGINATION_", {
+    "DEFAULT_LIMIT": 50,   # tamaño de página si se pide paginación sin "limit"
+    "MAX_LIMIT": 500,      # tamaño de página máximo permitido
+})
+
+
+# Caché de respuestas de lectura (GET de proyectos y documentos), en memoria de cada proceso
+CACHE_CONFIG = _con_entorno("CACHE_", {
+    "ENABLED": True,
+    "MAX_ENTRIES": 1000,   # respuestas cacheadas como máximo (se descartan las menos usadas)
+    "TTL": 30,             # segundos que vive una respuesta aunque no haya escrituras
+    "SHARED": True,        # invalidaciones compartidas entre workers por la BBDD
+    "SYNC_INTERVAL": 1.0,  # segundos entre lecturas de esas invalidaciones en cada proceso (0: en cada consulta)
+})
+
+
+# Modo asíncrono: las operaciones en SharePoint se encolan (tabla autodoc.outbox) y las ejecuta un pool de workers
+ASYNC_CONFIG = _con_entorno("ASYNC_", {
+    "WORKERS": 4,                  # hilos que procesan la cola en cada proceso
+    "POLL_INTERVAL": 1.0,          # segundos entre consultas a la cola cuando está vacía
+    "MAX_ATTEMPTS": 8,             # intentos antes de marcar un job como error
+    "RETRY_BASE": 2,               # espera base entre intentos (se duplica en cada uno)
+    "RETRY_MAX": 300,              # espera máxima entre intentos
+    "LEASE_SECONDS": 600,          # si un worker muere, su job se reintenta pasado este tiempo
+    "STAGING_DIR": "/tmp/autodoc-outbox",  # archivos pendientes de subir (compartido entre workers)
+})
+
+# Reconciliación SharePoint -> BBDD con la consulta delta de Graph (programada con Flask-APScheduler)
+RECONCILE_CONFIG = _con_entorno("RECONCILE_", {
+    "ENABLED": True,               # programar la reconciliación al arrancar (requiere DRIVE_ID)
+    "INTERVAL": 300,               # segundos entre pasadas
+    "PAGE_SIZE": 1000,             # elementos por página de la consulta delta ($top)
+    "GRACE": 900,                  # segundos que se aplazan los elementos recién creados en SharePoint
+    "LEASE_SECONDS": 900,          # si una pasada muere, otra puede empezar pasado este tiempo
+    "PRUNE_ON_RESYNC": True,       # en una pasada completa, eliminar filas cuyo elemento ya no existe
+})
+
+# Exportación completa de proyectos/documentos (GET /exportar/...) con cursor de servidor
+EXPORT_CONFIG = _con_entorno("EXPORT_", {
+    "ITERSIZE": 2000,              # filas por FETCH del cursor de servidor (y por bloque enviado al cliente)
+    "MAX_CONCURRENT": 2,           # exportaciones simultáneas por proceso (cada una con su propia conexión)
+    "QUEUE_TIMEOUT": 5,            # segundos esperando una exportación libre antes de responder 503
+    "HOLD_WARN_MS": 15 * 60 * 1000,  # avisar en el log si una exportación dura más
+})
+
+# Migraciones del esquema (flask --app main migrar)
+MIGRATION_CONFIG = _con_entorno("MIGRATION_", {
+    "LOCK_TIMEOUT": "5s",          # espera máxima por un bloqueo en migraciones transaccionales (después fallan)
+})
+
+# Modo asyncio (python asgi.py, ver app/asgi.py): subidas, eliminaciones y escrituras con asyncpg y httpx
+# en un bucle de eventos por proceso; el resto de rutas las sigue atendiendo Flask en WSGI_THREADS hilos.
+# Cada worker abre como mucho DB_POOL_MAX conexiones asyncpg además del pool de Flask (DB_CONFIG).
+ASGI_CONFIG = _con_entorno("ASGI_", {
+    "DB_POOL_MIN": 1,              # conexiones asyncpg abiertas al arrancar
+    "DB_POOL_MAX": 10,             # conexiones asyncpg máximas por proceso
+    "GRAPH_MAX_CONNECTIONS": 100,  # conexiones simultáneas con Graph por proceso
+    "MAX_CONCURRENT_UPLOADS": 32,  # subidas a SharePoint simultáneas por proceso (cada una con un fragmento en memoria)
+    "WSGI_THREADS": 8,             # hilos para las rutas que atiende Flask
+})
+
+# Métricas (GET /metrics en formato Prometheus) y cabecera Server-Timing con el desglose de cada petición.
+# Cada proceso vuelca sus métricas en DIR cada FLUSH_INTERVAL segundos; /metrics suma las de todos los workers.
+METRICS_CONFIG = _con_entorno("METRICS_", {
+    "ENABLED": True,               # medir y exponer /metrics (False: sin medición ni cabecera)
+    "SERVER_TIMING": True,         # cabecera Server-Timing en las respuestas
+    "DIR": "/tmp/autodoc-metrics",  # métricas de cada proceso (se vacía al arrancar el servidor)
+    "FLUSH_INTERVAL": 5,           # segundos entre volcados de las métricas de un proceso
+    "BUCKETS": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],  # límites de los histogramas (s)
+})
+
+# Consultas lentas: las que superan THRESHOLD_MS se registran en el log (nombre en queries.py, SQL normalizado,
+# hash de los parámetros, duración y filas). De una muestra se guarda el plan (EXPLAIN) en PLAN_FILE.
+SLOW_QUERY_CONFIG = _con_entorno("SLOW_QUERY_", {
+    "THRESHOLD_MS": 200,           # duración a partir de la cual una consulta es lenta
+    "EXPLAIN_SAMPLE": 0.1,         # fracción de las consultas lentas de las que se captura el plan (0 = ninguna)
+    "EXPLAIN_INTERVAL": 600,       # segundos mínimos entre dos planes de la misma consulta
+    "EXPLAIN_TIMEOUT_MS": 10000,   # statement_timeout del EXPLAIN ANALYZE (vuelve a ejecutar la consulta)
+    "PLAN_FILE": "/tmp/autodoc-planes.log",  # archivo de planes (rotativo)
+    "PLAN_FILE_MAX_BYTES": 10 * 1024 * 1024,
+    "PLAN_FILE_BACKUPS": 5,        # archivos anteriores que se conservan al rotar
+})
+
+# Perfilador bajo demanda (ver app/utils/perfilador.py): perfila con cProfile la petición que lleve la cabecera
+# HEADER con uno de SECRETS, o una fracción SAMPLE de todas. Sin SECRETS ni SAMPLE no cuesta nada por petición.
+PROFILER_CONFIG = _con_entorno("PROFILER_", {
+    "SECRETS": [],                 # secretos aceptados en la cabecera (separados por comas; también para /perfiles)
+    "HEADER": "X-Autodoc-Profile",
+    "SAMPLE": 0.0,                 # fracción de peticiones que se perfilan sin pedirlo (0 = ninguna)
+    "DIR": "/tmp/autodoc-perfiles",  # perfiles de todos los workers (formato pstats)
+    "MAX_FILES": 50,               # perfiles que se conservan (se borran los más antiguos)
+})
+
+# Descarga de documentos (GET /proyectos/<id>/documentos/<id>/contenido): los archivos se sirven desde una caché
+# en disco (LRU acotada a MAX_BYTES, compartida por los workers) por id de SharePoint + eTag.
+# Los metadatos de Graph (eTag, tamaño, URL de descarga) se reutilizan durante METADATA_TTL segundos.
+CONTENT_CACHE_CONFIG = _con_entorno("CONTENT_CACHE_", {
+    "DIR": "/tmp/autodoc-contenido",  # archivos cacheados (se conservan entre reinicios)
+    "MAX_BYTES": 2 * 1024 ** 3,    # tamaño máximo de la caché (0 = sin caché: todo se descarga de Graph)
+    "MAX_FILE_BYTES": 200 * 1024 ** 2,  # los archivos más grandes no se cachean, se envían directamente desde Graph
+    "METADATA_TTL": 60,            # segundos que se reutilizan los metadatos de un archivo sin preguntar a Graph
+    "METADATA_MAX_ENTRIES": 10000,  # metadatos en memoria por proceso
+    "CHUNK_SIZE": 1024 * 1024,     # bytes por bloque al descargar de Graph
+})
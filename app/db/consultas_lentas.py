@@ -0,0 +1,332 @@
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+import psycopg2
+
+from app.config.config import DB_CONFIG, SLOW_QUERY_CONFIG
+from app.db import queries
+from app.utils import metricas
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Coste de las consultas (ver _Preparado.execute en repositorio.py y ConsultasAsync en repositorio_async.py):
+# - Cada ejecución suma llamadas, tiempo y filas a su consulta (en las métricas, así se agregan todos los workers).
+# - Las que superan THRESHOLD_MS se registran en el log con su nombre en queries.py, el SQL normalizado,
+#   un hash de los parámetros (sin escribir los valores), la duración y las filas.
+# - De una muestra de las lentas se guarda el plan (EXPLAIN) en un archivo rotativo, desde un hilo
+#   con su propia conexión: la petición no espera al EXPLAIN ni le quita una conexión al pool.
+
+UMBRAL = SLOW_QUERY_CONFIG["THRESHOLD_MS"] / 1000
+
+# Literales (cadenas, números, NULL/TRUE/FALSE) y parámetros (%s, %(nombre)s) se normalizan a "?"
+_LITERAL = re.compile(r"(?:\bE)?'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\b(?:NULL|TRUE|FALSE)\b|%\(\w+\)s|%s", re.IGNORECASE)
+# Listas de valores "VALUES (?, ?), (?, ?)" (execute_values) -> "VALUES ?", igual que en la consulta original
+_TUPLA = r"\(\s*\?(?:::\w+)?(?:\s*,\s*\?(?:::\w+)?)*\s*\)"
+_LISTA = re.compile(rf"\bVALUES\s*{_TUPLA}(?:\s*,\s*{_TUPLA})*", re.IGNORECASE)
+_ESPACIOS = re.compile(r"\s+")
+# Consultas que modifican datos o bloquean filas: su plan se captura sin ANALYZE (no se vuelven a ejecutar)
+_ESCRITURA = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CALL)\b|\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b",
+                        re.IGNORECASE)
+
+
+def normalizar(sql):
+    """
+    SQL en una línea, sin valores: los literales y parámetros pasan a "?" y las listas de VALUES a un solo "?".
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _ESPACIOS.sub(" ", sql).strip().rstrip(";").strip().replace("%%", "%")
+    return _LISTA.sub("VALUES ?", _LITERAL.sub("?", sql))
+
+
+# Texto de la consulta -> nombre de su constante en queries.py
+_nombres = {}
+# SQL normalizado -> nombre (consultas que llegan ya con los valores, p. ej. las de execute_values)
+_nombres_normalizados = {}
+# Nombre -> SQL normalizado de la constante (para el resumen)
+_sql_por_nombre = {}
+# Plantilla con {columnas} -> nombre
+_plantillas = {}
+_MAX_SIN_NOMBRE = 1000  # consultas sin constante que se recuerdan (el resto se normaliza cada vez)
+_sin_nombre = {}
+
+
+def _registrar_constantes(modulo):
+    for nombre, valor in vars(modulo).items():
+        if not nombre.isupper() or not isinstance(valor, str):
+            continue
+        if "{columnas}" in valor:
+            _plantillas[valor] = nombre
+            _sql_por_nombre[nombre] = normalizar(valor)
+            continue
+        _nombres[valor] = nombre
+        normalizada = normalizar(valor)
+        _nombres_normalizados.setdefault(normalizada, nombre)
+        _sql_por_nombre[nombre] = normalizada
+
+
+_registrar_constantes(queries)
+
+
+def registrar_proyeccion(plantilla, sql):
+    """
+    Una consulta proyectada (ver repositorio.proyectar) se identifica con el nombre de su plantilla.
+    """
+    nombre = _plantillas.get(plantilla)
+    if nombre is not None:
+        _nombres[sql] = nombre
+
+
+def nombre_consulta(query):
+    """
+    Nombre de la constante de queries.py, o el SQL normalizado si la consulta no es una constante.
+    """
+    if isinstance(query, str):
+        nombre = _nombres.get(query)
+        if nombre is not None:
+            return nombre
+        nombre = _sin_nombre.get(query)
+        if nombre is not None:
+            return nombre
+    normalizada = normalizar(query)
+    nombre = _nombres_normalizados.get(normalizada, normalizada[:200])
+    if isinstance(query, str) and len(_sin_nombre) < _MAX_SIN_NOMBRE:
+        _sin_nombre[query] = nombre
+    return nombre
+
+
+def hash_parametros(params):
+    """
+    Identifica los valores de los parámetros sin escribirlos en el log (mismos valores, mismo hash).
+    """
+    if params is None:
+        return "-"
+    return hashlib.sha256(repr(params).encode("utf-8", "replace")).hexdigest()[:12]
+
+
+def registrar(query, params, duracion, filas):
+    """
+    Anota una ejecución: tiempo de la BBDD de la petición, estadísticas de la consulta y, si es lenta,
+    aviso en el log y (según la muestra) captura de su plan.
+    """
+    metricas.anotar(metricas.DB, duracion)
+    if not metricas.ENABLED and duracion < UMBRAL:
+        return
+    nombre = nombre_consulta(query)
+    etiqueta = (("query", nombre),)
+    metricas.contar("autodoc_db_query_calls_total", etiqueta)
+    metricas.contar("autodoc_db_query_seconds_total", etiqueta, duracion)
+    if filas is not None and filas > 0:
+        metricas.contar("autodoc_db_query_rows_total", etiqueta, filas)
+    if duracion < UMBRAL:
+        return
+
+    metricas.contar("autodoc_db_slow_queries_total", etiqueta)
+    # Con execute_values los valores van dentro de la consulta: el hash es el de la consulta completa
+    huella = hash_parametros(query if params is None and isinstance(query, bytes) else params)
+    sql = normalizar(query)
+    logger.warning(f"[DB] Slow query {nombre}: {duracion * 1000:.0f}ms, {filas} rows, params {huella}: {sql[:1000]}")
+    if _muestrear(nombre):
+        _capturador().encolar(nombre, query, params, duracion, filas, huella)
+
+
+# ------------------ Captura de planes ------------------ #
+_ultimo_plan = {}  # nombre -> time.monotonic() del último plan capturado
+_muestreo_lock = threading.Lock()
+
+
+def _muestrear(nombre):
+    """
+    True si se captura el plan de esta ejecución lenta: según EXPLAIN_SAMPLE
+    y como mucho uno por consulta cada EXPLAIN_INTERVAL segundos.
+    """
+    if random.random() >= SLOW_QUERY_CONFIG["EXPLAIN_SAMPLE"]:
+        return False
+    ahora = time.monotonic()
+    with _muestreo_lock:
+        ultimo = _ultimo_plan.get(nombre)
+        if ultimo is not None and ahora - ultimo < SLOW_QUERY_CONFIG["EXPLAIN_INTERVAL"]:
+            return False
+        _ultimo_plan[nombre] = ahora
+    return True
+
+
+class CapturadorPlanes:
+    """
+    Hilo que ejecuta EXPLAIN de las consultas lentas muestreadas con su propia conexión y guarda el plan
+    en PLAN_FILE (rotativo). Las consultas de solo lectura con EXPLAIN (ANALYZE, BUFFERS): se vuelven a
+    ejecutar, en una transacción de solo lectura y con statement_timeout. Las escrituras solo con EXPLAIN
+    (el plan estimado), sin ejecutarlas. Si la cola está llena, el plan se descarta.
+    """
+
+    def __init__(self, config=SLOW_QUERY_CONFIG, db_config=DB_CONFIG, max_pendientes=20):
+        self.config = config
+        self.db_config = db_config
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._conn = None
+        self._archivo = None
+        self._hilo = threading.Thread(target=self._bucle, name="planes-consultas", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, nombre, query, params, duracion, filas, huella):
+        try:
+            self._cola.put_nowait((nombre, query, params, duracion, filas, huella))
+        except queue.Full:
+            logger.debug(f"[DB] Plan queue full, skipping plan for {nombre}.")
+
+    def detener(self):
+        self._cola.put(None)
+        self._hilo.join(timeout=self.config["EXPLAIN_TIMEOUT_MS"] / 1000 + 5)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _bucle(self):
+        while True:
+            tarea = self._cola.get()
+            if tarea is None:
+                return
+            try:
+                self._capturar(*tarea)
+            except Exception as e:
+                logger.warning(f"[DB] Could not capture plan for {tarea[0]}: {e}")
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.close()
+                self._conn = None
+
+    def _conexion(self):
+        if self._conn is None or self._conn.closed:
+            config = self.db_config
+            self._conn = psycopg2.connect(
+                host=config["DB_HOST"], port=config.get("DB_PORT", 5432), dbname=config["DB_NAME"],
+                user=config["DB_USER"], password=config["DB_PASS"], connect_timeout=config.get("DB_CONN_TIMEOUT", 10),
+                application_name="autodoc-planes",
+            )
+        return self._conn
+
+    def _salida(self):
+        if self._archivo is None:
+            archivo = logging.getLogger("autodoc.planes")
+            archivo.propagate = False  # los planes solo van al archivo
+            archivo.setLevel(logging.INFO)
+            os.makedirs(os.path.dirname(self.config["PLAN_FILE"]) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.config["PLAN_FILE"], maxBytes=self.config["PLAN_FILE_MAX_BYTES"],
+                backupCount=self.config["PLAN_FILE_BACKUPS"], encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            archivo.addHandler(handler)
+            self._archivo = archivo
+        return self._archivo
+
+    def _capturar(self, nombre, query, params, duracion, filas, huella):
+        texto = query.decode("utf-8", "replace") if isinstance(query, bytes) else query
+        analizar = not _ESCRITURA.search(texto)
+        opciones = "ANALYZE, BUFFERS" if analizar else "VERBOSE"
+        conn = self._conexion()
+        try:
+            with conn.cursor() as cursor:
+                if analizar:
+                    cursor.execute("SET TRANSACTION READ ONLY")
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", (str(self.config["EXPLAIN_TIMEOUT_MS"]),))
+                explain = f"EXPLAIN ({opciones}) "
+                cursor.execute(explain.encode() + query if isinstance(query, bytes) else explain + query, params)
+                plan = "\n".join(fila[0] for fila in cursor.fetchall())
+        finally:
+            conn.rollback()  # nunca se confirma nada de lo ejecutado por el EXPLAIN
+
+        self._salida().info(
+            f"{nombre} {duracion * 1000:.0f}ms, {filas} rows, params {huella} (EXPLAIN {opciones})\n"
+            f"{normalizar(query)}\n{plan}\n"
+        )
+        logger.info(f"[DB] Plan for slow query {nombre} saved to {self.config['PLAN_FILE']}.")
+
+
+_capturador_planes = None
+_capturador_lock = threading.Lock()
+
+
+def _capturador():
+    global _capturador_planes
+    if _capturador_planes is None:
+        with _capturador_lock:
+            if _capturador_planes is None:
+                _capturador_planes = CapturadorPlanes()
+    return _capturador_planes
+
+
+def detener_capturador():
+    """
+    Espera al plan en curso y cierra la conexión del capturador (ver funciones.cerrar_recursos).
+    """
+    global _capturador_planes
+    capturador, _capturador_planes = _capturador_planes, None
+    if capturador is not None:
+        capturador.detener()
+
+
+# Capturadores heredados del proceso padre en un fork (su conexión es del padre: no se cierra desde el hijo)
+_heredados = []
+
+
+def _reiniciar_tras_fork():
+    global _capturador_planes, _capturador_lock, _muestreo_lock
+    if _capturador_planes is not None:
+        _heredados.append(_capturador_planes)
+    _capturador_planes = None
+    _capturador_lock = threading.Lock()
+    _muestreo_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+# ------------------ Resumen (GET /db-stats/consultas) ------------------ #
+ORDENES = {
+    "total": lambda c: c["total_ms"],
+    "media": lambda c: c["media_ms"],
+    "llamadas": lambda c: c["llamadas"],
+    "lentas": lambda c: c["lentas"],
+}
+
+
+def resumen(limit=20, orden="total"):
+    """
+    Las `limit` consultas con más tiempo total (o media, llamadas, lentas) sumando todos los workers.
+    """
+    contadores, _, _ = metricas.agregados()
+    por_consulta = {}
+    campos = {
+        "autodoc_db_query_calls_total": "llamadas",
+        "autodoc_db_query_seconds_total": "total",
+        "autodoc_db_query_rows_total": "filas",
+        "autodoc_db_slow_queries_total": "lentas",
+    }
+    for (metrica, etiquetas), valor in contadores.items():
+        campo = campos.get(metrica)
+        if campo is None:
+            continue
+        nombre = dict(etiquetas).get("query")
+        datos = por_consulta.setdefault(nombre, {"llamadas": 0, "total": 0.0, "filas": 0, "lentas": 0})
+        datos[campo] += valor
+
+    consultas = [
+        {
+            "consulta": nombre,
+            "sql": _sql_por_nombre.get(nombre, nombre),
+            "llamadas": int(datos["llamadas"]),
+            "total_ms": round(datos["total"] * 1000, 1),
+            "media_ms": round(datos["total"] / datos["llamadas"] * 1000, 2) if datos["llamadas"] else 0,
+            "filas": int(datos["filas"]),
+            "lentas": int(datos["lentas"]),
+        }
+        for nombre, datos in por_consulta.items()
+    ]
+    consultas.sort(key=ORDENES[orden], reverse=True)
+    return consultas[:limit]
@@ -0,0 +1,60 @@
+from collections import namedtuple
+
+
+class CamposInvalidos(ValueError):
+    """
+    Se lanza cuando el parámetro "fields" pide campos que no existen.
+    """
+
+
+class TipoFila:
+    """
+    Forma de una fila de la API: campo de la respuesta -> columna de la BBDD (en el orden de la respuesta).
+    Las filas se leen con un cursor de tuplas y se guardan como namedtuple (sin diccionario por fila);
+    `_asdict()` las convierte en el JSON de la API justo al serializar.
+    """
+
+    def __init__(self, nombre, columnas):
+        self.nombre = nombre
+        self.columnas = columnas
+        self._clases = {}  # campos -> clase namedtuple (una por combinación usada)
+
+    def proyeccion(self, fields=None, incluir=()):
+        """
+        Devuelve (clase de fila, columnas a seleccionar) para el parámetro "fields"
+        (lista separada por comas; todos los campos si no se indica).
+        `incluir` son campos que se seleccionan siempre (p. ej. la clave del cursor de paginación).
+        """
+        if fields is None:
+            pedidos = set(self.columnas)
+        else:
+            pedidos = {campo.strip() for campo in fields.split(",") if campo.strip()}
+            desconocidos = pedidos - self.columnas.keys()
+            if desconocidos:
+                raise CamposInvalidos(f"Campos no válidos en fields: {', '.join(sorted(desconocidos))}")
+            if not pedidos:
+                raise CamposInvalidos("El parámetro fields no puede estar vacío")
+        pedidos.update(incluir)
+
+        campos = tuple(campo for campo in self.columnas if campo in pedidos)
+        clase = self._clases.get(campos)
+        if clase is None:
+            clase = self._clases.setdefault(campos, namedtuple(self.nombre, campos))
+        return clase, tuple(self.columnas[campo] for campo in campos)
+
+
+PROYECTO = TipoFila("Proyecto", {
+    "idProyecto": "proyecto_id",
+    "nombre": "nombre",
+    "descripcion": "descripcion",
+    "proyecto_url": "proyecto_url",
+})
+
+DOCUMENTO = TipoFila("Documento", {
+    "idDocumento": "documento_id",
+    "idProyecto": "proyecto_id",
+    "nombre": "nombre",
+    "descripcion": "descripcion",
+    "url": "url",
+    "fecha": "fecha_creacion",
+})
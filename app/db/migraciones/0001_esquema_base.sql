@@ -0,0 +1,21 @@
+-- Esquema y tablas principales (las que crea app/db/postgres/data.sql en una BBDD nueva)
+CREATE SCHEMA IF NOT EXISTS autodoc;
+
+CREATE TABLE IF NOT EXISTS autodoc.proyectos (
+    proyecto_id SERIAL PRIMARY KEY,
+    nombre VARCHAR(150) NOT NULL,
+    descripcion TEXT,
+    proyecto_url VARCHAR(250),      -- URL pública de la carpeta
+    id_sharepoint VARCHAR(100),     -- ID de la carpeta en SharePoint
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS autodoc.documentos (
+    documento_id SERIAL PRIMARY KEY,
+    proyecto_id INT NOT NULL REFERENCES autodoc.proyectos(proyecto_id) ON DELETE CASCADE,
+    nombre VARCHAR(150) NOT NULL,
+    descripcion TEXT,
+    url VARCHAR(250),               -- URL del archivo en SharePoint/OneDrive
+    id_sharepoint VARCHAR(100),     -- ID del archivo en SharePoint
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
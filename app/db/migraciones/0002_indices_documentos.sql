@@ -0,0 +1,8 @@
+-- Índice de la clave ajena documentos.proyecto_id, ordenado como los listados de documentos.
+-- Lo usan GET /proyectos/<id>/documentos y /detalle (filtro, orden y cursor sin ordenar en memoria),
+-- la exportación y el ON DELETE CASCADE al eliminar un proyecto.
+-- migracion: sin-transaccion
+-- plan: SELECT documento_id FROM autodoc.documentos WHERE proyecto_id = 1 ORDER BY fecha_creacion, documento_id LIMIT 50
+-- plan: SELECT count(*) FROM autodoc.documentos WHERE proyecto_id = 1
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_documentos_proyecto_fecha
+    ON autodoc.documentos (proyecto_id, fecha_creacion, documento_id);
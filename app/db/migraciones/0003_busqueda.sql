@@ -0,0 +1,22 @@
+-- Búsqueda (GET /buscar) y filtro por nombre de GET /proyectos
+-- - unaccent: búsqueda sin tildes ("guia" encuentra "Guía")
+-- - pg_trgm: coincidencias parciales y con errores tipográficos sobre el nombre
+-- - tsvector en español: búsqueda por palabras (con raíces) en nombre + descripción
+-- migracion: sin-transaccion
+-- plan: SELECT proyecto_id FROM autodoc.proyectos WHERE autodoc.f_unaccent(lower(nombre)) LIKE autodoc.f_unaccent(lower('%manual%'))
+-- plan: SELECT documento_id FROM autodoc.documentos WHERE to_tsvector('spanish', autodoc.f_unaccent(coalesce(nombre, '') || ' ' || coalesce(descripcion, ''))) @@ websearch_to_tsquery('spanish', 'manual')
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION autodoc.f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_proyectos_nombre_trgm
+    ON autodoc.proyectos USING gin (autodoc.f_unaccent(lower(nombre)) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_proyectos_fts
+    ON autodoc.proyectos USING gin (to_tsvector('spanish', autodoc.f_unaccent(coalesce(nombre, '') || ' ' || coalesce(descripcion, ''))));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_documentos_nombre_trgm
+    ON autodoc.documentos USING gin (autodoc.f_unaccent(lower(nombre)) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_documentos_fts
+    ON autodoc.documentos USING gin (to_tsvector('spanish', autodoc.f_unaccent(coalesce(nombre, '') || ' ' || coalesce(descripcion, ''))));
@@ -0,0 +1,16 @@
+-- Cola de operaciones pendientes en SharePoint (modo asíncrono, GET /jobs/<id>)
+CREATE TABLE IF NOT EXISTS autodoc.outbox (
+    job_id BIGSERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',   -- pendiente, en_proceso, completado, error
+    intentos INT NOT NULL DEFAULT 0,
+    siguiente_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    bloqueado_hasta TIMESTAMP,
+    resultado JSONB,
+    error TEXT,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pendientes
+    ON autodoc.outbox (siguiente_intento) WHERE estado IN ('pendiente', 'en_proceso');
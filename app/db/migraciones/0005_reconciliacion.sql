@@ -0,0 +1,13 @@
+-- Reconciliación con SharePoint (consulta delta de Graph): estado por drive e índices por id de SharePoint
+-- migracion: sin-transaccion
+-- plan: SELECT documento_id FROM autodoc.documentos WHERE id_sharepoint = ANY(ARRAY['01ABCD1234'])
+CREATE TABLE IF NOT EXISTS autodoc.sharepoint_delta (
+    drive_id VARCHAR(200) PRIMARY KEY,
+    delta_link TEXT,                          -- cambios desde la última pasada completada
+    next_link TEXT,                           -- siguiente página de una pasada interrumpida
+    pendientes JSONB NOT NULL DEFAULT '{}',   -- elementos recién creados aplazados (id -> createdDateTime)
+    bloqueado_hasta TIMESTAMP,                -- pasada en curso (una sola a la vez)
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_proyectos_id_sharepoint ON autodoc.proyectos (id_sharepoint);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_documentos_id_sharepoint ON autodoc.documentos (id_sharepoint);
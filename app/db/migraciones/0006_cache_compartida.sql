@@ -0,0 +1,11 @@
+-- Caché de respuestas: invalidaciones compartidas entre los workers (ver app/utils/cache.py)
+CREATE TABLE IF NOT EXISTS autodoc.cache_generacion (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),   -- una sola fila
+    version BIGINT NOT NULL DEFAULT 0                 -- se incrementa en cada invalidación
+);
+INSERT INTO autodoc.cache_generacion (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+CREATE TABLE IF NOT EXISTS autodoc.cache_invalidaciones (
+    etiqueta VARCHAR(100) PRIMARY KEY,                -- p. ej. "proyectos", "proyecto:3", "documentos:3"
+    version BIGINT NOT NULL                           -- generación de su última invalidación
+);
+CREATE INDEX IF NOT EXISTS idx_cache_invalidaciones_version ON autodoc.cache_invalidaciones (version);
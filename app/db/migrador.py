@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import os
+import re
+import time
+
+from app.db import queries as db
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+MIGRACIONES_DIR = os.path.join(os.path.dirname(__file__), "migraciones")
+
+# 0002_indices_documentos.sql -> (2, "indices_documentos")
+_ARCHIVO = re.compile(r"^(\d+)_(\w+)\.sql$")
+# Directivas en comentarios: "-- migracion: sin-transaccion" y "-- plan: <consulta>"
+_DIRECTIVA = re.compile(r"^--\s*(migracion|plan):\s*(.+?)\s*$", re.MULTILINE)
+_DOLAR = re.compile(r"\$(\w*)\$")
+_INDICE = re.compile(r"\bINDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+class MigracionError(Exception):
+    """
+    Se lanza cuando una migración no se puede aplicar (o hay otra migración en curso).
+    """
+
+
+class Migracion:
+    """
+    Archivo NNNN_nombre.sql de app/db/migraciones.
+    - Por defecto se aplica en una transacción junto con su registro en autodoc.schema_migraciones.
+    - "-- migracion: sin-transaccion": cada sentencia se ejecuta por separado en autocommit
+      (necesario para CREATE INDEX CONCURRENTLY). Estas migraciones deben poder repetirse
+      (IF NOT EXISTS), porque si fallan a mitad quedan aplicadas en parte.
+    - "-- plan: <consulta>": consulta cuyo plan se muestra antes y después de aplicar la migración.
+    """
+
+    def __init__(self, version, nombre, sql):
+        self.version = version
+        self.nombre = nombre
+        self.sql = sql
+        self.checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        directivas = _DIRECTIVA.findall(sql)
+        self.transaccional = ("migracion", "sin-transaccion") not in directivas
+        self.planes = [valor for clave, valor in directivas if clave == "plan"]
+        self.indices = set(_INDICE.findall(sql))
+
+    def sentencias(self):
+        return dividir_sentencias(self.sql)
+
+    def __repr__(self):
+        return f"{self.version:04d}_{self.nombre}"
+
+
+def cargar_migraciones(directorio=MIGRACIONES_DIR):
+    """
+    Lee las migraciones del directorio, ordenadas por versión.
+    """
+    migraciones = {}
+    for archivo in sorted(os.listdir(directorio)):
+        match = _ARCHIVO.match(archivo)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migraciones:
+            raise MigracionError(f"Versión de migración repetida: {archivo}")
+        with open(os.path.join(directorio, archivo), encoding="utf-8") as f:
+            migraciones[version] = Migracion(version, match.group(2), f.read())
+    return [migraciones[v] for v in sorted(migraciones)]
+
+
+def dividir_sentencias(sql):
+    """
+    Separa un script SQL en sentencias por ";", sin cortar dentro de comentarios,
+    cadenas ('...'), identificadores ("...") ni cuerpos $$...$$ / $tag$...$tag$.
+    """
+    sentencias = []
+    actual = []
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if sql.startswith("--", i):
+            fin = sql.find("\n", i)
+            i = n if fin == -1 else fin + 1
+            actual.append("\n")
+            continue
+        if sql.startswith("/*", i):
+            fin = sql.find("*/", i + 2)
+            i = n if fin == -1 else fin + 2
+            continue
+        if c in ("'", '"'):
+            fin = i + 1
+            while fin < n:
+                if sql[fin] == c:
+                    if sql.startswith(c * 2, fin):  # comilla escapada ('' o "")
+                        fin += 2
+                        continue
+                    break
+                fin += 1
+            actual.append(sql[i:fin + 1])
+            i = fin + 1
+            continue
+        if c == "$":
+            match = _DOLAR.match(sql, i)
+            if match:
+                etiqueta = match.group(0)
+                fin = sql.find(etiqueta, i + len(etiqueta))
+                fin = n if fin == -1 else fin + len(etiqueta)
+                actual.append(sql[i:fin])
+                i = fin
+                continue
+        if c == ";":
+            sentencia = "".join(actual).strip()
+            if sentencia:
+                sentencias.append(sentencia)
+            actual = []
+        else:
+            actual.append(c)
+        i += 1
+    sentencia = "".join(actual).strip()
+    if sentencia:
+        sentencias.append(sentencia)
+    return sentencias
+
+
+def resumir_plan(plan):
+    """
+    Resume un plan de EXPLAIN (FORMAT JSON) en una línea: nodos que leen tablas o índices y coste total.
+    """
+    pasos = []
+
+    def recorrer(nodo):
+        tipo = nodo["Node Type"]
+        if "Index Name" in nodo:
+            pasos.append(f"{tipo} using {nodo['Index Name']}")
+        elif "Relation Name" in nodo:
+            pasos.append(f"{tipo} on {nodo['Relation Name']}")
+        for hijo in nodo.get("Plans", ()):
+            recorrer(hijo)
+
+    raiz = plan[0]["Plan"]
+    recorrer(raiz)
+    return f"{', '.join(pasos) or raiz['Node Type']} (coste {raiz['Total Cost']})"
+
+
+class Migrador:
+    """
+    Aplica en orden las migraciones pendientes (las que no están en autodoc.schema_migraciones).
+    - Un solo proceso a la vez (pg_try_advisory_lock).
+    - Las migraciones transaccionales usan lock_timeout: si una tabla está bloqueada,
+      fallan en vez de dejar esperando a las peticiones que llegan detrás.
+    - Antes de una migración sin transacción se eliminan los índices que esa migración crea y
+      quedaron inválidos (CREATE INDEX CONCURRENTLY interrumpido); si no, IF NOT EXISTS los daría por buenos.
+    - `informar(texto)` recibe el progreso (p. ej. click.echo).
+    """
+
+    def __init__(self, pool, config, migraciones=None, informar=None):
+        self.pool = pool
+        self.lock_timeout = config.get("LOCK_TIMEOUT", "5s")
+        self.migraciones = migraciones if migraciones is not None else cargar_migraciones()
+        self.informar = informar or logger.info
+
+    def ejecutar(self, dry_run=False, hasta=None):
+        """
+        Aplica las migraciones pendientes (hasta la versión `hasta`, si se indica) y devuelve las aplicadas.
+        Con dry_run solo muestra qué se ejecutaría y el plan actual de las consultas "-- plan:".
+        """
+        conn = self.pool.get_connection()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                if not dry_run:
+                    cursor.execute(db.SETUP_MIGRATIONS)
+                    cursor.execute(db.TRY_LOCK_MIGRATIONS)
+                    if not cursor.fetchone()["bloqueado"]:
+                        raise MigracionError("Ya hay otra migración en curso.")
+                try:
+                    pendientes = self._pendientes(cursor, hasta)
+                    if not pendientes:
+                        self.informar("No hay migraciones pendientes.")
+                    for migracion in pendientes:
+                        if dry_run:
+                            self._mostrar(cursor, migracion)
+                        else:
+                            self._aplicar(cursor, migracion)
+                    return pendientes
+                finally:
+                    if not dry_run:
+                        cursor.execute(db.UNLOCK_MIGRATIONS)
+        finally:
+            conn.autocommit = False
+            self.pool.release_connection(conn)
+
+    def _pendientes(self, cursor, hasta):
+        cursor.execute(db.MIGRATIONS_TABLE_EXISTS)
+        aplicadas = {}
+        if cursor.fetchone()["existe"]:
+            cursor.execute(db.GET_APPLIED_MIGRATIONS)
+            aplicadas = {fila["version"]: fila for fila in cursor.fetchall()}
+
+        pendientes = []
+        for migracion in self.migraciones:
+            aplicada = aplicadas.get(migracion.version)
+            if aplicada is None:
+                if hasta is None or migracion.version <= hasta:
+                    pendientes.append(migracion)
+            elif aplicada["checksum"] != migracion.checksum:
+                self.informar(f"AVISO: {migracion!r} ha cambiado después de aplicarse (no se vuelve a ejecutar).")
+        return pendientes
+
+    def _planes(self, cursor, migracion):
+        planes = []
+        for consulta in migracion.planes:
+            try:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + consulta)
+                planes.append(resumir_plan(cursor.fetchone()["QUERY PLAN"]))
+            except Exception as e:  # p. ej. la función o la tabla aún no existen
+                planes.append(f"no disponible ({str(e).strip().splitlines()[0]})")
+        return planes
+
+    def _mostrar(self, cursor, migracion):
+        modo = "transacción" if migracion.transaccional else "sin transacción"
+        self.informar(f"[pendiente] {migracion!r} ({modo})")
+        for sentencia in migracion.sentencias():
+            lineas = sentencia.splitlines()
+            self.informar(f"    {lineas[0]}" + (" ..." if len(lineas) > 1 else ""))
+        for consulta, plan in zip(migracion.planes, self._planes(cursor, migracion)):
+            self.informar(f"    plan: {consulta}\n      actual: {plan}")
+
+    def _aplicar(self, cursor, migracion):
+        antes = self._planes(cursor, migracion)
+        self.informar(f"Aplicando {migracion!r}...")
+        inicio = time.perf_counter()
+
+        if migracion.transaccional:
+            cursor.execute("BEGIN")
+            try:
+                cursor.execute(db.SET_LOCK_TIMEOUT, (self.lock_timeout,))
+                cursor.execute(migracion.sql)
+                self._registrar(cursor, migracion, inicio)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        else:
+            self._descartar_indices_invalidos(cursor, migracion)
+            for sentencia in migracion.sentencias():
+                cursor.execute(sentencia)
+            cursor.execute(db.GET_INVALID_INDEXES)
+            invalidos = {fila["nombre"] for fila in cursor.fetchall()} & migracion.indices
+            if invalidos:
+                raise MigracionError(f"{migracion!r} dejó índices inválidos: {', '.join(sorted(invalidos))}")
+            self._registrar(cursor, migracion, inicio)
+
+        duracion = time.perf_counter() - inicio
+        logger.info(f"[MIGRATE] {migracion!r} applied in {duracion * 1000:.0f}ms.")
+        self.informar(f"  aplicada en {duracion:.2f}s")
+        for consulta, plan_antes, plan_despues in zip(migracion.planes, antes, self._planes(cursor, migracion)):
+            self.informar(f"  plan: {consulta}\n    antes:   {plan_antes}\n    después: {plan_despues}")
+
+    def _descartar_indices_invalidos(self, cursor, migracion):
+        cursor.execute(db.GET_INVALID_INDEXES)
+        for fila in cursor.fetchall():
+            if fila["nombre"] in migracion.indices:
+                self.informar(f"  eliminando índice inválido {fila['nombre']} (build interrumpido)")
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS autodoc."{fila["nombre"]}"')
+
+    @staticmethod
+    def _registrar(cursor, migracion, inicio):
+        duracion_ms = int((time.perf_counter() - inicio) * 1000)
+        cursor.execute(db.RECORD_MIGRATION, (migracion.version, migracion.nombre, migracion.checksum, duracion_ms))
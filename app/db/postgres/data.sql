@@ -1,3 +1,6 @@
+-- Inicialización de una BBDD nueva (docker-entrypoint-initdb.d).
+-- Los cambios de esquema se añaden también como migración en app/db/migraciones (flask --app main migrar).
+
 -- Crear esquema si no existe
 CREATE SCHEMA IF NOT EXISTS autodoc AUTHORIZATION autodoc_user;
 
@@ -22,6 +25,73 @@ CREATE TABLE IF NOT EXISTS autodoc.documentos (
     fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Índice para listar los documentos de un proyecto ordenados (paginación por cursor)
+-- En bases de datos ya creadas se aplica con: flask --app main migrar
+CREATE INDEX IF NOT EXISTS idx_documentos_proyecto_fecha
+    ON autodoc.documentos (proyecto_id, fecha_creacion, documento_id);
+
+-- Cola de operaciones pendientes en SharePoint (modo asíncrono, GET /jobs/<id>)
+-- En bases de datos ya creadas se aplica con: flask --app main migrar
+CREATE TABLE IF NOT EXISTS autodoc.outbox (
+    job_id BIGSERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',   -- pendiente, en_proceso, completado, error
+    intentos INT NOT NULL DEFAULT 0,
+    siguiente_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    bloqueado_hasta TIMESTAMP,
+    resultado JSONB,
+    error TEXT,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pendientes
+    ON autodoc.outbox (siguiente_intento) WHERE estado IN ('pendiente', 'en_proceso');
+
+-- Reconciliación con SharePoint (consulta delta de Graph): estado por drive e índices por id de SharePoint
+-- En bases de datos ya creadas se aplica con: flask --app main migrar
+CREATE TABLE IF NOT EXISTS autodoc.sharepoint_delta (
+    drive_id VARCHAR(200) PRIMARY KEY,
+    delta_link TEXT,                          -- cambios desde la última pasada completada
+    next_link TEXT,                           -- siguiente página de una pasada interrumpida
+    pendientes JSONB NOT NULL DEFAULT '{}',   -- elementos recién creados aplazados (id -> createdDateTime)
+    bloqueado_hasta TIMESTAMP,                -- pasada en curso (una sola a la vez)
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_proyectos_id_sharepoint ON autodoc.proyectos (id_sharepoint);
+CREATE INDEX IF NOT EXISTS idx_documentos_id_sharepoint ON autodoc.documentos (id_sharepoint);
+
+-- Búsqueda (GET /buscar): sin tildes, por palabras en español y por similitud del nombre
+-- En bases de datos ya creadas se aplica con: flask --app main migrar
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION autodoc.f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+CREATE INDEX IF NOT EXISTS idx_proyectos_nombre_trgm
+    ON autodoc.proyectos USING gin (autodoc.f_unaccent(lower(nombre)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_proyectos_fts
+    ON autodoc.proyectos USING gin (to_tsvector('spanish', autodoc.f_unaccent(coalesce(nombre, '') || ' ' || coalesce(descripcion, ''))));
+CREATE INDEX IF NOT EXISTS idx_documentos_nombre_trgm
+    ON autodoc.documentos USING gin (autodoc.f_unaccent(lower(nombre)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_documentos_fts
+    ON autodoc.documentos USING gin (to_tsvector('spanish', autodoc.f_unaccent(coalesce(nombre, '') || ' ' || coalesce(descripcion, ''))));
+
+-- Caché de respuestas: invalidaciones compartidas entre los workers (ver app/utils/cache.py)
+-- En bases de datos ya creadas se aplica con: flask --app main migrar
+CREATE TABLE IF NOT EXISTS autodoc.cache_generacion (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),   -- una sola fila
+    version BIGINT NOT NULL DEFAULT 0                 -- se incrementa en cada invalidación
+);
+INSERT INTO autodoc.cache_generacion (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+CREATE TABLE IF NOT EXISTS autodoc.cache_invalidaciones (
+    etiqueta VARCHAR(100) PRIMARY KEY,                -- p. ej. "proyectos", "proyecto:3", "documentos:3"
+    version BIGINT NOT NULL                           -- generación de su última invalidación
+);
+CREATE INDEX IF NOT EXISTS idx_cache_invalidaciones_version ON autodoc.cache_invalidaciones (version);
+
 -- Insertar datos de ejemplo en proyectos
 INSERT INTO autodoc.proyectos (nombre, descripcion, proyecto_url, id_sharepoint)
 VALUES 
@@ -1,21 +1,100 @@
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor  # Devuelve filas como diccionarios
+from collections import deque
+import contextvars
 import logging
+import os
+import threading
 import time
 
+from app.utils import metricas
+
 logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
 
+
+# ------------------ Tiempo de retención de conexiones ------------------ #
+# Conexiones que tiene cada hilo en este momento (para detectar llamadas de red con una conexión tomada)
+_held_lock = threading.Lock()
+_held_by_thread = {}  # ident del hilo -> conexiones que tiene
+# Estadísticas de la request en curso (ver start_hold_tracking)
+_request_hold = contextvars.ContextVar("db_request_hold", default=None)
+
+
+def start_hold_tracking():
+    """
+    Empieza a medir cuánto tiempo retiene conexiones la request actual.
+    Devuelve el diccionario que se irá rellenando (conexiones, tiempo total y máximo, I/O con conexión).
+    """
+    stats = {"count": 0, "total": 0.0, "max": 0.0, "io": 0}
+    _request_hold.set(stats)
+    return stats
+
+
+def connections_held():
+    """
+    Número de conexiones del pool que tiene el hilo actual.
+    """
+    with _held_lock:
+        return _held_by_thread.get(threading.get_ident(), 0)
+
+
+def note_io(descripcion):
+    """
+    Avisa si el hilo actual va a hacer una llamada de red (p. ej. a Graph) con una conexión tomada.
+    Una conexión retenida durante I/O externo deja al resto de peticiones sin conexiones libres.
+    """
+    if not connections_held():
+        return False
+    logger.warning(f"[DB] Network call while holding a DB connection: {descripcion}")
+    stats = _request_hold.get()
+    if stats is not None:
+        stats["io"] += 1
+    return True
+
+
+def _reiniciar_tras_fork():
+    """
+    En el proceso hijo de un fork: los hilos del padre (y sus conexiones) no existen aquí.
+    """
+    global _held_lock, _held_by_thread
+    _held_lock = threading.Lock()
+    _held_by_thread = {}
+
+
+os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def _track(ident, delta):
+    with _held_lock:
+        count = _held_by_thread.get(ident, 0) + delta
+        if count > 0:
+            _held_by_thread[ident] = count
+        else:
+            _held_by_thread.pop(ident, None)
+
+
+class PoolTimeoutError(Exception):
+    """
+    Se lanza cuando no se consigue una conexión libre dentro del timeout configurado.
+    """
+
+
 class PsqlConnectionPool:
     """
     Clase para manejar un pool de conexiones a PostgreSQL.
     Esto evita abrir/cerrar conexiones constantemente, mejora eficiencia y rendimiento.
+    - Se crea una única vez por proceso (ver get_db_pool en funciones.py).
+    - Si no hay conexiones libres, las peticiones esperan en una cola FIFO
+      hasta que otra devuelva su conexión o venza el timeout.
     """
-    _pool = None  # Variable de clase para guardar el pool de conexiones
 
-    def __init__(self, config):
+    def __init__(self, config, cursor_factory=RealDictCursor, connection_factory=None):
         """
         Inicializa la configuración de la conexión desde un diccionario.
+        `cursor_factory` / `connection_factory` permiten usar cursores y conexiones propios
+        (p. ej. los de sentencias preparadas de app/db/repositorio.py).
         """
         self.user = config["DB_USER"]
         self.password = config["DB_PASS"]
@@ -24,65 +103,192 @@ class PsqlConnectionPool:
         self.database = config["DB_NAME"]
         self.pool_min = config.get("DB_POOL_MIN", 1)  # conexiones mínimas en el pool
         self.pool_max = config.get("DB_POOL_MAX", 5)  # conexiones máximas en el pool
-        self.retries = config.get("DB_CONN_RETRIES", 3)  # reintentos si falla la conexión
-        self.timeout = config.get("DB_CONN_TIMEOUT", 10)  # timeout en segundos
+        self.acquire_timeout = config.get("DB_POOL_TIMEOUT", 10)  # espera máxima por una conexión libre
+        self.pre_ping = config.get("DB_POOL_PRE_PING", True)  # comprobar conexión antes de entregarla
+        self.timeout = config.get("DB_CONN_TIMEOUT", 10)  # timeout de conexión en segundos
+        self.cursor_factory = cursor_factory
+        self.connection_factory = connection_factory
+        self.hold_warn = config.get("DB_HOLD_WARN_MS", 500) / 1000  # avisar si una conexión se retiene más
+
+        self._pool = None  # ThreadedConnectionPool de psycopg2
+        self._lock = threading.Lock()
+        self._in_use = 0  # conexiones entregadas (o reservadas para un waiter)
+        self._waiters = deque()  # cola FIFO de peticiones esperando conexión
+        self._checkouts = {}  # id(conn) -> (inicio, hilo, estadísticas de la request)
+        self._hold = {"count": 0, "total": 0.0, "max": 0.0}  # retención acumulada del proceso
 
     def connect(self):
         """
         Crea el pool de conexiones si no existe.
         """
-        if self._pool is not None:
-            # Ya existe el pool, no hacemos nada
-            return
+        with self._lock:
+            if self._pool is not None:
+                # Ya existe el pool, no hacemos nada
+                return
 
-        # Creamos un ThreadedConnectionPool
-        self._pool = psycopg2.pool.ThreadedConnectionPool(
-            self.pool_min,
-            self.pool_max,
-            user=self.user,
-            password=self.password,
-            host=self.host,
-            port=self.port,
-            database=self.database,
-            connect_timeout=self.timeout,
-            cursor_factory=RealDictCursor  # Para que devuelva filas como diccionarios
-        )
+            # Creamos un ThreadedConnectionPool
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                self.pool_min,
+                self.pool_max,
+                user=self.user,
+                password=self.password,
+                host=self.host,
+                port=self.port,
+                database=self.database,
+                connect_timeout=self.timeout,
+                cursor_factory=self.cursor_factory,  # Por defecto devuelve filas como diccionarios
+                connection_factory=self.connection_factory,
+            )
         logger.info("[DB] Connection pool created.")
 
-    def get_connection(self):
+    def _acquire_slot(self, timeout):
+        """
+        Reserva un hueco en el pool. Si está lleno, espera en la cola FIFO.
+        Las conexiones liberadas se entregan directamente al primer waiter,
+        así ninguna petición adelanta a otra que llevaba más tiempo esperando.
+        """
+        with self._lock:
+            if self._in_use < self.pool_max and not self._waiters:
+                self._in_use += 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        if waiter.wait(timeout):
+            return  # release_connection nos ha cedido su hueco
+
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                # Se nos cedió el hueco justo al vencer el timeout: lo usamos
+                return
+        raise PoolTimeoutError(
+            f"No hay conexiones libres en el pool tras esperar {timeout}s "
+            f"({self.pool_max} en uso, {len(self._waiters)} en espera)."
+        )
+
+    def _release_slot(self):
+        """
+        Libera un hueco del pool o se lo cede al primer waiter de la cola.
+        """
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._in_use -= 1
+
+    def _ping(self, conn):
+        """
+        Comprueba que la conexión sigue viva (pre-ping).
+        """
+        if conn.closed:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            # Cursor simple: el ping cuenta como espera por la conexión, no como consulta
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()  # No dejar la transacción del ping abierta
+            return True
+        except psycopg2.Error:
+            return False
+
+    def get_connection(self, timeout=None):
         """
         Obtiene una conexión del pool.
-        Reintenta varias veces si hay errores temporales.
+        Espera en la cola hasta `timeout` segundos (DB_POOL_TIMEOUT por defecto)
+        y descarta las conexiones caídas antes de entregarlas.
         """
         if self._pool is None:
             self.connect()  # Crear pool si no existe
 
-        for attempt in range(self.retries):
-            try:
-                conn = self._pool.getconn()  # Obtener conexión del pool
-                return conn
-            except Exception as e:
-                logger.warning(f"[DB] Connection attempt {attempt + 1} failed: {e}")
-                time.sleep(1)  # Espera 1 segundo antes de reintentar
+        inicio = time.perf_counter()
+        self._acquire_slot(self.acquire_timeout if timeout is None else timeout)
+        try:
+            conn = self._pool.getconn()  # Obtener conexión del pool
+            if not self._ping(conn):
+                logger.warning("[DB] Stale connection discarded, reconnecting.")
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._release_slot()
+            raise
+        ident = threading.get_ident()
+        ahora = time.perf_counter()
+        with self._lock:
+            self._checkouts[id(conn)] = (ahora, ident, _request_hold.get())
+        _track(ident, 1)
+        metricas.anotar(metricas.DB_POOL, ahora - inicio)  # espera en la cola + pre-ping
+        return conn
 
-        raise Exception("Could not get DB connection after retries.")
+    def _record_hold(self, conn):
+        """
+        Registra cuánto tiempo ha estado tomada la conexión (proceso y request que la pidió).
+        """
+        with self._lock:
+            checkout = self._checkouts.pop(id(conn), None)
+        if checkout is None:
+            return
+        inicio, ident, request_stats = checkout
+        elapsed = time.perf_counter() - inicio
+        _track(ident, -1)
+        with self._lock:
+            self._hold["count"] += 1
+            self._hold["total"] += elapsed
+            self._hold["max"] = max(self._hold["max"], elapsed)
+        if request_stats is not None:
+            request_stats["count"] += 1
+            request_stats["total"] += elapsed
+            request_stats["max"] = max(request_stats["max"], elapsed)
+        if elapsed > self.hold_warn:
+            logger.warning(f"[DB] Connection held for {elapsed * 1000:.0f}ms.")
 
     def release_connection(self, conn):
         """
         Devuelve la conexión al pool.
         """
         if self._pool and conn:
-            self._pool.putconn(conn)
+            self._record_hold(conn)
+            close = bool(conn.closed)
+            if not close and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                # No devolver al pool conexiones con transacciones a medias
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+            self._pool.putconn(conn, close=close)
+            self._release_slot()
             logger.debug("[DB] Connection released back to pool.")
 
+    def stats(self):
+        """
+        Devuelve el estado actual del pool (conexiones en uso, abiertas sin usar y peticiones en espera)
+        y el tiempo de retención de las conexiones (medio y máximo).
+        """
+        pool_psycopg = self._pool
+        with self._lock:
+            hold = self._hold
+            return {
+                "max": self.pool_max,
+                "in_use": self._in_use,
+                "idle": len(pool_psycopg._pool) if pool_psycopg is not None else 0,
+                "waiters": len(self._waiters),
+                "hold_count": hold["count"],
+                "hold_avg_ms": round(hold["total"] / hold["count"] * 1000, 2) if hold["count"] else 0,
+                "hold_max_ms": round(hold["max"] * 1000, 2),
+            }
+
     def close_all(self):
         """
         Cierra todas las conexiones del pool.
         """
-        if self._pool:
-            self._pool.closeall()
-            self._pool = None
-            logger.info("[DB] All connections closed.")
+        with self._lock:
+            if self._pool:
+                self._pool.closeall()
+                self._pool = None
+                logger.info("[DB] All connections closed.")
 
     # ------------------ Helpers para consultas ------------------ #
     @staticmethod
@@ -105,15 +311,16 @@ class PsqlConnectionPool:
 from contextlib import contextmanager
 
 @contextmanager
-def db_cursor(pool: PsqlConnectionPool):
+def db_cursor(pool: PsqlConnectionPool, cursor_factory=None):
     """
     Context manager para manejar conexión y cursor de forma automática.
     - Hace commit si todo va bien
     - Hace rollback si hay error
     - Devuelve el cursor listo para ejecutar consultas
+    - `cursor_factory` cambia el tipo de cursor (por defecto, el del pool)
     """
     conn = pool.get_connection()   # Obtener conexión del pool
-    cursor = conn.cursor()         # Crear cursor
+    cursor = conn.cursor(cursor_factory=cursor_factory)  # Crear cursor
     try:
         yield cursor               # Se usa en bloque with
         conn.commit()              # Commit automático al finalizar el bloque
@@ -1,12 +1,34 @@
+# Las consultas de lectura de la API llevan la lista de columnas como {columnas}:
+# se rellena con repositorio.proyectar() según el parámetro "fields" (ver app/db/filas.py).
+
 # ----------------- PROYECTOS -----------------
 # Obtener todos los proyectos
-GET_ALL_PROJECTS = "SELECT * FROM autodoc.proyectos;"
+GET_ALL_PROJECTS = "SELECT {columnas} FROM autodoc.proyectos ORDER BY proyecto_id;"
+
+# Obtener un proyecto por su nombre (coincidencia parcial, sin distinguir mayúsculas ni tildes)
+# Usa el índice trigram idx_proyectos_nombre_trgm
+GET_PROJECT_BY_NAME = """
+    SELECT {columnas} FROM autodoc.proyectos
+    WHERE autodoc.f_unaccent(lower(nombre)) LIKE autodoc.f_unaccent(lower(%s))
+    ORDER BY proyecto_id;
+"""
 
-# Obtener un proyecto por su nombre (coincidencia parcial)
-GET_PROJECT_BY_NAME = "SELECT * FROM autodoc.proyectos WHERE nombre ILIKE %s;"
+# Obtener una página de proyectos (paginación por cursor: proyecto_id > último de la página anterior)
+GET_PROJECTS_PAGE = """
+    SELECT {columnas} FROM autodoc.proyectos
+    WHERE proyecto_id > %s
+    ORDER BY proyecto_id
+    LIMIT %s;
+"""
+GET_PROJECTS_BY_NAME_PAGE = """
+    SELECT {columnas} FROM autodoc.proyectos
+    WHERE autodoc.f_unaccent(lower(nombre)) LIKE autodoc.f_unaccent(lower(%s)) AND proyecto_id > %s
+    ORDER BY proyecto_id
+    LIMIT %s;
+"""
 
 # Obtener un proyecto por ID
-GET_PROJECT_BY_ID = "SELECT * FROM autodoc.proyectos WHERE proyecto_id = %s;"
+GET_PROJECT_BY_ID = "SELECT {columnas} FROM autodoc.proyectos WHERE proyecto_id = %s;"
 
 # Obtener url (id de sharepoint) de un proyecto por ID
 GET_PROJECT_URL_BY_ID = "SELECT proyecto_url, id_sharepoint FROM autodoc.proyectos WHERE proyecto_id = %s;"
@@ -22,33 +44,445 @@ UPDATE_PROJECT = """
     SET nombre = %s, descripcion = %s, proyecto_url = %s
     WHERE proyecto_id = %s;
 """
-# Eliminar un proyecto
-DELETE_PROJECT = "DELETE FROM autodoc.proyectos WHERE proyecto_id = %s;"
+# Eliminar un proyecto (solo si sigue enlazado a la carpeta leída antes de borrarla en SharePoint)
+DELETE_PROJECT_IF_UNCHANGED = """
+    DELETE FROM autodoc.proyectos
+    WHERE proyecto_id = %s AND id_sharepoint IS NOT DISTINCT FROM %s
+    RETURNING proyecto_id;
+"""
+
+# Obtener los IDs de SharePoint de varios proyectos (eliminación por lotes)
+GET_PROJECTS_SHAREPOINT_BY_IDS = """
+    SELECT proyecto_id, id_sharepoint FROM autodoc.proyectos
+    WHERE proyecto_id = ANY(%s);
+"""
+# Eliminar varios proyectos (sus documentos se eliminan en cascada)
+DELETE_PROJECTS = "DELETE FROM autodoc.proyectos WHERE proyecto_id = ANY(%s) RETURNING proyecto_id;"
 
 # ----------------- DOCUMENTOS -----------------
 # Obtener todos los documentos de un proyecto
-GET_DOCUMENTS_BY_PROJECT = "SELECT * FROM autodoc.documentos WHERE proyecto_id = %s;"
+GET_DOCUMENTS_BY_PROJECT = """
+    SELECT {columnas} FROM autodoc.documentos
+    WHERE proyecto_id = %s
+    ORDER BY fecha_creacion, documento_id;
+"""
 
-# Obtener un documento por ID
+# Obtener una página de documentos de un proyecto (cursor: fecha_creacion + documento_id)
+# Usa el índice idx_documentos_proyecto_fecha (proyecto_id, fecha_creacion, documento_id)
+GET_DOCUMENTS_BY_PROJECT_FIRST_PAGE = """
+    SELECT {columnas} FROM autodoc.documentos
+    WHERE proyecto_id = %s
+    ORDER BY fecha_creacion, documento_id
+    LIMIT %s;
+"""
+GET_DOCUMENTS_BY_PROJECT_PAGE = """
+    SELECT {columnas} FROM autodoc.documentos
+    WHERE proyecto_id = %s AND (fecha_creacion, documento_id) > (%s::timestamp, %s)
+    ORDER BY fecha_creacion, documento_id
+    LIMIT %s;
+"""
+
+# Obtener todos los documentos (exportación; mismo orden que el índice idx_documentos_proyecto_fecha)
+EXPORT_DOCUMENTS = """
+    SELECT {columnas} FROM autodoc.documentos
+    ORDER BY proyecto_id, fecha_creacion, documento_id;
+"""
+
+# Obtener un documento por ID (fila completa, uso interno)
 GET_DOCUMENT_BY_ID = "SELECT * FROM autodoc.documentos WHERE documento_id = %s;"
+# Obtener un documento por ID (campos de la API)
+GET_DOCUMENT_FIELDS_BY_ID = "SELECT {columnas} FROM autodoc.documentos WHERE documento_id = %s;"
 
 # Crear un nuevo documento
 CREATE_DOCUMENT = """
     INSERT INTO autodoc.documentos (proyecto_id, nombre, descripcion, url, id_sharepoint)
     VALUES (%s, %s, %s, %s, %s) RETURNING documento_id;
 """
+# Crear varios documentos en una sola sentencia (psycopg2.extras.execute_values rellena VALUES %s)
+CREATE_DOCUMENTS_BATCH = """
+    INSERT INTO autodoc.documentos (proyecto_id, nombre, descripcion, url, id_sharepoint)
+    VALUES %s RETURNING documento_id, id_sharepoint;
+"""
+# Lo mismo con una lista por columna (modo asyncio: asyncpg no tiene execute_values)
+CREATE_DOCUMENTS_UNNEST = """
+    INSERT INTO autodoc.documentos (proyecto_id, nombre, descripcion, url, id_sharepoint)
+    SELECT %s, * FROM unnest(%s::varchar[], %s::text[], %s::varchar[], %s::varchar[])
+    RETURNING documento_id, id_sharepoint;
+"""
 # Actualizar un documento existente
 UPDATE_DOCUMENT = """
     UPDATE autodoc.documentos
     SET nombre = %s, descripcion = %s
-    WHERE documento_id = %s;
+    WHERE documento_id = %s
+    RETURNING proyecto_id;
 """
 UPDATE_DOCUMENT_URL = """
     UPDATE autodoc.documentos
     SET nombre = %s, descripcion = %s, url = %s
-    WHERE documento_id = %s;
+    WHERE documento_id = %s
+    RETURNING proyecto_id;
+"""
+
+
+# Eliminar un documento (solo si sigue enlazado al archivo leído antes de borrarlo en SharePoint)
+DELETE_DOCUMENT_IF_UNCHANGED = """
+    DELETE FROM autodoc.documentos
+    WHERE documento_id = %s AND id_sharepoint IS NOT DISTINCT FROM %s
+    RETURNING proyecto_id;
+"""
+
+# Obtener los IDs de SharePoint de varios documentos de un proyecto (eliminación por lotes)
+GET_DOCUMENTS_SHAREPOINT_BY_IDS = """
+    SELECT documento_id, id_sharepoint FROM autodoc.documentos
+    WHERE proyecto_id = %s AND documento_id = ANY(%s);
+"""
+# Eliminar varios documentos de un proyecto
+DELETE_DOCUMENTS = """
+    DELETE FROM autodoc.documentos
+    WHERE proyecto_id = %s AND documento_id = ANY(%s)
+    RETURNING documento_id;
+"""
+
+
+# ----------------- DETALLE DE PROYECTO -----------------
+# Proyecto + recuento de documentos + fecha del último cambio + una página de documentos, en una sola consulta.
+# - La página se pide con limit + 1 filas: hay_mas indica si hay otra y ultima_fecha/ultimo_id son la
+#   clave del cursor (la misma que usa GET_DOCUMENTS_BY_PROJECT_PAGE).
+# - Los documentos salen ya en JSON con los campos de la API; la fecha con el formato HTTP que usa Flask.
+# - Sin cursor, after_fecha/after_id son NULL y la comparación empieza en -infinity.
+GET_PROJECT_DETAIL = """
+    SELECT p.proyecto_id, p.nombre, p.descripcion, p.proyecto_url,
+           t.total_documentos,
+           GREATEST(p.fecha_creacion, t.ultimo_documento) AS ultima_modificacion,
+           coalesce(pag.documentos, '[]'::json) AS documentos,
+           pag.hay_mas, pag.ultima_fecha, pag.ultimo_id
+    FROM autodoc.proyectos p
+    CROSS JOIN LATERAL (
+        SELECT count(*) AS total_documentos, max(d.fecha_creacion) AS ultimo_documento
+        FROM autodoc.documentos d
+        WHERE d.proyecto_id = p.proyecto_id
+    ) t
+    CROSS JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                   'idDocumento', n.documento_id,
+                   'idProyecto', n.proyecto_id,
+                   'nombre', n.nombre,
+                   'descripcion', n.descripcion,
+                   'url', n.url,
+                   'fecha', to_char(n.fecha_creacion, 'Dy, DD Mon YYYY HH24:MI:SS "GMT"')
+               ) ORDER BY n.fila) FILTER (WHERE n.fila <= %(limit)s) AS documentos,
+               count(*) > %(limit)s AS hay_mas,
+               max(n.fecha_creacion) FILTER (WHERE n.fila = %(limit)s) AS ultima_fecha,
+               max(n.documento_id) FILTER (WHERE n.fila = %(limit)s) AS ultimo_id
+        FROM (
+            SELECT pagina.*, row_number() OVER (ORDER BY pagina.fecha_creacion, pagina.documento_id) AS fila
+            FROM (
+                SELECT d.documento_id, d.proyecto_id, d.nombre, d.descripcion, d.url, d.fecha_creacion
+                FROM autodoc.documentos d
+                WHERE d.proyecto_id = p.proyecto_id
+                  AND (d.fecha_creacion, d.documento_id)
+                      > (coalesce(%(after_fecha)s, '-infinity'::timestamp), coalesce(%(after_id)s, 0))
+                ORDER BY d.fecha_creacion, d.documento_id
+                LIMIT %(limit)s + 1
+            ) pagina
+        ) n
+    ) pag
+    WHERE p.proyecto_id = %(proyecto_id)s;
+"""
+
+
+# ----------------- BÚSQUEDA -----------------
+# Subconsultas de búsqueda por tabla. Las expresiones coinciden con las de los índices de la migración 0003
+# y el texto buscado va como parámetro (constante) para que el planificador pueda usar esos índices.
+# relevancia = rango de texto completo (x2) + similitud trigram del nombre
+_SEARCH_PROJECTS = """
+    SELECT 'proyecto' AS tipo, p.proyecto_id AS id, p.proyecto_id, p.nombre, p.descripcion,
+           p.proyecto_url AS url, p.fecha_creacion,
+           (ts_rank(to_tsvector('spanish', autodoc.f_unaccent(coalesce(p.nombre, '') || ' ' || coalesce(p.descripcion, ''))), websearch_to_tsquery('spanish', autodoc.f_unaccent(%(texto)s))) * 2
+            + similarity(autodoc.f_unaccent(lower(p.nombre)), autodoc.f_unaccent(lower(%(texto)s))))::float8 AS relevancia
+    FROM autodoc.proyectos p
+    WHERE to_tsvector('spanish', autodoc.f_unaccent(coalesce(p.nombre, '') || ' ' || coalesce(p.descripcion, ''))) @@ websearch_to_tsquery('spanish', autodoc.f_unaccent(%(texto)s))
+       OR autodoc.f_unaccent(lower(p.nombre)) %% autodoc.f_unaccent(lower(%(texto)s))
+       OR autodoc.f_unaccent(lower(p.nombre)) LIKE '%%' || autodoc.f_unaccent(lower(%(texto)s)) || '%%'
+"""
+_SEARCH_DOCUMENTS = """
+    SELECT 'documento' AS tipo, d.documento_id AS id, d.proyecto_id, d.nombre, d.descripcion,
+           d.url, d.fecha_creacion,
+           (ts_rank(to_tsvector('spanish', autodoc.f_unaccent(coalesce(d.nombre, '') || ' ' || coalesce(d.descripcion, ''))), websearch_to_tsquery('spanish', autodoc.f_unaccent(%(texto)s))) * 2
+            + similarity(autodoc.f_unaccent(lower(d.nombre)), autodoc.f_unaccent(lower(%(texto)s))))::float8 AS relevancia
+    FROM autodoc.documentos d
+    WHERE to_tsvector('spanish', autodoc.f_unaccent(coalesce(d.nombre, '') || ' ' || coalesce(d.descripcion, ''))) @@ websearch_to_tsquery('spanish', autodoc.f_unaccent(%(texto)s))
+       OR autodoc.f_unaccent(lower(d.nombre)) %% autodoc.f_unaccent(lower(%(texto)s))
+       OR autodoc.f_unaccent(lower(d.nombre)) LIKE '%%' || autodoc.f_unaccent(lower(%(texto)s)) || '%%'
+"""
+# Consulta completa: ordenada por relevancia y paginada por cursor (relevancia, tipo, id)
+_SEARCH_TEMPLATE = """
+    SELECT * FROM ({subconsultas}) r
+    WHERE %(after_relevancia)s::float8 IS NULL
+       OR (r.relevancia, r.tipo, r.id) < (%(after_relevancia)s::float8, %(after_tipo)s, %(after_id)s)
+    ORDER BY r.relevancia DESC, r.tipo DESC, r.id DESC
+    LIMIT %(limit)s;
+"""
+SEARCH_ALL = _SEARCH_TEMPLATE.format(subconsultas=_SEARCH_PROJECTS + " UNION ALL " + _SEARCH_DOCUMENTS)
+SEARCH_PROJECTS = _SEARCH_TEMPLATE.format(subconsultas=_SEARCH_PROJECTS)
+SEARCH_DOCUMENTS = _SEARCH_TEMPLATE.format(subconsultas=_SEARCH_DOCUMENTS)
+
+
+# ----------------- OUTBOX (OPERACIONES ASÍNCRONAS EN SHAREPOINT) -----------------
+# Encolar un job (se ejecuta en la misma transacción que el cambio en proyectos/documentos)
+ENQUEUE_OUTBOX_JOB = "INSERT INTO autodoc.outbox (tipo, payload) VALUES (%s, %s) RETURNING job_id;"
+
+# Reservar el siguiente job pendiente (o uno en proceso cuyo worker dejó de responder)
+# SKIP LOCKED permite que varios workers consuman la cola sin bloquearse entre sí
+CLAIM_OUTBOX_JOB = """
+    UPDATE autodoc.outbox
+    SET estado = 'en_proceso', intentos = intentos + 1,
+        bloqueado_hasta = now() + make_interval(secs => %s), fecha_actualizacion = now()
+    WHERE job_id = (
+        SELECT job_id FROM autodoc.outbox
+        WHERE (estado = 'pendiente' AND siguiente_intento <= now())
+           OR (estado = 'en_proceso' AND bloqueado_hasta < now())
+        ORDER BY siguiente_intento, job_id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING job_id, tipo, payload, intentos;
+"""
+# Renovar la reserva mientras el handler se ejecuta (latido del worker)
+# Completar, reprogramar y renovar solo si el job sigue reservado por este intento: si la reserva caducó
+# y otro worker lo volvió a reservar, no se pisa su estado (0 filas)
+RENEW_OUTBOX_LEASE = """
+    UPDATE autodoc.outbox
+    SET bloqueado_hasta = now() + make_interval(secs => %s), fecha_actualizacion = now()
+    WHERE job_id = %s AND estado = 'en_proceso' AND intentos = %s;
+"""
+COMPLETE_OUTBOX_JOB = """
+    UPDATE autodoc.outbox
+    SET estado = 'completado', resultado = %s, error = NULL, bloqueado_hasta = NULL, fecha_actualizacion = now()
+    WHERE job_id = %s AND estado = 'en_proceso' AND intentos = %s;
+"""
+# Reprogramar un job fallido, o marcarlo como error si ya no quedan intentos
+FAIL_OUTBOX_JOB = """
+    UPDATE autodoc.outbox
+    SET estado = CASE WHEN intentos >= %s THEN 'error' ELSE 'pendiente' END,
+        siguiente_intento = now() + make_interval(secs => %s),
+        error = %s, bloqueado_hasta = NULL, fecha_actualizacion = now()
+    WHERE job_id = %s AND estado = 'en_proceso' AND intentos = %s;
+"""
+GET_OUTBOX_JOB = """
+    SELECT job_id, tipo, estado, intentos, resultado, error, fecha_creacion, fecha_actualizacion
+    FROM autodoc.outbox WHERE job_id = %s;
+"""
+
+# Cambios en BBDD del modo asíncrono (SharePoint se actualiza después desde el worker)
+UPDATE_PROJECT_FIELDS = """
+    UPDATE autodoc.proyectos
+    SET nombre = %s, descripcion = %s
+    WHERE proyecto_id = %s
+    RETURNING id_sharepoint;
+"""
+UPDATE_PROJECT_SHAREPOINT = """
+    UPDATE autodoc.proyectos
+    SET proyecto_url = %s, id_sharepoint = %s
+    WHERE proyecto_id = %s;
+"""
+UPDATE_DOCUMENT_SHAREPOINT = """
+    UPDATE autodoc.documentos
+    SET url = %s, id_sharepoint = %s
+    WHERE documento_id = %s
+    RETURNING proyecto_id;
+"""
+DELETE_PROJECT_RETURNING = "DELETE FROM autodoc.proyectos WHERE proyecto_id = %s RETURNING id_sharepoint;"
+DELETE_DOCUMENT_RETURNING = """
+    DELETE FROM autodoc.documentos WHERE documento_id = %s
+    RETURNING proyecto_id, id_sharepoint;
+"""
+
+# ----------------- RECONCILIACIÓN CON SHAREPOINT (CONSULTA DELTA DE GRAPH) -----------------
+# Reservar la reconciliación de un drive (la fila se crea la primera vez)
+INIT_DELTA_STATE = "INSERT INTO autodoc.sharepoint_delta (drive_id) VALUES (%s) ON CONFLICT (drive_id) DO NOTHING;"
+CLAIM_DELTA_STATE = """
+    UPDATE autodoc.sharepoint_delta
+    SET bloqueado_hasta = now() + make_interval(secs => %s), fecha_actualizacion = now()
+    WHERE drive_id = %s AND (bloqueado_hasta IS NULL OR bloqueado_hasta < now())
+    RETURNING delta_link, next_link, pendientes, LOCALTIMESTAMP AS inicio;
+"""
+# Olvidar el deltaLink para recorrer el drive completo en la siguiente pasada
+RESET_DELTA_STATE = "UPDATE autodoc.sharepoint_delta SET delta_link = NULL, next_link = NULL WHERE drive_id = %s;"
+# Guardar el enlace para continuar (en la misma transacción que los cambios de la página)
+SAVE_DELTA_PROGRESS = """
+    UPDATE autodoc.sharepoint_delta
+    SET next_link = %s, pendientes = %s,
+        bloqueado_hasta = now() + make_interval(secs => %s), fecha_actualizacion = now()
+    WHERE drive_id = %s;
+"""
+SAVE_DELTA_LINK = """
+    UPDATE autodoc.sharepoint_delta
+    SET delta_link = %s, next_link = NULL, pendientes = %s, fecha_actualizacion = now()
+    WHERE drive_id = %s;
+"""
+RELEASE_DELTA_STATE = "UPDATE autodoc.sharepoint_delta SET bloqueado_hasta = NULL WHERE drive_id = %s;"
+
+# Cambios de una página de delta (execute_values rellena VALUES %s)
+DELTA_DELETE_PROJECTS = """
+    DELETE FROM autodoc.proyectos WHERE id_sharepoint = ANY(%s)
+    RETURNING proyecto_id;
+"""
+DELTA_DELETE_DOCUMENTS = """
+    DELETE FROM autodoc.documentos WHERE id_sharepoint = ANY(%s)
+    RETURNING documento_id, proyecto_id;
+"""
+DELTA_GET_PROJECTS = """
+    SELECT id_sharepoint, proyecto_id FROM autodoc.proyectos
+    WHERE id_sharepoint = ANY(%s);
+"""
+DELTA_GET_DOCUMENTS = """
+    SELECT id_sharepoint, documento_id, proyecto_id FROM autodoc.documentos
+    WHERE id_sharepoint = ANY(%s);
+"""
+DELTA_UPDATE_PROJECTS = """
+    UPDATE autodoc.proyectos AS p
+    SET nombre = v.nombre, proyecto_url = v.url
+    FROM (VALUES %s) AS v (id_sharepoint, nombre, url)
+    WHERE p.id_sharepoint = v.id_sharepoint
+      AND (p.nombre, p.proyecto_url) IS DISTINCT FROM (v.nombre, v.url)
+    RETURNING p.proyecto_id;
+"""
+DELTA_INSERT_PROJECTS = """
+    INSERT INTO autodoc.proyectos (nombre, proyecto_url, id_sharepoint)
+    VALUES %s RETURNING proyecto_id;
+"""
+# Solo se actualiza la URL (el nombre del documento es el que se puso en AutoDoc, no el del archivo)
+# y el proyecto si el archivo se ha movido a la carpeta de otro proyecto
+DELTA_UPDATE_DOCUMENTS = """
+    UPDATE autodoc.documentos AS d
+    SET url = v.url, proyecto_id = COALESCE(v.proyecto_id, d.proyecto_id)
+    FROM (VALUES %s) AS v (id_sharepoint, url, proyecto_id)
+    WHERE d.id_sharepoint = v.id_sharepoint
+      AND (d.url, d.proyecto_id) IS DISTINCT FROM (v.url, COALESCE(v.proyecto_id, d.proyecto_id))
+    RETURNING d.documento_id, d.proyecto_id;
+"""
+DELTA_INSERT_DOCUMENTS = """
+    INSERT INTO autodoc.documentos (proyecto_id, nombre, url, id_sharepoint)
+    VALUES %s RETURNING documento_id, proyecto_id;
+"""
+# Filas enlazadas con SharePoint anteriores a una pasada completa (para detectar las que ya no existen)
+DELTA_LINKED_ITEMS = """
+    SELECT id_sharepoint FROM autodoc.proyectos WHERE id_sharepoint IS NOT NULL AND fecha_creacion < %s
+    UNION ALL
+    SELECT id_sharepoint FROM autodoc.documentos WHERE id_sharepoint IS NOT NULL AND fecha_creacion < %s;
+"""
+
+
+# ----------------- CACHÉ DE RESPUESTAS (INVALIDACIONES ENTRE PROCESOS) -----------------
+# Publicar una invalidación: la generación se incrementa (y su fila queda bloqueada hasta el COMMIT,
+# así las versiones se confirman en orden) y cada etiqueta guarda la versión de su última invalidación
+PUBLISH_CACHE_INVALIDATION = """
+    WITH generacion AS (
+        UPDATE autodoc.cache_generacion SET version = version + 1 RETURNING version
+    )
+    INSERT INTO autodoc.cache_invalidaciones (etiqueta, version)
+    SELECT etiqueta, generacion.version FROM unnest(%s::text[]) AS etiqueta, generacion
+    ON CONFLICT (etiqueta) DO UPDATE SET version = EXCLUDED.version;
+"""
+GET_CACHE_GENERATION = "SELECT version FROM autodoc.cache_generacion;"
+# Etiquetas invalidadas después de la última versión leída por el proceso (índice idx_cache_invalidaciones_version)
+GET_CACHE_INVALIDATIONS = "SELECT etiqueta, version FROM autodoc.cache_invalidaciones WHERE version > %s;"
+
+
+# ----------------- MIGRACIONES -----------------
+# Versiones del esquema aplicadas (ver app/db/migrador.py y app/db/migraciones/)
+SETUP_MIGRATIONS = """
+    CREATE SCHEMA IF NOT EXISTS autodoc;
+    CREATE TABLE IF NOT EXISTS autodoc.schema_migraciones (
+        version INT PRIMARY KEY,
+        nombre VARCHAR(200) NOT NULL,
+        checksum CHAR(64) NOT NULL,          -- sha256 del archivo .sql aplicado
+        duracion_ms INT,
+        fecha_aplicacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+MIGRATIONS_TABLE_EXISTS = "SELECT to_regclass('autodoc.schema_migraciones') IS NOT NULL AS existe;"
+GET_APPLIED_MIGRATIONS = "SELECT version, nombre, checksum FROM autodoc.schema_migraciones ORDER BY version;"
+RECORD_MIGRATION = """
+    INSERT INTO autodoc.schema_migraciones (version, nombre, checksum, duracion_ms)
+    VALUES (%s, %s, %s, %s);
+"""
+
+# Espera máxima por los bloqueos de una migración transaccional
+SET_LOCK_TIMEOUT = "SET LOCAL lock_timeout = %s;"
+
+# Un solo proceso migrando a la vez (bloqueo de sesión; clave fija de la aplicación)
+TRY_LOCK_MIGRATIONS = "SELECT pg_try_advisory_lock(74530001) AS bloqueado;"
+UNLOCK_MIGRATIONS = "SELECT pg_advisory_unlock(74530001);"
+
+# Índices de autodoc que quedaron a medias (CREATE INDEX CONCURRENTLY interrumpido)
+GET_INVALID_INDEXES = """
+    SELECT c.relname AS nombre
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'autodoc' AND NOT i.indisvalid;
 """
 
 
-# Eliminar un documento
-DELETE_DOCUMENT = "DELETE FROM autodoc.documentos WHERE documento_id = %s;"
\ No newline at end of file
+# ----------------- SENTENCIAS PREPARADAS -----------------
+# Consultas que se ejecutan como sentencias preparadas (PREPARE una vez por conexión, después EXECUTE)
+# y tipo de cada parámetro, en orden. Ver app/db/repositorio.py.
+# No se incluyen el DDL, las que usan execute_values (VALUES %s) ni las que filtran por texto con LIKE
+# o similitud (búsqueda y filtro por nombre): su mejor plan depende del texto buscado.
+# Las que llevan {columnas} se preparan por cada combinación de columnas que se use.
+PREPARED_STATEMENTS = {
+    # Proyectos
+    "GET_ALL_PROJECTS": (),
+    "GET_PROJECTS_PAGE": ("int", "bigint"),
+    "GET_PROJECT_BY_ID": ("int",),
+    "GET_PROJECT_URL_BY_ID": ("int",),
+    "CREATE_PROJECT": ("varchar", "text", "varchar", "varchar"),
+    "UPDATE_PROJECT": ("varchar", "text", "varchar", "int"),
+    "DELETE_PROJECT_IF_UNCHANGED": ("int", "varchar"),
+    "GET_PROJECTS_SHAREPOINT_BY_IDS": ("int[]",),
+    "DELETE_PROJECTS": ("int[]",),
+    # Documentos
+    "GET_DOCUMENTS_BY_PROJECT": ("int",),
+    "GET_DOCUMENTS_BY_PROJECT_FIRST_PAGE": ("int", "bigint"),
+    "GET_DOCUMENTS_BY_PROJECT_PAGE": ("int", "timestamp", "int", "bigint"),
+    "GET_DOCUMENT_BY_ID": ("int",),
+    "GET_DOCUMENT_FIELDS_BY_ID": ("int",),
+    "CREATE_DOCUMENT": ("int", "varchar", "text", "varchar", "varchar"),
+    "UPDATE_DOCUMENT": ("varchar", "text", "int"),
+    "UPDATE_DOCUMENT_URL": ("varchar", "text", "varchar", "int"),
+    "DELETE_DOCUMENT_IF_UNCHANGED": ("int", "varchar"),
+    "GET_DOCUMENTS_SHAREPOINT_BY_IDS": ("int", "int[]"),
+    "DELETE_DOCUMENTS": ("int", "int[]"),
+    # Detalle de proyecto (parámetros con nombre: limit, after_fecha, after_id, proyecto_id)
+    "GET_PROJECT_DETAIL": ("bigint", "timestamp", "int", "int"),
+    # Outbox y modo asíncrono
+    "ENQUEUE_OUTBOX_JOB": ("varchar", "jsonb"),
+    "CLAIM_OUTBOX_JOB": ("float8",),
+    "RENEW_OUTBOX_LEASE": ("float8", "bigint", "int"),
+    "COMPLETE_OUTBOX_JOB": ("jsonb", "bigint", "int"),
+    "FAIL_OUTBOX_JOB": ("int", "float8", "text", "bigint", "int"),
+    "GET_OUTBOX_JOB": ("bigint",),
+    "UPDATE_PROJECT_FIELDS": ("varchar", "text", "int"),
+    "UPDATE_PROJECT_SHAREPOINT": ("varchar", "varchar", "int"),
+    "UPDATE_DOCUMENT_SHAREPOINT": ("varchar", "varchar", "int"),
+    "DELETE_PROJECT_RETURNING": ("int",),
+    "DELETE_DOCUMENT_RETURNING": ("int",),
+    # Reconciliación con SharePoint
+    "INIT_DELTA_STATE": ("varchar",),
+    "CLAIM_DELTA_STATE": ("float8", "varchar"),
+    "RESET_DELTA_STATE": ("varchar",),
+    "SAVE_DELTA_PROGRESS": ("text", "jsonb", "float8", "varchar"),
+    "SAVE_DELTA_LINK": ("text", "jsonb", "varchar"),
+    "RELEASE_DELTA_STATE": ("varchar",),
+    "DELTA_DELETE_PROJECTS": ("text[]",),
+    "DELTA_DELETE_DOCUMENTS": ("text[]",),
+    "DELTA_GET_PROJECTS": ("text[]",),
+    "DELTA_GET_DOCUMENTS": ("text[]",),
+    "DELTA_LINKED_ITEMS": ("timestamp", "timestamp"),
+    # Caché de respuestas (GET_CACHE_INVALIDATIONS se ejecuta en cada consulta a la caché)
+    "PUBLISH_CACHE_INVALIDATION": ("text[]",),
+    "GET_CACHE_GENERATION": (),
+    "GET_CACHE_INVALIDATIONS": ("bigint",),
+}
@@ -0,0 +1,222 @@
+import logging
+import re
+import time
+import zlib
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+from app.db.psql_connection_pool import db_cursor
+from app.db import consultas_lentas, queries
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# %s, %(nombre)s y %% (un "%" literal) en el texto de las consultas
+_PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s|%s")
+
+
+def a_posicional(sql):
+    """
+    Convierte los parámetros de una consulta de queries.py (%s, %(nombre)s) en $1, $2...
+    Devuelve (consulta, parámetros): el nombre del parámetro de cada $n, o None si es un %s.
+    """
+    posiciones = {}  # parámetro con nombre -> $n
+    parametros = []
+
+    def sustituir(match):
+        if match.group(0) == "%%":
+            return "%"
+        if match.group(1):
+            clave = match.group(1)
+            if clave not in posiciones:
+                parametros.append(clave)
+                posiciones[clave] = len(parametros)
+            return f"${posiciones[clave]}"
+        parametros.append(None)
+        return f"${len(parametros)}"
+
+    return _PLACEHOLDER.sub(sustituir, sql.strip().rstrip(";")), parametros
+
+
+class Sentencia:
+    """
+    Consulta de queries.py convertida en sentencia preparada de PostgreSQL.
+    - `prepare`: PREPARE nombre (tipos) AS <consulta con $1, $2...>
+    - `execute`: EXECUTE nombre (%s, ...) con los mismos parámetros que la consulta original.
+    """
+
+    def __init__(self, nombre, sql, tipos):
+        self.nombre = f"autodoc_{nombre.lower()}"
+        cuerpo, parametros = a_posicional(sql)
+        placeholders = ["%s" if clave is None else f"%({clave})s" for clave in parametros]
+        if len(tipos) != len(placeholders):
+            raise ValueError(f"{nombre}: {len(placeholders)} parámetros y {len(tipos)} tipos declarados")
+
+        tipos_sql = f" ({', '.join(tipos)})" if tipos else ""
+        self.prepare = f"PREPARE {self.nombre}{tipos_sql} AS {cuerpo}"
+        self.execute = f"EXECUTE {self.nombre}" + (f" ({', '.join(placeholders)})" if placeholders else "")
+
+
+# Texto de la consulta -> Sentencia (las consultas se identifican por su constante en queries.py)
+_sentencias = {}
+# Consultas con {columnas}: plantilla -> (nombre, tipos); se preparan al proyectarlas
+_plantillas = {}
+# (plantilla, columnas) -> texto de la consulta
+_proyecciones = {}
+
+
+def registrar_sentencias(modulo):
+    """
+    Registra como sentencias preparadas las consultas listadas en `modulo.PREPARED_STATEMENTS`.
+    """
+    for nombre, tipos in modulo.PREPARED_STATEMENTS.items():
+        sql = getattr(modulo, nombre)
+        if "{columnas}" in sql:
+            _plantillas[sql] = (nombre, tipos)
+        else:
+            _sentencias[sql] = Sentencia(nombre, sql, tipos)
+
+
+def proyectar(plantilla, columnas):
+    """
+    Devuelve la consulta `plantilla` con la lista de columnas indicada en lugar de {columnas}.
+    Si la plantilla es una sentencia preparada, cada combinación de columnas se registra
+    como una sentencia propia (el nombre incluye un hash de la consulta).
+    """
+    clave = (plantilla, columnas)
+    sql = _proyecciones.get(clave)
+    if sql is None:
+        sql = plantilla.format(columnas=", ".join(columnas))
+        consultas_lentas.registrar_proyeccion(plantilla, sql)
+        if plantilla in _plantillas:
+            nombre, tipos = _plantillas[plantilla]
+            _sentencias[sql] = Sentencia(f"{nombre}_{zlib.crc32(sql.encode()):08x}", sql, tipos)
+        _proyecciones[clave] = sql
+    return sql
+
+
+registrar_sentencias(queries)
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """
+    Conexión que recuerda qué sentencias tiene ya preparadas
+    (las sentencias preparadas existen mientras dure la sesión en el servidor).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+        self.descartar_preparadas = False
+
+
+class _Preparado:
+    """
+    Ejecuta las consultas registradas como sentencias preparadas:
+    la primera vez en cada conexión se hace PREPARE y después solo EXECUTE,
+    así PostgreSQL no vuelve a analizar ni planificar la consulta en cada llamada.
+    El resto (DDL, execute_values, búsqueda) se envía como texto, igual que antes.
+    Cada ejecución se mide: tiempo de la BBDD de la petición, estadísticas por consulta y log de consultas
+    lentas (ver app/db/consultas_lentas.py).
+    """
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return self._ejecutar(query, vars)
+        finally:
+            consultas_lentas.registrar(query, vars, time.perf_counter() - inicio, self.rowcount)
+
+    def _ejecutar(self, query, vars):
+        sentencia = _sentencias.get(query) if isinstance(query, str) else None
+        preparadas = getattr(self.connection, "preparadas", None)
+        if sentencia is None or preparadas is None:
+            return super().execute(query, vars)
+
+        if self.connection.descartar_preparadas:
+            super().execute("DEALLOCATE ALL")
+            preparadas.clear()
+            self.connection.descartar_preparadas = False
+        if sentencia.nombre not in preparadas:
+            super().execute(sentencia.prepare)
+            preparadas.add(sentencia.nombre)
+        try:
+            return super().execute(sentencia.execute, vars)
+        except psycopg2.errors.FeatureNotSupported:
+            # "cached plan must not change result type": la tabla cambió (p. ej. una migración).
+            # Se vuelven a preparar en la siguiente transacción de esta conexión.
+            self.connection.descartar_preparadas = True
+            raise
+
+
+class PreparedCursor(_Preparado, RealDictCursor):
+    """
+    Cursor con sentencias preparadas que devuelve las filas como diccionarios (cursor por defecto del pool).
+    """
+
+
+class PreparedTupleCursor(_Preparado, psycopg2.extensions.cursor):
+    """
+    Cursor con sentencias preparadas que devuelve las filas como tuplas (listados de la API).
+    """
+
+
+class Repositorio:
+    """
+    Acceso a la BBDD para las consultas de queries.py.
+    Cada llamada toma una conexión del pool solo durante la consulta (con commit al terminar).
+    Para varias consultas en la misma transacción se sigue usando db_cursor(pool).
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def fetch_one(self, query, params=None):
+        """
+        Devuelve la primera fila (diccionario) o None.
+        """
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone()
+
+    def fetch_many(self, query, params=None):
+        """
+        Devuelve todas las filas (lista de diccionarios).
+        """
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def fetch_rows(self, tipo, query, params=None):
+        """
+        Devuelve todas las filas como instancias de `tipo` (namedtuple con los campos de la API,
+        ver app/db/filas.py), leídas con un cursor de tuplas: sin un diccionario por fila.
+        """
+        with db_cursor(self.pool, PreparedTupleCursor) as cursor:
+            cursor.execute(query, params)
+            return [tipo._make(fila) for fila in cursor]
+
+    def fetch_row(self, tipo, query, params=None):
+        """
+        Devuelve la primera fila como instancia de `tipo`, o None.
+        """
+        with db_cursor(self.pool, PreparedTupleCursor) as cursor:
+            cursor.execute(query, params)
+            fila = cursor.fetchone()
+            return tipo._make(fila) if fila is not None else None
+
+    def execute(self, query, params=None):
+        """
+        Ejecuta una escritura y devuelve el número de filas afectadas.
+        """
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(query, params)
+            return cursor.rowcount
+
+    def execute_returning(self, query, params=None):
+        """
+        Ejecuta un INSERT/UPDATE/DELETE ... RETURNING y devuelve las filas devueltas.
+        """
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
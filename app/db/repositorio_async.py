@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import logging
+import time
+import asyncpg
+
+from app.db import consultas_lentas
+from app.db.psql_connection_pool import PoolTimeoutError
+from app.db.repositorio import a_posicional
+from app.utils import metricas
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Texto de la consulta (constante de queries.py) -> (consulta con $1, $2..., parámetros)
+_consultas = {}
+
+
+def _argumentos(query, params):
+    """
+    Devuelve la consulta en el formato de asyncpg y sus argumentos en orden
+    (`params` como en psycopg2: tupla para %s, diccionario para %(nombre)s).
+    """
+    convertida = _consultas.get(query)
+    if convertida is None:
+        convertida = _consultas.setdefault(query, a_posicional(query))
+    sql, parametros = convertida
+    if isinstance(params, dict):
+        return sql, [params[clave] for clave in parametros]
+    return sql, list(params or ())
+
+
+def _filas(resultado):
+    """
+    Filas devueltas o afectadas según el resultado de asyncpg (lista, fila o estado como "UPDATE 3").
+    """
+    if isinstance(resultado, str):
+        cuenta = resultado.rsplit(" ", 1)[-1]
+        return int(cuenta) if cuenta.isdigit() else 0
+    if isinstance(resultado, list):
+        return len(resultado)
+    return 0 if resultado is None else 1
+
+
+class ConsultasAsync:
+    """
+    Los métodos de Repositorio, como corrutinas, sobre una conexión de asyncpg
+    (ver RepositorioAsync.transaccion). Las filas son asyncpg.Record: se leen con fila["columna"],
+    igual que los diccionarios de psycopg2. Cada consulta se mide como en Repositorio (ver app/db/consultas_lentas.py).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def _ejecutar(self, metodo, query, params):
+        # Mide la consulta como _Preparado.execute (tiempo, estadísticas y log de consultas lentas)
+        sql, args = _argumentos(query, params)
+        inicio = time.perf_counter()
+        filas = -1
+        try:
+            resultado = await metodo(sql, *args)
+            filas = _filas(resultado)
+            return resultado
+        finally:
+            consultas_lentas.registrar(query, params, time.perf_counter() - inicio, filas)
+
+    async def fetch_one(self, query, params=None):
+        return await self._ejecutar(self.conn.fetchrow, query, params)
+
+    async def fetch_many(self, query, params=None):
+        return await self._ejecutar(self.conn.fetch, query, params)
+
+    async def fetch_rows(self, tipo, query, params=None):
+        return [tipo._make(fila) for fila in await self.fetch_many(query, params)]
+
+    async def fetch_row(self, tipo, query, params=None):
+        fila = await self.fetch_one(query, params)
+        return tipo._make(fila) if fila is not None else None
+
+    async def execute(self, query, params=None):
+        """
+        Ejecuta una escritura y devuelve el número de filas afectadas.
+        """
+        estado = await self._ejecutar(self.conn.execute, query, params)  # p. ej. "UPDATE 1"
+        return _filas(estado)
+
+    async def execute_returning(self, query, params=None):
+        return await self.fetch_many(query, params)
+
+
+class RepositorioAsync:
+    """
+    Acceso a la BBDD para el modo asyncio (ver app/asgi.py), con un pool de asyncpg por proceso.
+    - Las mismas consultas de queries.py; asyncpg las prepara la primera vez en cada conexión
+      y después solo las ejecuta (como las sentencias preparadas de Repositorio).
+    - Cada llamada toma una conexión solo durante la consulta; varias consultas en la misma
+      transacción con `async with repo.transaccion() as consultas`.
+    - Si no hay conexión libre en DB_POOL_TIMEOUT segundos se lanza PoolTimeoutError, como en el pool síncrono.
+    """
+
+    def __init__(self, config, pool_min, pool_max):
+        self.config = config
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.acquire_timeout = config.get("DB_POOL_TIMEOUT", 10)
+        self._pool = None
+
+    async def abrir(self):
+        config = self.config
+        self._pool = await asyncpg.create_pool(
+            host=config["DB_HOST"],
+            port=config.get("DB_PORT", 5432),
+            user=config["DB_USER"],
+            password=config["DB_PASS"],
+            database=config["DB_NAME"],
+            timeout=config.get("DB_CONN_TIMEOUT", 10),
+            min_size=self.pool_min,
+            max_size=self.pool_max,
+        )
+        logger.info("[DB] Async connection pool created.")
+
+    async def cerrar(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
+            logger.info("[DB] Async connection pool closed.")
+
+    @contextlib.asynccontextmanager
+    async def conexion(self):
+        try:
+            with metricas.medir(metricas.DB_POOL):
+                conn = await self._pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(
+                f"No hay conexiones libres en el pool tras esperar {self.acquire_timeout}s ({self.pool_max} en uso)."
+            )
+        try:
+            yield conn
+        finally:
+            await self._pool.release(conn)
+
+    @contextlib.asynccontextmanager
+    async def transaccion(self):
+        """
+        Conexión con una transacción abierta (commit al salir del bloque, rollback si hay error).
+        """
+        async with self.conexion() as conn, conn.transaction():
+            yield ConsultasAsync(conn)
+
+    async def fetch_one(self, query, params=None):
+        async with self.conexion() as conn:
+            return await ConsultasAsync(conn).fetch_one(query, params)
+
+    async def fetch_many(self, query, params=None):
+        async with self.conexion() as conn:
+            return await ConsultasAsync(conn).fetch_many(query, params)
+
+    async def fetch_rows(self, tipo, query, params=None):
+        async with self.conexion() as conn:
+            return await ConsultasAsync(conn).fetch_rows(tipo, query, params)
+
+    async def fetch_row(self, tipo, query, params=None):
+        async with self.conexion() as conn:
+            return await ConsultasAsync(conn).fetch_row(tipo, query, params)
+
+    async def execute(self, query, params=None):
+        async with self.conexion() as conn:
+            return await ConsultasAsync(conn).execute(query, params)
+
+    async def execute_returning(self, query, params=None):
+        async with self.conexion() as conn:
+            return await ConsultasAsync(conn).execute_returning(query, params)
+
+    def stats(self):
+        """
+        Conexiones del pool (abiertas y libres).
+        """
+        if self._pool is None:
+            return {"max": self.pool_max, "size": 0, "idle": 0}
+        return {"max": self.pool_max, "size": self._pool.get_size(), "idle": self._pool.get_idle_size()}
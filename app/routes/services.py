@@ -1,17 +1,32 @@
-from flask import jsonify, request
-from app import app
+import logging
+import unicodedata
+from urllib.parse import quote
+from flask import Blueprint, Response, g, jsonify, request, send_file
+from app.db import consultas_lentas
+from app.db.filas import CamposInvalidos
+from app.db.psql_connection_pool import PoolTimeoutError, start_hold_tracking
 from app.utils import funciones as funcs
+from app.utils import metricas, perfilador
+from app.utils.cache import cached_json
+from app.utils.exportacion import FORMATOS
+from app.config.config import CONTENT_CACHE_CONFIG, METRICS_CONFIG, SLOW_QUERY_CONFIG, UPLOAD_CONFIG
+from app.utils.paginacion import CursorInvalido, parse_limit
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Endpoints de la API (se registran en create_app, ver app/__init__.py)
+bp = Blueprint("services", __name__)
 
 # -------------------- RUTA DE PRUEBA -------------------- #
 # PRUEBA - Llamada a la función saludo desde funciones.py
-@app.route("/saludo", methods=["GET"])
+@bp.route("/saludo", methods=["GET"])
 def saludo_route():
     data = funcs.saludo()
     return jsonify({"saludo": data})
 
 # -------------------- ACCESS TOKEN MICROSOFT GRAPH -------------------- #
 # Devuelve un token de acceso para Microsoft Graph
-@app.route("/test-token", methods=["GET"])
+@bp.route("/test-token", methods=["GET"])
 def test_token():
     try:
         token = funcs.get_access_token()
@@ -19,51 +34,227 @@ def test_token():
     except Exception as e:
         return jsonify({"error": str(e)})
 
+# Devuelve las latencias acumuladas de las llamadas a Microsoft Graph
+@bp.route("/graph-stats", methods=["GET"])
+def graph_stats():
+    return jsonify(funcs.get_graph_client().stats())
+
+# Estado del pool de conexiones y tiempo que se retienen las conexiones
+@bp.route("/db-stats", methods=["GET"])
+def db_stats():
+    return jsonify(funcs.get_db_pool().stats())
+
+# Consultas con más tiempo en la BBDD (todos los workers): ?limit=N&orden=total|media|llamadas|lentas
+@bp.route("/db-stats/consultas", methods=["GET"])
+def db_stats_consultas():
+    if not metricas.ENABLED:
+        return jsonify({"mensaje": "Las métricas están desactivadas (METRICS_ENABLED)"}), 404
+    orden = request.args.get("orden", "total")
+    if orden not in consultas_lentas.ORDENES:
+        return jsonify({"mensaje": f"El parámetro orden debe ser uno de: {', '.join(consultas_lentas.ORDENES)}"}), 400
+    try:
+        limit = parse_limit(request.args.get("limit"))
+    except CursorInvalido as e:
+        return jsonify({"mensaje": str(e)}), 400
+    return jsonify({
+        "umbral_lenta_ms": SLOW_QUERY_CONFIG["THRESHOLD_MS"],
+        "consultas": consultas_lentas.resumen(limit, orden),
+    })
+
+# Métricas de todos los workers en formato Prometheus (ver app/utils/metricas.py)
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    if not metricas.ENABLED:
+        return jsonify({"mensaje": "Las métricas están desactivadas (METRICS_ENABLED)"}), 404
+    return Response(metricas.exponer(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Perfiles guardados por el perfilador (ver app/utils/perfilador.py); piden la cabecera con un secreto válido
+def _perfiles_no_autorizados():
+    if not perfilador.SECRETOS:
+        return jsonify({"mensaje": "El perfilador no tiene secretos configurados (PROFILER_SECRETS)"}), 404
+    if not perfilador.autorizado(request.headers.get(perfilador.CABECERA)):
+        return jsonify({"mensaje": f"Falta la cabecera {perfilador.CABECERA} o el secreto no es válido"}), 403
+    return None
+
+@bp.route("/perfiles", methods=["GET"])
+def listar_perfiles():
+    return _perfiles_no_autorizados() or jsonify(perfilador.listar())
+
+# Descarga el perfil (pstats: snakeviz, python -m pstats) o, con ?formato=texto&orden=cumulative|tottime|calls&limit=N,
+# las funciones con más tiempo
+@bp.route("/perfiles/<nombre>", methods=["GET"])
+def descargar_perfil(nombre):
+    error = _perfiles_no_autorizados()
+    if error:
+        return error
+    ruta = perfilador.ruta_perfil(nombre)
+    if ruta is None:
+        return jsonify({"mensaje": "No se encontró el perfil (puede que ya se haya borrado)"}), 404
+    if request.args.get("formato") != "texto":
+        return send_file(ruta, mimetype="application/octet-stream", as_attachment=True, download_name=nombre)
+    orden = request.args.get("orden", "cumulative")
+    if orden not in perfilador.ORDENES:
+        return jsonify({"mensaje": f"El parámetro orden debe ser uno de: {', '.join(perfilador.ORDENES)}"}), 400
+    try:
+        limit = parse_limit(request.args.get("limit"))
+    except CursorInvalido as e:
+        return jsonify({"mensaje": str(e)}), 400
+    return Response(perfilador.texto(ruta, orden, limit), content_type="text/plain; charset=utf-8")
+
+# -------------------- RETENCIÓN DE CONEXIONES Y TIEMPOS POR REQUEST -------------------- #
+# Cada respuesta indica cuánto tiempo ha tenido conexiones a la BBDD (X-DB-Hold-Ms)
+# y en el log queda un aviso si se llamó a Graph con una conexión tomada.
+# Server-Timing desglosa la petición: espera por el pool, consultas, token y llamadas a Graph.
+# Las peticiones perfiladas (ver app/utils/perfilador.py) indican su perfil en X-Profile.
+@bp.before_app_request
+def _medir_conexiones():
+    g.db_hold = start_hold_tracking()
+    g.tiempos = metricas.iniciar_peticion()
+    if (perfilador.ACTIVO and not request.path.startswith("/perfiles")
+            and perfilador.solicitado(request.headers.get(perfilador.CABECERA))):
+        g.perfil = perfilador.iniciar()
+
+@bp.after_app_request
+def _informar_conexiones(response):
+    hold = g.get("db_hold")
+    if hold is not None:
+        response.headers["X-DB-Hold-Ms"] = f"{hold['total'] * 1000:.1f}"
+        response.headers["X-DB-Connections"] = str(hold["count"])
+        if hold["io"]:
+            logger.warning(f"[DB] {request.method} {request.path} made {hold['io']} Graph calls while holding a DB connection.")
+    tiempos = g.get("tiempos")
+    if tiempos is not None:
+        if METRICS_CONFIG["SERVER_TIMING"]:
+            response.headers["Server-Timing"] = tiempos.server_timing()
+        ruta = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metricas.finalizar_peticion(tiempos, request.method, ruta, response.status_code)
+    perfil = g.pop("perfil", None)
+    if perfil is not None:
+        nombre = perfilador.finalizar(perfil, request.method, request.path, response.status_code)
+        if nombre:
+            response.headers["X-Profile"] = nombre
+    return response
+
+# Si la petición terminó sin pasar por el after_request (excepción no controlada) el perfil se descarta
+@bp.teardown_app_request
+def _descartar_perfil(exc):
+    perfilador.descartar(g.pop("perfil", None))
+
+# -------------------- MODO ASÍNCRONO -------------------- #
+# Las escrituras se pueden pedir en modo asíncrono con "?async=true" o la cabecera "Prefer: respond-async".
+# En ese caso se responde 202 con el job que completará la operación en SharePoint (ver GET /jobs/<id>).
+def _modo_async():
+    return (request.args.get("async", "").lower() in ("1", "true")
+            or "respond-async" in request.headers.get("Prefer", ""))
+
+def _respuesta_job(job_id, mensaje, **datos):
+    respuesta = jsonify({"mensaje": mensaje, "job_id": job_id, **datos})
+    if job_id is None:
+        return respuesta, 200  # No quedó nada pendiente en SharePoint
+    respuesta.headers["Location"] = f"/jobs/{job_id}"
+    return respuesta, 202
+
+# -------------------- ESTADO DE UN JOB -------------------- #
+@bp.route("/jobs/<int:job_id>", methods=["GET"])
+def obtener_job_endpoint(job_id):
+    job = funcs.obtener_job(job_id)
+
+    if not job:
+        return jsonify({"mensaje": "No se encontró el job con ese ID"}), 404
+
+    return jsonify({
+        "job_id": job["job_id"],
+        "tipo": job["tipo"],
+        "estado": job["estado"],
+        "intentos": job["intentos"],
+        "resultado": job["resultado"],
+        "error": job["error"],
+        "fecha_creacion": job["fecha_creacion"],
+        "fecha_actualizacion": job["fecha_actualizacion"]
+    })
+
 """-----------------------------------------------------------------------
                        PROYECTOS
 -----------------------------------------------------------------------"""
 # -------------------- OBTENER PROYECTOS -------------------- #
 # Devuelve todos los proyectos o filtra por nombre si se proporciona el parámetro
-@app.route("/proyectos", methods=["GET"])
+# Con "limit" y/o "after" devuelve una página: {"datos": [...], "siguiente": cursor o null}
+# Con "fields" (p. ej. ?fields=idProyecto,nombre) devuelve solo esos campos
+# Respuesta cacheada (con ETag); se invalida al crear, modificar o eliminar proyectos
+@bp.route("/proyectos", methods=["GET"])
 def obtener_proyectos_endpoint():
+    return cached_json(("proyectos", request.query_string), ["proyectos"], _listar_proyectos)
+
+def _listar_proyectos():
     nombre = request.args.get("nombre")
-    proyectos_raw = funcs.obtener_proyectos(nombre)
+    fields = request.args.get("fields")
 
-    # Transformar cada proyecto al formato esperado
-    proyectos = [
-        {
-            "idProyecto": p["proyecto_id"],
-            "nombre": p["nombre"],
-            "descripcion": p["descripcion"],
-            "proyecto_url": p["proyecto_url"]
-        }
-        for p in proyectos_raw
-    ]
-    return jsonify(proyectos)
+    siguiente = None
+    paginado = "limit" in request.args or "after" in request.args
+    try:
+        if paginado:
+            limit = parse_limit(request.args.get("limit"))
+            filas, siguiente = funcs.obtener_proyectos_pagina(nombre, limit, request.args.get("after"), fields)
+        else:
+            filas = funcs.obtener_proyectos(nombre, fields)
+    except (CursorInvalido, CamposInvalidos) as e:
+        return jsonify({"mensaje": str(e)}), 400
+
+    # Las filas ya tienen los campos de la respuesta
+    proyectos = [p._asdict() for p in filas]
+
+    if paginado:
+        return {"datos": proyectos, "siguiente": siguiente}
+    return proyectos
 
 
 # -------------------- OBTENER UN PROYECTO POR ID -------------------- #
-# Devuelve un proyecto específico por su ID
-@app.route("/proyectos/<int:id>", methods=["GET"])
+# Devuelve un proyecto específico por su ID (admite "fields", como el listado)
+# Respuesta cacheada (con ETag); se invalida al modificar o eliminar el proyecto
+@bp.route("/proyectos/<int:id>", methods=["GET"])
 def obtener_proyecto_por_id_endpoint(id):
-    proyecto_raw = funcs.obtener_proyecto_por_id(id)
+    return cached_json(("proyecto", id, request.query_string), [("proyecto", id)], lambda: _obtener_proyecto(id))
 
-    if not proyecto_raw:
+def _obtener_proyecto(id):
+    try:
+        proyecto = funcs.obtener_proyecto_por_id(id, request.args.get("fields"))
+    except CamposInvalidos as e:
+        return jsonify({"mensaje": str(e)}), 400
+
+    if not proyecto:
         return jsonify({"mensaje": "No se encontró el proyecto con ese ID"}), 404
 
-    # Transformar el resultado al formato esperado
-    proyecto = {
-        "idProyecto": proyecto_raw["proyecto_id"],
-        "nombre": proyecto_raw["nombre"],
-        "descripcion": proyecto_raw["descripcion"],
-        "proyecto_url": proyecto_raw["proyecto_url"]
-    }
+    return proyecto._asdict()
+
 
-    return jsonify(proyecto)
+# -------------------- DETALLE DE UN PROYECTO -------------------- #
+# Proyecto + totalDocumentos + ultimaModificacion + primera página de documentos en una sola consulta
+# (la pantalla del proyecto no necesita llamar también a /documentos). Acepta "limit" y "after":
+# {"idProyecto": ..., ..., "documentos": {"datos": [...], "siguiente": cursor o null}}
+# Respuesta cacheada (con ETag); se invalida al modificar el proyecto o sus documentos
+@bp.route("/proyectos/<int:id>/detalle", methods=["GET"])
+def obtener_detalle_proyecto_endpoint(id):
+    return cached_json(
+        ("detalle", id, request.query_string),
+        [("proyecto", id), ("documentos", id)],
+        lambda: _obtener_detalle_proyecto(id)
+    )
+
+def _obtener_detalle_proyecto(id):
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        detalle = funcs.obtener_detalle_proyecto(id, limit, request.args.get("after"))
+    except CursorInvalido as e:
+        return jsonify({"mensaje": str(e)}), 400
+
+    if not detalle:
+        return jsonify({"mensaje": "No se encontró el proyecto con ese ID"}), 404
+
+    return detalle
 
 
 # -------------------- CREAR UN NUEVO PROYECTO -------------------- #
-@app.route("/proyectos", methods=["POST"])
+@bp.route("/proyectos", methods=["POST"])
 def crear_proyecto_endpoint():
     # Obtener los datos del request body
     data = request.get_json()
@@ -75,6 +266,10 @@ def crear_proyecto_endpoint():
     if not nombre or not descripcion:
         return jsonify({"mensaje": "Faltan campos obligatorios"}), 400
 
+    if _modo_async():
+        proyecto_id, job_id = funcs.crear_proyecto_async(nombre, descripcion)
+        return _respuesta_job(job_id, "Proyecto registrado, creando carpeta en SharePoint", proyecto_id=proyecto_id)
+
     # Crear carpeta en Sharepoint y obtener URL + folder_id
     try:
         proyecto_url, id_sharepoint = funcs.crear_carpeta_sharepoint(nombre)
@@ -91,7 +286,7 @@ def crear_proyecto_endpoint():
     }), 200
 
 # -------------------- MODIFICAR PROYECTO -------------------- #
-@app.route("/proyectos/<int:id>", methods=["PUT"])
+@bp.route("/proyectos/<int:id>", methods=["PUT"])
 def modificar_proyecto_endpoint(id):
     # Obtener datos del request
     data = request.get_json()
@@ -104,6 +299,12 @@ def modificar_proyecto_endpoint(id):
     # Validar campos obligatorios (opcional si quieres que todos sean requeridos)
     if not all([nombre, descripcion]):
         return jsonify({"mensaje": "Faltan campos obligatorios"}), 400
+
+    if _modo_async():
+        job_id = funcs.modificar_proyecto_async(id, nombre, descripcion)
+        if job_id is None:
+            return jsonify({"mensaje": "No se encontró el proyecto con ese ID"}), 404
+        return _respuesta_job(job_id, "Proyecto actualizado, renombrando carpeta en SharePoint")
     
     # --- 1. Modificar en SharePoint ---
     try:
@@ -122,8 +323,14 @@ def modificar_proyecto_endpoint(id):
 
 
 # -------------------- ELIMINAR PROYECTO -------------------- #
-@app.route("/proyectos/<int:id>", methods=["DELETE"])
+@bp.route("/proyectos/<int:id>", methods=["DELETE"])
 def eliminar_proyecto_endpoint(id):
+    if _modo_async():
+        existia, job_id = funcs.eliminar_proyecto_async(id)
+        if not existia:
+            return jsonify({"mensaje": "No se encontró el proyecto con ese ID"}), 404
+        return _respuesta_job(job_id, "Proyecto eliminado, eliminando carpeta en SharePoint")
+
     # Llamamos a la función auxiliar que elimina el proyecto
     try: 
         eliminado = funcs.eliminar_proyecto(id)
@@ -136,33 +343,78 @@ def eliminar_proyecto_endpoint(id):
 
     return jsonify({"mensaje": "Proyecto eliminado correctamente"})
 
+# -------------------- ELIMINAR VARIOS PROYECTOS -------------------- #
+# Body JSON: {"ids": [1, 2, 3]}. Devuelve un resultado por proyecto (207 si alguno falló).
+@bp.route("/proyectos", methods=["DELETE"])
+def eliminar_proyectos_lote_endpoint():
+    ids = _ids_lote(request.get_json(silent=True))
+    if ids is None:
+        return jsonify({"mensaje": _MENSAJE_IDS_LOTE}), 400
+
+    try:
+        resultados = funcs.eliminar_proyectos_lote(ids)
+    except Exception as e:
+        return jsonify({"error": f"No se pudieron eliminar los proyectos: {str(e)}"}), 500
+
+    return _respuesta_lote(resultados, "proyectos")
+
+# Valida el body {"ids": [...]} de las eliminaciones por lotes (sin duplicados, en orden)
+# Entre 1 y BATCH_MAX_IDS IDs válidos (ver funcs.id_valido); si no, None (400 con _MENSAJE_IDS_LOTE)
+_MENSAJE_IDS_LOTE = f"Se esperaba {{\"ids\": [...]}} con entre 1 y {UPLOAD_CONFIG['BATCH_MAX_IDS']} IDs enteros positivos"
+
+def _ids_lote(data):
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not 1 <= len(ids) <= UPLOAD_CONFIG["BATCH_MAX_IDS"] or not all(funcs.id_valido(i) for i in ids):
+        return None
+    return list(dict.fromkeys(ids))
+
+def _respuesta_lote(resultados, tipo):
+    correctos = sum(1 for r in resultados if r["ok"])
+    return jsonify({
+        "mensaje": f"{correctos} de {len(resultados)} {tipo} eliminados",
+        "resultados": resultados
+    }), 200 if correctos == len(resultados) else 207
+
 """-----------------------------------------------------------------------
                        DOCUMENTOS
 -----------------------------------------------------------------------"""
 
 # -------------------- LISTAR DOCUMENTOS DE UN PROYECTO -------------------- #
-@app.route("/proyectos/<int:idProyecto>/documentos", methods=["GET"])
+# Con "limit" y/o "after" devuelve una página: {"datos": [...], "siguiente": cursor o null}
+# Con "fields" (p. ej. ?fields=idDocumento,nombre,url) devuelve solo esos campos
+# Respuesta cacheada (con ETag); se invalida al crear, modificar o eliminar documentos del proyecto
+@bp.route("/proyectos/<int:idProyecto>/documentos", methods=["GET"])
 def obtener_documentos_endpoint(idProyecto):
-    documentos_raw = funcs.obtener_documentos(idProyecto)
+    return cached_json(
+        ("documentos", idProyecto, request.query_string),
+        [("documentos", idProyecto)],
+        lambda: _listar_documentos(idProyecto)
+    )
 
-    # Transformar cada documento al formato esperado
-    documentos = [
-        {
-            "idDocumento": d["documento_id"],
-            "idProyecto": d["proyecto_id"],
-            "nombre": d["nombre"],
-            "descripcion": d["descripcion"],
-            "url": d["url"],
-            "fecha": d["fecha_creacion"]
-        }
-        for d in documentos_raw
-    ]
+def _listar_documentos(idProyecto):
+    fields = request.args.get("fields")
+
+    siguiente = None
+    paginado = "limit" in request.args or "after" in request.args
+    try:
+        if paginado:
+            limit = parse_limit(request.args.get("limit"))
+            filas, siguiente = funcs.obtener_documentos_pagina(idProyecto, limit, request.args.get("after"), fields)
+        else:
+            filas = funcs.obtener_documentos(idProyecto, fields)
+    except (CursorInvalido, CamposInvalidos) as e:
+        return jsonify({"mensaje": str(e)}), 400
+
+    # Las filas ya tienen los campos de la respuesta
+    documentos = [d._asdict() for d in filas]
 
-    return jsonify(documentos)
+    if paginado:
+        return {"datos": documentos, "siguiente": siguiente}
+    return documentos
 
 
 # -------------------- SUBIR DOCUMENTO (ARCHIVO) A SHAREPOINT Y REGISTRARLO EN LA BBDD -------------------- #
-@app.route("/proyectos/<int:idProyecto>/documentos", methods=["POST"])
+@bp.route("/proyectos/<int:idProyecto>/documentos", methods=["POST"])
 def crear_documento_endpoint(idProyecto):
     if "file" not in request.files:
         return jsonify({"mensaje": "No se recibió archivo"}), 400
@@ -173,14 +425,21 @@ def crear_documento_endpoint(idProyecto):
 
     if not nombre or not descripcion or not archivo:
         return jsonify({"mensaje": "Faltan campos obligatorios"}), 400
+
+    if _modo_async():
+        documento_id, job_id = funcs.crear_documento_async(
+            idProyecto, nombre, descripcion, archivo.filename, archivo.stream
+        )
+        return _respuesta_job(job_id, "Documento registrado, subiendo archivo a SharePoint", documento_id=documento_id)
     
     # Obtener folder_id del proyecto
     folder_id = funcs.obtener_info_proyecto(idProyecto)
 
-    # Subir el archivo a SharePoint
+    # Subir el archivo a SharePoint (se envía desde el fichero temporal, sin leerlo entero)
     try:
-        contenido_bytes = archivo.read()
-        archivo_url, archivo_id = funcs.subir_archivo_sharepoint(archivo.filename, contenido_bytes, folder_id)
+        archivo_url, archivo_id = funcs.subir_archivo_sharepoint(
+            archivo.filename, archivo.stream, folder_id, upload_id=request.form.get("upload_id")
+        )
     except Exception as e:
         return jsonify({"error": f"No se pudo subir el archivo a SharePoint: {str(e)}"}), 500
 
@@ -190,34 +449,181 @@ def crear_documento_endpoint(idProyecto):
     return jsonify({
         "mensaje": "Documento creado correctamente",
         "documento_id": documento_id,
-        "url": archivo_url
+        "url": archivo_url,
+        "tamano": archivo.stream.size,
+        "sha256": archivo.stream.sha256
     }), 200
 
 
 
+# -------------------- SUBIR VARIOS DOCUMENTOS A LA VEZ -------------------- #
+# Formulario multipart con varios "files". Opcionalmente, "nombres" y "descripciones"
+# en el mismo orden que los archivos; si no, se usa el nombre del archivo y "descripcion".
+# Devuelve un resultado por archivo: 200 si todos se subieron, 207 si algunos fallaron.
+@bp.route("/proyectos/<int:idProyecto>/documentos/lote", methods=["POST"])
+def crear_documentos_lote_endpoint(idProyecto):
+    archivos = [a for a in request.files.getlist("files") if a and a.filename]
+    if not archivos:
+        return jsonify({"mensaje": "No se recibieron archivos"}), 400
+    if len(archivos) > UPLOAD_CONFIG["BATCH_MAX_FILES"]:
+        return jsonify({"mensaje": f"Máximo {UPLOAD_CONFIG['BATCH_MAX_FILES']} archivos por petición"}), 400
+    repetidos = funcs.nombres_repetidos([a.filename for a in archivos])
+    if repetidos:
+        return jsonify({"mensaje": f"Hay archivos con el mismo nombre en el lote: {', '.join(repetidos)}"}), 400
+
+    nombres = request.form.getlist("nombres")
+    descripciones = request.form.getlist("descripciones")
+    descripcion_comun = request.form.get("descripcion", "")
+
+    lote = [
+        {
+            "nombre": nombres[i] if i < len(nombres) and nombres[i] else archivo.filename,
+            "descripcion": descripciones[i] if i < len(descripciones) else descripcion_comun,
+            "filename": archivo.filename,
+            "stream": archivo.stream
+        }
+        for i, archivo in enumerate(archivos)
+    ]
+
+    try:
+        resultados = funcs.subir_documentos_lote(idProyecto, lote)
+    except Exception as e:
+        return jsonify({"error": f"No se pudieron subir los documentos: {str(e)}"}), 500
+
+    correctos = sum(1 for r in resultados if r["ok"])
+    if correctos == 0:
+        codigo = 500
+    elif correctos < len(resultados):
+        codigo = 207
+    else:
+        codigo = 200
+
+    return jsonify({
+        "mensaje": f"{correctos} de {len(resultados)} documentos subidos correctamente",
+        "resultados": resultados
+    }), codigo
+
+
+# -------------------- ELIMINAR VARIOS DOCUMENTOS -------------------- #
+# Body JSON: {"ids": [1, 2, 3]}. Devuelve un resultado por documento (207 si alguno falló).
+@bp.route("/proyectos/<int:idProyecto>/documentos", methods=["DELETE"])
+def eliminar_documentos_lote_endpoint(idProyecto):
+    ids = _ids_lote(request.get_json(silent=True))
+    if ids is None:
+        return jsonify({"mensaje": _MENSAJE_IDS_LOTE}), 400
+
+    try:
+        resultados = funcs.eliminar_documentos_lote(idProyecto, ids)
+    except Exception as e:
+        return jsonify({"error": f"No se pudieron eliminar los documentos: {str(e)}"}), 500
+
+    return _respuesta_lote(resultados, "documentos")
+
+
+# -------------------- PROGRESO DE UNA SUBIDA -------------------- #
+# El frontend envía "upload_id" en el formulario de subida y consulta aquí el avance
+@bp.route("/subidas/<upload_id>", methods=["GET"])
+def progreso_subida_endpoint(upload_id):
+    progreso = funcs.obtener_progreso_subida(upload_id)
+
+    if not progreso:
+        return jsonify({"mensaje": "No se encontró la subida con ese ID"}), 404
+
+    return jsonify(progreso)
+
+
 # -------------------- OBTENER DOCUMENTO POR ID -------------------- #
-@app.route("/proyectos/<int:idProyecto>/documentos/<int:idDocumento>", methods=["GET"])
+# Admite "fields", como el listado
+# Respuesta cacheada (con ETag); se invalida al modificar o eliminar el documento o su proyecto
+@bp.route("/proyectos/<int:idProyecto>/documentos/<int:idDocumento>", methods=["GET"])
 def obtener_documento_por_id_endpoint(idProyecto, idDocumento):
-    documento_raw = funcs.obtener_documento_por_id(idDocumento)
+    return cached_json(
+        ("documento", idProyecto, idDocumento, request.query_string),
+        [("documento", idDocumento), ("documentos", idProyecto)],
+        lambda: _obtener_documento(idDocumento)
+    )
 
-    if not documento_raw:
+def _obtener_documento(idDocumento):
+    try:
+        documento = funcs.obtener_documento_por_id(idDocumento, request.args.get("fields"))
+    except CamposInvalidos as e:
+        return jsonify({"mensaje": str(e)}), 400
+
+    if not documento:
         return jsonify({"mensaje": "No se encontró el documento con ese ID"}), 404
 
-    # Transformar al formato esperado
-    documento = {
-        "idDocumento": documento_raw["documento_id"],
-        "idProyecto": documento_raw["proyecto_id"],
-        "nombre": documento_raw["nombre"],
-        "descripcion": documento_raw["descripcion"],
-        "url": documento_raw["url"],
-        "fecha": documento_raw["fecha_creacion"]
-    }
+    return documento._asdict()
 
-    return jsonify(documento)
+
+# -------------------- DESCARGAR EL ARCHIVO DE UN DOCUMENTO -------------------- #
+# Envía el archivo desde la caché en disco (ver app/utils/contenido.py) o, si no se cachea, directamente desde Graph.
+# Admite Range (206/416) y peticiones condicionales con el eTag de SharePoint (If-None-Match -> 304, If-Range).
+@bp.route("/proyectos/<int:idProyecto>/documentos/<int:idDocumento>/contenido", methods=["GET"])
+def descargar_documento_endpoint(idProyecto, idDocumento):
+    try:
+        metadatos = funcs.obtener_metadatos_contenido(idProyecto, idDocumento)
+        if metadatos is None:
+            return jsonify({"mensaje": "No se encontró el documento con ese ID o no tiene archivo en SharePoint"}), 404
+        if request.if_none_match.contains(metadatos.etag):
+            # El cliente ya tiene esta versión: ni siquiera hace falta tenerla en la caché
+            metricas.contar("autodoc_content_requests_total", (("result", "not_modified"),))
+            respuesta = Response(status=304)
+            respuesta.set_etag(metadatos.etag)
+            return respuesta
+        ruta = funcs.contenido_en_cache(metadatos)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo obtener el archivo de SharePoint: {str(e)}"}), 502
+
+    if ruta is not None:
+        try:
+            # Con gunicorn el archivo completo se envía con sendfile (sin copiarlo por Python)
+            respuesta = send_file(
+                ruta, mimetype=metadatos.mimetype, download_name=metadatos.nombre,
+                conditional=True, etag=metadatos.etag, last_modified=metadatos.modificado,
+            )
+        except FileNotFoundError:
+            pass  # Otro worker lo acaba de sacar de la caché: se envía desde Graph
+        else:
+            respuesta.headers["Cache-Control"] = "private, no-cache"
+            return respuesta
+    return _contenido_desde_graph(metadatos)
+
+def _contenido_desde_graph(metadatos):
+    rango = request.headers.get("Range")
+    if rango and "If-Range" in request.headers and request.if_range.etag != metadatos.etag:
+        rango = None  # El cliente tiene otra versión del archivo: se envía completo
+    try:
+        origen = funcs.descargar_contenido(metadatos, rango)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo descargar el archivo de SharePoint: {str(e)}"}), 502
+    if origen.status_code not in (200, 206, 416):
+        origen.close()
+        return jsonify({"error": f"SharePoint respondió {origen.status_code} al descargar el archivo"}), 502
+
+    cuerpo = origen.iter_content(CONTENT_CACHE_CONFIG["CHUNK_SIZE"]) if origen.status_code != 416 else b""
+    respuesta = Response(cuerpo, status=origen.status_code, mimetype=metadatos.mimetype)
+    respuesta.call_on_close(origen.close)  # libera la conexión con Graph aunque el cliente corte la descarga
+    for cabecera in ("Content-Length", "Content-Range"):
+        if cabecera in origen.headers:
+            respuesta.headers[cabecera] = origen.headers[cabecera]
+    respuesta.headers["Accept-Ranges"] = "bytes"
+    respuesta.headers.set("Content-Disposition", "inline", **_nombre_archivo(metadatos.nombre))
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    respuesta.headers["X-Accel-Buffering"] = "no"  # que un proxy (nginx) no acumule la respuesta
+    respuesta.set_etag(metadatos.etag)
+    respuesta.last_modified = metadatos.modificado
+    return respuesta
+
+# Nombre del archivo para Content-Disposition (como send_file: ASCII y, si hace falta, filename* en UTF-8)
+def _nombre_archivo(nombre):
+    simple = unicodedata.normalize("NFKD", nombre).encode("ascii", "ignore").decode("ascii")
+    if simple == nombre:
+        return {"filename": nombre}
+    return {"filename": simple, "filename*": f"UTF-8''{quote(nombre, safe='!#$&+-.^_`|~')}"}
 
 
 # -------------------- MODIFICAR DOCUMENTO -------------------- #
-@app.route("/proyectos/<int:idProyecto>/documentos/<int:idDocumento>", methods=["PUT"])
+@bp.route("/proyectos/<int:idProyecto>/documentos/<int:idDocumento>", methods=["PUT"])
 def modificar_documento_endpoint(idProyecto, idDocumento):
     """
     Endpoint para modificar un documento existente.
@@ -233,6 +639,12 @@ def modificar_documento_endpoint(idProyecto, idDocumento):
     if not nombre or not descripcion:
         return jsonify({"mensaje": "Faltan campos obligatorios"}), 400
 
+    if archivo and _modo_async():
+        job_id = funcs.modificar_documento_async(idDocumento, nombre, descripcion, archivo.stream)
+        if job_id is None:
+            return jsonify({"mensaje": "No se encontró el documento con ese ID"}), 404
+        return _respuesta_job(job_id, "Documento actualizado, reemplazando archivo en SharePoint")
+
     # --- 1. Si hay archivo, reemplazar en SharePoint y actualizar BD ---
     nueva_url = None
     if archivo:
@@ -244,9 +656,9 @@ def modificar_documento_endpoint(idProyecto, idDocumento):
 
         # --- Actualizar en SharePoint ---
         try:
-            contenido_bytes = archivo.read() if archivo else None
-
-            nueva_url = funcs.modificar_documento_sharepoint(sharepoint_id, contenido_bytes)
+            nueva_url = funcs.modificar_documento_sharepoint(
+                sharepoint_id, archivo.stream, upload_id=request.form.get("upload_id")
+            )
         except Exception as e:
             return jsonify({"error": f"No se pudo actualizar en SharePoint: {str(e)}"}), 500
 
@@ -263,8 +675,14 @@ def modificar_documento_endpoint(idProyecto, idDocumento):
 
 
 # -------------------- ELIMINAR DOCUMENTO -------------------- #
-@app.route("/proyectos/<int:idProyecto>/documentos/<int:idDocumento>", methods=["DELETE"])
+@bp.route("/proyectos/<int:idProyecto>/documentos/<int:idDocumento>", methods=["DELETE"])
 def eliminar_documento_endpoint(idProyecto, idDocumento):
+    if _modo_async():
+        existia, job_id = funcs.eliminar_documento_async(idDocumento)
+        if not existia:
+            return jsonify({"mensaje": "No se encontró el documento con ese ID"}), 404
+        return _respuesta_job(job_id, "Documento eliminado, eliminando archivo en SharePoint")
+
     try:
         eliminado = funcs.eliminar_documento(idDocumento)
     except Exception as e:
@@ -273,4 +691,74 @@ def eliminar_documento_endpoint(idProyecto, idDocumento):
     if not eliminado:
         return jsonify({"mensaje": "No se encontró el documento con ese ID"}), 404
 
-    return jsonify({"mensaje": "Documento eliminado correctamente"})
\ No newline at end of file
+    return jsonify({"mensaje": "Documento eliminado correctamente"})
+
+"""-----------------------------------------------------------------------
+                       BÚSQUEDA
+-----------------------------------------------------------------------"""
+
+# -------------------- BUSCAR PROYECTOS Y DOCUMENTOS -------------------- #
+# GET /buscar?q=texto&tipo=todos|proyectos|documentos&limit=20&after=<cursor>
+@bp.route("/buscar", methods=["GET"])
+def buscar_endpoint():
+    texto = (request.args.get("q") or "").strip()
+    if not texto:
+        return jsonify({"mensaje": "Falta el texto a buscar (q)"}), 400
+
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        resultados_raw, siguiente = funcs.buscar(
+            texto, request.args.get("tipo", "todos"), limit, request.args.get("after")
+        )
+    except ValueError as e:
+        return jsonify({"mensaje": str(e)}), 400
+
+    resultados = [
+        {
+            "tipo": r["tipo"],
+            "id": r["id"],
+            "idProyecto": r["proyecto_id"],
+            "nombre": r["nombre"],
+            "descripcion": r["descripcion"],
+            "url": r["url"],
+            "fecha": r["fecha_creacion"],
+            "relevancia": round(r["relevancia"], 4)
+        }
+        for r in resultados_raw
+    ]
+
+    return jsonify({"datos": resultados, "siguiente": siguiente})
+
+
+"""-----------------------------------------------------------------------
+                       EXPORTACIÓN
+-----------------------------------------------------------------------"""
+# -------------------- EXPORTAR PROYECTOS O DOCUMENTOS -------------------- #
+# Descarga completa en NDJSON (una fila JSON por línea) o CSV, enviada por bloques mientras se lee:
+#   /exportar/proyectos?formato=ndjson|csv
+#   /exportar/documentos?formato=ndjson|csv[&proyecto=<id>]
+# Admite "fields" como los listados. No se cachea.
+@bp.route("/exportar/<any(proyectos, documentos):tipo>", methods=["GET"])
+def exportar_endpoint(tipo):
+    formato = request.args.get("formato", "ndjson")
+    proyecto_id = request.args.get("proyecto")
+    if proyecto_id is not None and not proyecto_id.isdigit():
+        return jsonify({"mensaje": "El parámetro proyecto debe ser un ID numérico"}), 400
+
+    try:
+        exportacion = funcs.exportar(
+            tipo, formato, request.args.get("fields"), int(proyecto_id) if proyecto_id else None
+        )
+    except ValueError as e:
+        return jsonify({"mensaje": str(e)}), 400
+    except PoolTimeoutError:
+        respuesta = jsonify({"mensaje": "Hay demasiadas exportaciones en curso, vuelve a intentarlo"})
+        respuesta.headers["Retry-After"] = "10"
+        return respuesta, 503
+
+    response = Response(exportacion, mimetype=FORMATOS[formato])
+    response.call_on_close(exportacion.cerrar)  # devuelve la conexión aunque el cliente corte la descarga
+    response.headers["Content-Disposition"] = f'attachment; filename="{tipo}.{formato}"'
+    response.headers["X-Accel-Buffering"] = "no"  # que un proxy (nginx) no acumule la respuesta
+    return response
+
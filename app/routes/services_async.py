@@ -0,0 +1,445 @@
+import asyncio
+import json
+import re
+from flask.json.provider import DefaultJSONProvider
+from python_multipart.multipart import parse_options_header
+from starlette.exceptions import HTTPException
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Route
+from app.utils import funciones as funcs
+from app.utils import funciones_async as afuncs
+from app.utils import metricas
+from app.utils.archivos import HashingSpooledFile
+from app.config.config import CORS_ORIGINS, METRICS_CONFIG, UPLOAD_CONFIG
+
+# Rutas del modo asyncio (ver app/asgi.py): las subidas, eliminaciones y escrituras, con las mismas
+# URLs, cuerpos, mensajes y códigos de estado que las de services.py. El resto de rutas (lecturas
+# cacheadas, exportación, jobs...) y las peticiones OPTIONS (CORS) las sigue atendiendo Flask.
+
+# -------------------- RESPUESTAS -------------------- #
+# JSON igual que jsonify de Flask (claves ordenadas, compacto y con salto de línea final)
+class JSONFlask(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        texto = json.dumps(content, default=DefaultJSONProvider.default, ensure_ascii=True,
+                           sort_keys=True, separators=(",", ":"))
+        return (texto + "\n").encode("utf-8")
+
+def jsonify(content, status_code=200, headers=None):
+    return JSONFlask(content, status_code, headers)
+
+async def _get_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise HTTPException(400, "El cuerpo de la petición no es un JSON válido")
+
+# -------------------- MODO ASÍNCRONO (OUTBOX) -------------------- #
+# Igual que en services.py: "?async=true" o "Prefer: respond-async" encola la operación en SharePoint
+def _modo_async(request):
+    return (request.query_params.get("async", "").lower() in ("1", "true")
+            or "respond-async" in request.headers.get("Prefer", ""))
+
+def _respuesta_job(job_id, mensaje, **datos):
+    if job_id is None:
+        return jsonify({"mensaje": mensaje, "job_id": job_id, **datos})  # No quedó nada pendiente en SharePoint
+    return jsonify({"mensaje": mensaje, "job_id": job_id, **datos}, 202, {"Location": f"/jobs/{job_id}"})
+
+# -------------------- ARCHIVOS SUBIDOS -------------------- #
+class _ParserSubidas(MultiPartParser):
+    """
+    Parser multipart de Starlette que guarda cada archivo en HashingSpooledFile (como AutodocRequest):
+    en memoria hasta SPOOL_MEMORY_MAX y después en disco, con tamaño y SHA-256 calculados al recibirlo.
+    """
+    spool_max_size = UPLOAD_CONFIG["SPOOL_MEMORY_MAX"]
+
+    def on_headers_finished(self):
+        super().on_headers_finished()
+        subido = self._current_part.file
+        if subido is not None:
+            subido.file = HashingSpooledFile(self.spool_max_size, archivo=subido.file)
+
+async def _formulario(request):
+    """
+    Lee el formulario de la petición, como request.form y request.files en Flask
+    (multipart con _ParserSubidas; urlencoded o vacío con el parser de Starlette).
+    Los archivos se cierran con `await form.close()`.
+    """
+    tipo, _ = parse_options_header(request.headers.get("Content-Type", ""))
+    if tipo != b"multipart/form-data":
+        return await request.form()
+    try:
+        return await _ParserSubidas(request.headers, request.stream()).parse()
+    except MultiPartException as e:
+        raise HTTPException(400, e.message)
+
+def _archivo(form, campo):
+    archivo = form.get(campo)
+    return archivo if archivo is not None and not isinstance(archivo, str) else None
+
+"""-----------------------------------------------------------------------
+                       PROYECTOS
+-----------------------------------------------------------------------"""
+
+# -------------------- CREAR UN NUEVO PROYECTO -------------------- #
+async def crear_proyecto_endpoint(request):
+    data = await _get_json(request)
+
+    nombre = data.get("nombre")
+    descripcion = data.get("descripcion")
+
+    if not nombre or not descripcion:
+        return jsonify({"mensaje": "Faltan campos obligatorios"}, 400)
+
+    if _modo_async(request):
+        proyecto_id, job_id = await asyncio.to_thread(funcs.crear_proyecto_async, nombre, descripcion)
+        return _respuesta_job(job_id, "Proyecto registrado, creando carpeta en SharePoint", proyecto_id=proyecto_id)
+
+    try:
+        proyecto_url, id_sharepoint = await afuncs.crear_carpeta_sharepoint(nombre)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo crear la carpeta en SharePoint: {str(e)}"}, 500)
+
+    proyecto_id = await afuncs.crear_proyecto(nombre, descripcion, proyecto_url, id_sharepoint)
+
+    return jsonify({
+        "mensaje": "Proyecto creado correctamente",
+        "proyecto_id": proyecto_id,
+        "proyecto_url": proyecto_url
+    })
+
+# -------------------- MODIFICAR PROYECTO -------------------- #
+async def modificar_proyecto_endpoint(request):
+    id = request.path_params["id"]
+    data = await _get_json(request)
+    if not data:
+        return jsonify({"mensaje": "No se enviaron datos para actualizar"}, 400)
+
+    nombre = data.get("nombre")
+    descripcion = data.get("descripcion")
+
+    if not all([nombre, descripcion]):
+        return jsonify({"mensaje": "Faltan campos obligatorios"}, 400)
+
+    if _modo_async(request):
+        job_id = await asyncio.to_thread(funcs.modificar_proyecto_async, id, nombre, descripcion)
+        if job_id is None:
+            return jsonify({"mensaje": "No se encontró el proyecto con ese ID"}, 404)
+        return _respuesta_job(job_id, "Proyecto actualizado, renombrando carpeta en SharePoint")
+
+    try:
+        proyecto_url = await afuncs.modificar_proyecto_sharepoint(id, nombre)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo actualizar la carpeta en SharePoint: {str(e)}"}, 500)
+
+    actualizado = await afuncs.modificar_proyecto_bbdd(id, nombre, descripcion, proyecto_url)
+
+    if not actualizado:
+        return jsonify({"mensaje": "No se pudo actualizar en la BBDD"}, 404)
+
+    return jsonify({"mensaje": "Proyecto actualizado correctamente"})
+
+# -------------------- ELIMINAR PROYECTO -------------------- #
+async def eliminar_proyecto_endpoint(request):
+    id = request.path_params["id"]
+    if _modo_async(request):
+        existia, job_id = await asyncio.to_thread(funcs.eliminar_proyecto_async, id)
+        if not existia:
+            return jsonify({"mensaje": "No se encontró el proyecto con ese ID"}, 404)
+        return _respuesta_job(job_id, "Proyecto eliminado, eliminando carpeta en SharePoint")
+
+    try:
+        eliminado = await afuncs.eliminar_proyecto(id)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo eliminar el proyecto: {str(e)}"}, 500)
+
+    if not eliminado:
+        return jsonify({"mensaje": "No se encontró el proyecto con ese ID"}, 404)
+
+    return jsonify({"mensaje": "Proyecto eliminado correctamente"})
+
+# -------------------- ELIMINAR VARIOS PROYECTOS -------------------- #
+# Body JSON: {"ids": [1, 2, 3]}. Devuelve un resultado por proyecto (207 si alguno falló).
+async def eliminar_proyectos_lote_endpoint(request):
+    ids = _ids_lote(await _json_opcional(request))
+    if ids is None:
+        return jsonify({"mensaje": _MENSAJE_IDS_LOTE}, 400)
+
+    try:
+        resultados = await afuncs.eliminar_proyectos_lote(ids)
+    except Exception as e:
+        return jsonify({"error": f"No se pudieron eliminar los proyectos: {str(e)}"}, 500)
+
+    return _respuesta_lote(resultados, "proyectos")
+
+# Como request.get_json(silent=True): None si el cuerpo no es JSON
+async def _json_opcional(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+# Valida el body {"ids": [...]} de las eliminaciones por lotes (sin duplicados, en orden)
+# Entre 1 y BATCH_MAX_IDS IDs válidos (ver funcs.id_valido); si no, None (400 con _MENSAJE_IDS_LOTE)
+_MENSAJE_IDS_LOTE = f"Se esperaba {{\"ids\": [...]}} con entre 1 y {UPLOAD_CONFIG['BATCH_MAX_IDS']} IDs enteros positivos"
+
+def _ids_lote(data):
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not 1 <= len(ids) <= UPLOAD_CONFIG["BATCH_MAX_IDS"] or not all(funcs.id_valido(i) for i in ids):
+        return None
+    return list(dict.fromkeys(ids))
+
+def _respuesta_lote(resultados, tipo):
+    correctos = sum(1 for r in resultados if r["ok"])
+    return jsonify({
+        "mensaje": f"{correctos} de {len(resultados)} {tipo} eliminados",
+        "resultados": resultados
+    }, 200 if correctos == len(resultados) else 207)
+
+"""-----------------------------------------------------------------------
+                       DOCUMENTOS
+-----------------------------------------------------------------------"""
+
+# -------------------- SUBIR DOCUMENTO (ARCHIVO) A SHAREPOINT Y REGISTRARLO EN LA BBDD -------------------- #
+async def crear_documento_endpoint(request):
+    idProyecto = request.path_params["idProyecto"]
+    form = await _formulario(request)
+    try:
+        return await _crear_documento(request, idProyecto, form)
+    finally:
+        await form.close()
+
+async def _crear_documento(request, idProyecto, form):
+    archivo = _archivo(form, "file")
+    if archivo is None:
+        return jsonify({"mensaje": "No se recibió archivo"}, 400)
+
+    nombre = form.get("nombre")
+    descripcion = form.get("descripcion")
+
+    if not nombre or not descripcion or not archivo.filename:
+        return jsonify({"mensaje": "Faltan campos obligatorios"}, 400)
+
+    if _modo_async(request):
+        documento_id, job_id = await asyncio.to_thread(
+            funcs.crear_documento_async, idProyecto, nombre, descripcion, archivo.filename, archivo.file
+        )
+        return _respuesta_job(job_id, "Documento registrado, subiendo archivo a SharePoint", documento_id=documento_id)
+
+    folder_id = await afuncs.obtener_info_proyecto(idProyecto)
+
+    try:
+        archivo_url, archivo_id = await afuncs.subir_archivo_sharepoint(
+            archivo.filename, archivo.file, folder_id, upload_id=form.get("upload_id")
+        )
+    except Exception as e:
+        return jsonify({"error": f"No se pudo subir el archivo a SharePoint: {str(e)}"}, 500)
+
+    documento_id = await afuncs.crear_documento(idProyecto, nombre, descripcion, archivo_url, archivo_id)
+
+    return jsonify({
+        "mensaje": "Documento creado correctamente",
+        "documento_id": documento_id,
+        "url": archivo_url,
+        "tamano": archivo.file.size,
+        "sha256": archivo.file.sha256
+    })
+
+# -------------------- SUBIR VARIOS DOCUMENTOS A LA VEZ -------------------- #
+# Igual que en services.py: varios "files" y, opcionalmente, "nombres" y "descripciones" en el mismo orden.
+async def crear_documentos_lote_endpoint(request):
+    idProyecto = request.path_params["idProyecto"]
+    form = await _formulario(request)
+    try:
+        return await _crear_documentos_lote(idProyecto, form)
+    finally:
+        await form.close()
+
+async def _crear_documentos_lote(idProyecto, form):
+    archivos = [a for a in form.getlist("files") if not isinstance(a, str) and a.filename]
+    if not archivos:
+        return jsonify({"mensaje": "No se recibieron archivos"}, 400)
+    if len(archivos) > UPLOAD_CONFIG["BATCH_MAX_FILES"]:
+        return jsonify({"mensaje": f"Máximo {UPLOAD_CONFIG['BATCH_MAX_FILES']} archivos por petición"}, 400)
+    repetidos = funcs.nombres_repetidos([a.filename for a in archivos])
+    if repetidos:
+        return jsonify({"mensaje": f"Hay archivos con el mismo nombre en el lote: {', '.join(repetidos)}"}, 400)
+
+    nombres = form.getlist("nombres")
+    descripciones = form.getlist("descripciones")
+    descripcion_comun = form.get("descripcion", "")
+
+    lote = [
+        {
+            "nombre": nombres[i] if i < len(nombres) and nombres[i] else archivo.filename,
+            "descripcion": descripciones[i] if i < len(descripciones) else descripcion_comun,
+            "filename": archivo.filename,
+            "stream": archivo.file
+        }
+        for i, archivo in enumerate(archivos)
+    ]
+
+    try:
+        resultados = await afuncs.subir_documentos_lote(idProyecto, lote)
+    except Exception as e:
+        return jsonify({"error": f"No se pudieron subir los documentos: {str(e)}"}, 500)
+
+    correctos = sum(1 for r in resultados if r["ok"])
+    if correctos == 0:
+        codigo = 500
+    elif correctos < len(resultados):
+        codigo = 207
+    else:
+        codigo = 200
+
+    return jsonify({
+        "mensaje": f"{correctos} de {len(resultados)} documentos subidos correctamente",
+        "resultados": resultados
+    }, codigo)
+
+# -------------------- ELIMINAR VARIOS DOCUMENTOS -------------------- #
+async def eliminar_documentos_lote_endpoint(request):
+    idProyecto = request.path_params["idProyecto"]
+    ids = _ids_lote(await _json_opcional(request))
+    if ids is None:
+        return jsonify({"mensaje": _MENSAJE_IDS_LOTE}, 400)
+
+    try:
+        resultados = await afuncs.eliminar_documentos_lote(idProyecto, ids)
+    except Exception as e:
+        return jsonify({"error": f"No se pudieron eliminar los documentos: {str(e)}"}, 500)
+
+    return _respuesta_lote(resultados, "documentos")
+
+# -------------------- MODIFICAR DOCUMENTO -------------------- #
+async def modificar_documento_endpoint(request):
+    idDocumento = request.path_params["idDocumento"]
+    form = await _formulario(request)
+    try:
+        return await _modificar_documento(request, idDocumento, form)
+    finally:
+        await form.close()
+
+async def _modificar_documento(request, idDocumento, form):
+    archivo = _archivo(form, "file")
+    if archivo is not None and not archivo.filename:
+        archivo = None  # campo "file" vacío, como en Flask
+    nombre = form.get("nombre")
+    descripcion = form.get("descripcion")
+
+    if not nombre or not descripcion:
+        return jsonify({"mensaje": "Faltan campos obligatorios"}, 400)
+
+    if archivo and _modo_async(request):
+        job_id = await asyncio.to_thread(funcs.modificar_documento_async, idDocumento, nombre, descripcion, archivo.file)
+        if job_id is None:
+            return jsonify({"mensaje": "No se encontró el documento con ese ID"}, 404)
+        return _respuesta_job(job_id, "Documento actualizado, reemplazando archivo en SharePoint")
+
+    nueva_url = None
+    if archivo:
+        try:
+            sharepoint_id = await afuncs.obtener_info_documento(idDocumento)
+        except Exception as e:
+            return jsonify({"error": f"No se encontró el documento en SharePoint: {str(e)}"}, 404)
+
+        try:
+            nueva_url = await afuncs.modificar_documento_sharepoint(
+                sharepoint_id, archivo.file, upload_id=form.get("upload_id")
+            )
+        except Exception as e:
+            return jsonify({"error": f"No se pudo actualizar en SharePoint: {str(e)}"}, 500)
+
+    try:
+        actualizado = await afuncs.modificar_documento_bbdd(idDocumento, nombre, descripcion, nueva_url)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo actualizar en la base de datos: {str(e)}"}, 500)
+
+    if not actualizado:
+        return jsonify({"mensaje": "No se encontró el documento con ese ID"}, 404)
+
+    return jsonify({"mensaje": "Documento actualizado correctamente"})
+
+# -------------------- ELIMINAR DOCUMENTO -------------------- #
+async def eliminar_documento_endpoint(request):
+    idDocumento = request.path_params["idDocumento"]
+    if _modo_async(request):
+        existia, job_id = await asyncio.to_thread(funcs.eliminar_documento_async, idDocumento)
+        if not existia:
+            return jsonify({"mensaje": "No se encontró el documento con ese ID"}, 404)
+        return _respuesta_job(job_id, "Documento eliminado, eliminando archivo en SharePoint")
+
+    try:
+        eliminado = await afuncs.eliminar_documento(idDocumento)
+    except Exception as e:
+        return jsonify({"error": f"No se pudo eliminar el documento: {str(e)}"}, 500)
+
+    if not eliminado:
+        return jsonify({"mensaje": "No se encontró el documento con ese ID"}, 404)
+
+    return jsonify({"mensaje": "Documento eliminado correctamente"})
+
+
+# -------------------- TIEMPOS POR REQUEST -------------------- #
+class _MedirPeticion:
+    """
+    Middleware ASGI con las mismas métricas que las rutas de Flask (ver services.py):
+    cabecera Server-Timing e histograma por ruta, con la ruta escrita como en Flask (/proyectos/<int:id>).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        tiempos = metricas.iniciar_peticion()
+        if tiempos is None:
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def enviar(mensaje):
+            nonlocal status
+            if mensaje["type"] == "http.response.start":
+                status = mensaje["status"]
+                if METRICS_CONFIG["SERVER_TIMING"]:
+                    cabecera = (b"server-timing", tiempos.server_timing().encode("latin-1"))
+                    mensaje = {**mensaje, "headers": [*mensaje.get("headers", ()), cabecera]}
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = _RUTAS_FLASK.get(scope.get("endpoint"), "unmatched")
+            metricas.finalizar_peticion(tiempos, scope["method"], ruta, status)
+
+def _ruta_flask(path):
+    # "/proyectos/{id:int}" -> "/proyectos/<int:id>"
+    return re.sub(r"\{(\w+):(\w+)\}", r"<\2:\1>", path)
+
+# CORS en cada ruta (las respuestas a OPTIONS las da Flask-CORS, ver app/asgi.py) y tiempos de la petición
+_MIDDLEWARE = [
+    Middleware(_MedirPeticion),
+    Middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=["*"], allow_headers=["*"]),
+]
+_MAX_SUBIDA = UPLOAD_CONFIG["MAX_UPLOAD_SIZE"]  # 413 si la petición es mayor (como MAX_CONTENT_LENGTH en Flask)
+
+RUTAS = [
+    Route("/proyectos", crear_proyecto_endpoint, methods=["POST"], middleware=_MIDDLEWARE),
+    Route("/proyectos", eliminar_proyectos_lote_endpoint, methods=["DELETE"], middleware=_MIDDLEWARE),
+    Route("/proyectos/{id:int}", modificar_proyecto_endpoint, methods=["PUT"], middleware=_MIDDLEWARE),
+    Route("/proyectos/{id:int}", eliminar_proyecto_endpoint, methods=["DELETE"], middleware=_MIDDLEWARE),
+    Route("/proyectos/{idProyecto:int}/documentos", crear_documento_endpoint, methods=["POST"],
+          middleware=_MIDDLEWARE, max_body_size=_MAX_SUBIDA),
+    Route("/proyectos/{idProyecto:int}/documentos", eliminar_documentos_lote_endpoint, methods=["DELETE"], middleware=_MIDDLEWARE),
+    Route("/proyectos/{idProyecto:int}/documentos/lote", crear_documentos_lote_endpoint, methods=["POST"],
+          middleware=_MIDDLEWARE, max_body_size=_MAX_SUBIDA),
+    Route("/proyectos/{idProyecto:int}/documentos/{idDocumento:int}", modificar_documento_endpoint, methods=["PUT"],
+          middleware=_MIDDLEWARE, max_body_size=_MAX_SUBIDA),
+    Route("/proyectos/{idProyecto:int}/documentos/{idDocumento:int}", eliminar_documento_endpoint, methods=["DELETE"],
+          middleware=_MIDDLEWARE),
+]
+
+_RUTAS_FLASK = {ruta.endpoint: _ruta_flask(ruta.path) for ruta in RUTAS}
@@ -0,0 +1,45 @@
+import hashlib
+from tempfile import SpooledTemporaryFile
+from flask import Request
+
+
+class HashingSpooledFile:
+    """
+    Fichero temporal para los archivos subidos por el frontend.
+    - Se mantiene en memoria hasta `max_size` bytes y después pasa a disco,
+      así el consumo de RAM por subida no depende del tamaño del archivo.
+    - Calcula tamaño y SHA-256 mientras Werkzeug escribe el multipart,
+      sin tener que volver a leer el archivo.
+    - `archivo`: fichero temporal ya creado (p. ej. el de Starlette en el modo asyncio).
+    """
+
+    def __init__(self, max_size, archivo=None):
+        self._file = archivo if archivo is not None else SpooledTemporaryFile(max_size=max_size, mode="w+b")
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, tell, close... se delegan en el fichero temporal
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class AutodocRequest(Request):
+    """
+    Request de Flask que guarda los archivos subidos en HashingSpooledFile.
+    """
+    spool_max_size = 1024 * 1024  # se sobrescribe con UPLOAD_CONFIG["SPOOL_MEMORY_MAX"]
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpooledFile(self.spool_max_size)
\ No newline at end of file
@@ -0,0 +1,236 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, jsonify, request
+
+from app.config.config import CACHE_CONFIG
+from app.db import queries as db # Consultas a la BBDD
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+
+def etiqueta_texto(tag):
+    """
+    Etiqueta como texto: "proyectos", ("proyecto", 3) -> "proyecto:3" (así se guarda en la BBDD).
+    """
+    return tag if isinstance(tag, str) else ":".join(str(parte) for parte in tag)
+
+
+class SharedInvalidations:
+    """
+    Invalidaciones compartidas entre procesos en la BBDD (tablas autodoc.cache_*, migración 0006).
+    - Cada invalidación incrementa autodoc.cache_generacion y guarda esa versión en sus etiquetas
+      (autodoc.cache_invalidaciones, una fila por etiqueta).
+    - La fila de la generación se bloquea hasta el COMMIT: las versiones se confirman en orden,
+      así quien lee "version > última leída" no se salta ninguna.
+    """
+
+    def __init__(self, get_repositorio):
+        self._get_repositorio = get_repositorio  # el pool se crea al usarlo por primera vez
+
+    def publish(self, tags):
+        self._get_repositorio().execute(db.PUBLISH_CACHE_INVALIDATION, (tags,))
+
+    def read(self, since):
+        """
+        Devuelve (versión actual, etiquetas invalidadas después de `since`).
+        Con `since` None solo la versión actual (la caché del proceso aún está vacía).
+        """
+        repositorio = self._get_repositorio()
+        if since is None:
+            return repositorio.fetch_one(db.GET_CACHE_GENERATION)["version"], []
+        filas = repositorio.fetch_many(db.GET_CACHE_INVALIDATIONS, (since,))
+        return max((fila["version"] for fila in filas), default=since), [fila["etiqueta"] for fila in filas]
+
+
+class ResponseCache:
+    """
+    Caché en memoria (por proceso) de respuestas JSON ya serializadas.
+    - LRU acotada a `max_entries` y con caducidad `ttl` en segundos.
+    - Cada entrada lleva etiquetas (p. ej. ("proyecto", 3)); las escrituras
+      invalidan solo las etiquetas afectadas.
+    - Si hay una invalidación mientras se genera una respuesta, esa
+      respuesta no se guarda (evita cachear datos anteriores a la escritura).
+    - Con share(), las invalidaciones se publican para el resto de procesos y cada proceso lee las
+      suyas como mucho cada `sync_interval` segundos, al consultar la caché (los aciertos dentro del
+      intervalo no tocan la BBDD). Una escritura en otro worker se ve, como mucho, tras ese intervalo;
+      las de este proceso, al momento. Si no se pueden leer, no se sirve nada de la caché.
+    """
+
+    def __init__(self, max_entries=1000, ttl=30, sync_interval=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clave -> (expira, body, etag, etiquetas)
+        self._tags = {}  # etiqueta -> set(claves)
+        self._generation = 0  # contador de invalidaciones
+        self._shared = None  # SharedInvalidations (ver share())
+        self._version = None  # última versión compartida aplicada
+        self._next_sync = 0  # time.monotonic() de la siguiente lectura de invalidaciones
+        self._shared_error = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        return self._shared
+
+    def share(self, shared):
+        """
+        Comparte las invalidaciones con el resto de procesos a través de `shared` (SharedInvalidations).
+        """
+        self._shared = shared
+
+    def get(self, key):
+        if not self._sync():
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def snapshot(self):
+        """
+        Estado de la caché antes de generar una respuesta (ver set()).
+        """
+        with self._lock:
+            return self._generation
+
+    def set(self, key, body, etag, tags, snapshot):
+        tags = tuple(etiqueta_texto(tag) for tag in tags)
+        with self._lock:
+            if snapshot != self._generation:
+                return  # Hubo una escritura mientras se generaba: no cachear
+            if self._shared is not None and self._version is None:
+                return  # Aún no se sabe desde qué versión aplicar las invalidaciones de otros procesos
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, body, etag, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *tags):
+        """
+        Elimina todas las entradas con alguna de las etiquetas indicadas, en este proceso y en el resto.
+        """
+        tags = self.invalidate_local(*tags)
+        if self._shared is None or not tags:
+            return
+        try:
+            self._shared.publish(tags)
+        except Exception:
+            # La escritura ya está confirmada: los otros procesos la verán como mucho al caducar (ttl)
+            logger.exception(f"[CACHE] Could not publish invalidation of {tags}, other workers may serve stale responses for {self.ttl}s.")
+
+    def invalidate_local(self, *tags):
+        """
+        Elimina las entradas con alguna de las etiquetas solo en este proceso.
+        Devuelve las etiquetas como texto (las que hay que publicar, ver invalidate()).
+        """
+        tags = sorted({etiqueta_texto(tag) for tag in tags})
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+        return tags
+
+    def _sync(self):
+        """
+        Aplica las invalidaciones publicadas desde la última lectura (también las de este proceso),
+        como mucho una vez cada `sync_interval` segundos. False si no se han podido leer.
+        """
+        if self._shared is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now < self._next_sync:
+                return not self._shared_error  # otro hilo ya ha leído (o lo está haciendo) en este intervalo
+            self._next_sync = now + self.sync_interval
+            since = self._version
+        try:
+            version, tags = self._shared.read(since)
+        except Exception:
+            if not self._shared_error:  # un aviso por caída, no uno por petición
+                logger.exception("[CACHE] Could not read shared invalidations, serving responses without cache.")
+            self._shared_error = True
+            return False
+        if self._shared_error:
+            logger.info("[CACHE] Shared invalidations readable again.")
+            self._shared_error = False
+        with self._lock:
+            if tags:
+                self._generation += 1
+                for tag in tags:
+                    for key in self._tags.pop(tag, ()):
+                        self._remove(key)
+            if self._version is None or version > self._version:
+                self._version = version
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[3]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+response_cache = ResponseCache(CACHE_CONFIG["MAX_ENTRIES"], CACHE_CONFIG["TTL"], CACHE_CONFIG["SYNC_INTERVAL"])  # se comparte en funciones.py
+
+
+def _json_response(body, etag):
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"  # el navegador revalida siempre con If-None-Match
+    return response.make_conditional(request)  # 304 si If-None-Match coincide
+
+
+def cached_json(key, tags, build):
+    """
+    Devuelve la respuesta JSON de `build()` pasando por la caché, con ETag y soporte de 304.
+    - `build()` devuelve los datos a serializar, o una respuesta Flask (p. ej. un 404)
+      que se devuelve tal cual y no se cachea.
+    - `tags` son las etiquetas que invalidarán la entrada (ver ResponseCache.invalidate).
+    - Al consultar la caché se aplican las invalidaciones de otros procesos, como mucho cada
+      CACHE_SYNC_INTERVAL segundos (ver ResponseCache).
+    """
+    enabled = CACHE_CONFIG["ENABLED"]
+    if enabled:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return _json_response(*cached)
+        snapshot = response_cache.snapshot()
+
+    data = build()
+    if isinstance(data, (Response, tuple)):
+        return data
+
+    body = jsonify(data).get_data()
+    etag = hashlib.sha1(body).hexdigest()
+    if enabled:
+        response_cache.set(key, body, etag, tuple(tags), snapshot)
+    return _json_response(body, etag)
\ No newline at end of file
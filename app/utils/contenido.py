@@ -0,0 +1,163 @@
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Metadatos de un archivo de SharePoint necesarios para servirlo (ver funciones.obtener_metadatos_contenido)
+Metadatos = namedtuple("Metadatos", ["item_id", "nombre", "size", "etag", "modificado", "mimetype", "download_url"])
+
+_TEMPORAL = ".tmp"
+_TEMPORAL_MAX_EDAD = 3600  # descargas a medias de procesos que murieron: se borran en el siguiente recorte
+
+
+class DescargaIncompleta(Exception):
+    """
+    Graph devolvió menos (o más) bytes de los que indicaban los metadatos del archivo.
+    """
+
+
+class CacheContenido:
+    """
+    Caché en disco del contenido de los archivos de SharePoint, compartida por los workers.
+    - Cada archivo se guarda por id de SharePoint + eTag: al reemplazar el archivo cambia el eTag
+      y la versión anterior deja de usarse (se acaba borrando por antigüedad).
+    - LRU acotada a `max_bytes`: cada acierto actualiza la fecha de modificación del archivo
+      y al guardar uno nuevo se borran los menos usados hasta volver al límite.
+    - Los archivos se escriben en un temporal y se renombran al terminar: nunca se sirve uno a medias.
+    - Una sola descarga por archivo y proceso: las peticiones simultáneas del mismo archivo esperan a la primera.
+    - Los metadatos (eTag, tamaño, URL de descarga) se guardan en memoria durante `ttl` segundos.
+    """
+
+    def __init__(self, config):
+        self.directorio = config["DIR"]
+        self.max_bytes = config["MAX_BYTES"]
+        self.max_file_bytes = min(config["MAX_FILE_BYTES"], self.max_bytes)
+        self.ttl = config["METADATA_TTL"]
+        self.max_entries = config["METADATA_MAX_ENTRIES"]
+        self._lock = threading.Lock()
+        self._metadatos = OrderedDict()  # item_id -> (expira, Metadatos)
+        self._descargas = {}  # ruta -> Lock de la descarga en curso
+
+    # --------------- Metadatos (en memoria, por proceso) --------------- #
+    def metadatos(self, item_id, cargar):
+        """
+        Metadatos del archivo `item_id`; si no están o han caducado se piden con `cargar(item_id)`
+        (None si el archivo no existe, y no se guarda).
+        """
+        with self._lock:
+            entrada = self._metadatos.get(item_id)
+            if entrada is not None and entrada[0] > time.monotonic():
+                self._metadatos.move_to_end(item_id)
+                return entrada[1]
+        metadatos = cargar(item_id)  # sin el lock: es una llamada a Graph
+        if metadatos is not None:
+            with self._lock:
+                self._metadatos[item_id] = (time.monotonic() + self.ttl, metadatos)
+                self._metadatos.move_to_end(item_id)
+                while len(self._metadatos) > self.max_entries:
+                    self._metadatos.popitem(last=False)
+        return metadatos
+
+    def invalidar(self, item_id):
+        """
+        Olvida los metadatos de `item_id` (p. ej. al reemplazar el archivo desde este proceso).
+        """
+        with self._lock:
+            self._metadatos.pop(item_id, None)
+
+    # --------------- Archivos (en disco, compartidos) --------------- #
+    def cacheable(self, metadatos):
+        return metadatos.size is not None and 0 < metadatos.size <= self.max_file_bytes
+
+    def _ruta(self, metadatos):
+        clave = hashlib.sha256(f"{metadatos.item_id}\0{metadatos.etag}".encode()).hexdigest()
+        return os.path.join(self.directorio, clave)
+
+    def buscar(self, metadatos):
+        """
+        Ruta del archivo cacheado (y lo marca como usado), o None si no está.
+        """
+        ruta = self._ruta(metadatos)
+        try:
+            os.utime(ruta)  # la fecha de modificación es la del último uso (LRU)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def guardar(self, metadatos, descargar):
+        """
+        Guarda el archivo en la caché y devuelve su ruta. `descargar()` devuelve un generador con sus bytes.
+        Si otra petición de este proceso ya lo está descargando, espera a que termine y usa su archivo.
+        """
+        ruta = self._ruta(metadatos)
+        with self._lock:
+            descarga = self._descargas.setdefault(ruta, threading.Lock())
+        try:
+            with descarga:
+                existente = self.buscar(metadatos)
+                if existente is not None:
+                    return existente
+                self._descargar(ruta, metadatos, descargar)
+        finally:
+            with self._lock:
+                if self._descargas.get(ruta) is descarga:
+                    del self._descargas[ruta]
+        self._recortar()
+        return ruta
+
+    def _descargar(self, ruta, metadatos, descargar):
+        os.makedirs(self.directorio, exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}{_TEMPORAL}"
+        inicio = time.perf_counter()
+        try:
+            escritos = 0
+            with open(temporal, "wb") as archivo, contextlib.closing(descargar()) as bloques:
+                for bloque in bloques:
+                    archivo.write(bloque)
+                    escritos += len(bloque)
+            if escritos != metadatos.size:
+                raise DescargaIncompleta(f"Se esperaban {metadatos.size} bytes y se recibieron {escritos}")
+            os.replace(temporal, ruta)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temporal)
+            raise
+        logger.info(f"[CONTENT] Cached {metadatos.item_id} ({metadatos.size} bytes) in {(time.perf_counter() - inicio) * 1000:.0f}ms")
+
+    def _recortar(self):
+        """
+        Borra los archivos menos usados hasta que la caché ocupe como mucho `max_bytes`.
+        """
+        archivos, total, ahora = [], 0, time.time()
+        try:
+            entradas = list(os.scandir(self.directorio))
+        except FileNotFoundError:
+            return
+        for entrada in entradas:
+            try:
+                estado = entrada.stat()
+            except FileNotFoundError:  # otro worker lo ha borrado o renombrado
+                continue
+            if entrada.name.endswith(_TEMPORAL):
+                if ahora - estado.st_mtime > _TEMPORAL_MAX_EDAD:
+                    with contextlib.suppress(OSError):
+                        os.remove(entrada.path)
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+            total += estado.st_size
+        if total <= self.max_bytes:
+            return
+        borrados = 0
+        for _, size, ruta in sorted(archivos):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(ruta)  # quien lo esté enviando ya lo tiene abierto y termina de enviarlo
+                borrados += 1
+            total -= size
+        logger.info(f"[CONTENT] Evicted {borrados} files, cache now {total} bytes")
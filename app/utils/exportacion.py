@@ -0,0 +1,94 @@
+import csv
+import datetime
+import io
+import json
+import logging
+import uuid
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Formato -> tipo MIME de la respuesta
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",  # Flask añade charset=utf-8
+}
+
+
+def _valor(valor):
+    """
+    Fechas en ISO 8601 (tanto en NDJSON como en CSV).
+    """
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    return valor
+
+
+class Exportacion:
+    """
+    Exporta el resultado de una consulta con un cursor de servidor (DECLARE ... / FETCH n):
+    PostgreSQL entrega bloques de `itersize` filas y cada bloque se envía al cliente en cuanto llega,
+    así la memoria no depende del número de filas y el primer byte sale enseguida.
+    - La consulta se lanza al crear el objeto (los errores salen antes de empezar a responder).
+    - La conexión se toma de `pool` y se devuelve en cerrar(), que se llama al terminar
+      la respuesta aunque el cliente corte la descarga (ver Response.call_on_close).
+    - Toda la exportación ve la misma foto de la BBDD (transacción REPEATABLE READ de solo lectura).
+    """
+
+    def __init__(self, pool, query, params, campos, formato, itersize):
+        self.pool = pool
+        self.campos = campos
+        self.formato = formato
+        self.itersize = itersize
+        self.filas = 0
+        self._cursor = None
+        self._conn = pool.get_connection()
+        try:
+            self._conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            self._cursor = self._conn.cursor(name=f"exportacion_{uuid.uuid4().hex}")
+            self._cursor.itersize = itersize
+            self._cursor.execute(query, params)
+        except Exception:
+            self.cerrar()
+            raise
+
+    def __iter__(self):
+        if self.formato == "csv":
+            yield "\ufeff".encode("utf-8")  # BOM: Excel abre el CSV como UTF-8 (tildes)
+            yield self._csv([self.campos])
+        while True:
+            filas = self._cursor.fetchmany(self.itersize)
+            if not filas:
+                break
+            self.filas += len(filas)
+            if self.formato == "csv":
+                yield self._csv([[_valor(v) for v in fila] for fila in filas])
+            else:
+                yield self._ndjson(filas)
+
+    def _ndjson(self, filas):
+        campos = self.campos
+        lineas = [json.dumps(dict(zip(campos, fila)), default=_valor, ensure_ascii=False) for fila in filas]
+        lineas.append("")
+        return "\n".join(lineas).encode("utf-8")
+
+    @staticmethod
+    def _csv(filas):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(filas)
+        return buffer.getvalue().encode("utf-8")
+
+    def cerrar(self):
+        """
+        Cierra el cursor y devuelve la conexión al pool (se puede llamar varias veces).
+        """
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            if self._cursor is not None and not conn.closed:
+                self._cursor.close()
+        except Exception as e:
+            logger.warning(f"[EXPORT] Could not close cursor: {e}")
+        finally:
+            self.pool.release_connection(conn)  # hace rollback de la transacción de lectura
+        logger.info(f"[EXPORT] {self.filas} rows exported ({self.formato}).")
@@ -1,49 +1,127 @@
+import atexit
+import contextvars
+from datetime import datetime
 import mimetypes
 import os
-from flask import g, jsonify
-from app.db.psql_connection_pool import PsqlConnectionPool
-from app.config.config import DB_CONFIG # Configuración de la BBDD
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from flask import jsonify
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from app.db.psql_connection_pool import PsqlConnectionPool, db_cursor
+from app.db.repositorio import PreparedConnection, PreparedCursor, Repositorio, proyectar
+from app.db.filas import DOCUMENTO, PROYECTO
+from app.db.migrador import Migrador
+from app.db.consultas_lentas import detener_capturador
+from app.config.config import DB_CONFIG, GRAPH_CONFIG, UPLOAD_CONFIG, ASYNC_CONFIG, RECONCILE_CONFIG, EXPORT_CONFIG, MIGRATION_CONFIG, CONTENT_CACHE_CONFIG, CACHE_CONFIG # Configuración de la BBDD, Graph, subidas, modo asíncrono, reconciliación, exportación, migraciones, descargas y caché
+from app.utils.graph_client import BATCH_MAX_REQUESTS, GraphClient
+from app.utils.graph_upload import ChunkedUpload, as_stream, obtener_progreso, stream_size
+from app.utils.paginacion import CursorInvalido, codificar_cursor, cortar_pagina, decodificar_cursor
+from app.utils.cache import SharedInvalidations, response_cache # Caché de respuestas GET (se invalida en cada escritura)
+from app.utils.contenido import CacheContenido, Metadatos
+from app.utils.outbox import OutboxWorker, encolar
+from app.utils.reconciliacion import CARPETA_PROVISIONAL, SharePointReconciler
+from app.utils.exportacion import FORMATOS, Exportacion
+from app.utils.programador import detener_programador
+from app.utils import metricas
 from app.db import queries as db # Consultas a la BBDD
-import requests
 
 # Importar variables de entorno para Sharepoint
 SITE_ID = os.getenv("SITE_ID")
 DRIVE_ID = os.getenv("DRIVE_ID")
 
 
-# ------------------ Pool por request ------------------ #
+# ------------------ Pool compartido por proceso ------------------ #
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
 def get_db_pool():
     """
     Devuelve el pool de conexiones de la base de datos.
-    Se almacena en g para que sea único por request.
+    Se crea una única vez por proceso y se comparte entre todas las requests.
+    Al terminar el proceso se cierran todas sus conexiones (ver cerrar_recursos).
     """
-    if "db_pool" not in g:
-        g.db_pool = PsqlConnectionPool(DB_CONFIG)
-        g.db_pool.connect()  # Inicializa el pool si no está creado
-    return g.db_pool
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                pool = PsqlConnectionPool(DB_CONFIG, PreparedCursor, PreparedConnection)  # Consultas como sentencias preparadas
+                pool.connect()  # Abre las conexiones mínimas
+                _db_pool = pool
+    return _db_pool
+
+# Estado de los pools del proceso para GET /metrics (solo los ya creados; no abre conexiones)
+@metricas.registrar_medidor
+def _metricas_pools():
+    gauges = []
+    for nombre, pool in (("main", _db_pool), ("export", _export_pool)):
+        if pool is None:
+            continue
+        stats = pool.stats()
+        etiqueta = (("pool", nombre),)
+        gauges += [
+            ("autodoc_db_pool_connections", etiqueta + (("state", "in_use"),), stats["in_use"]),
+            ("autodoc_db_pool_connections", etiqueta + (("state", "idle"),), stats["idle"]),
+            ("autodoc_db_pool_waiters", etiqueta, stats["waiters"]),
+            ("autodoc_db_pool_max_connections", etiqueta, stats["max"]),
+        ]
+    return gauges
+
+# Acceso a las consultas de queries.py (una conexión del pool solo mientras dura cada consulta)
+_repositorio = None
+
+def get_repositorio():
+    global _repositorio
+    if _repositorio is None:
+        _repositorio = Repositorio(get_db_pool())
+    return _repositorio
+
+# Las escrituras de cualquier worker (API, jobs de la outbox, reconciliación) invalidan la caché de todos
+if CACHE_CONFIG["SHARED"]:
+    response_cache.share(SharedInvalidations(get_repositorio))
+
+# Aplica las migraciones pendientes de app/db/migraciones (ver app/db/migrador.py).
+# Devuelve las migraciones aplicadas (o las que se aplicarían, con dry_run).
+def migrar(dry_run=False, hasta=None, informar=None):
+    return Migrador(get_db_pool(), MIGRATION_CONFIG, informar=informar).ejecutar(dry_run, hasta)
 
 # ----------- MICROSOFT GRAPH ------------ #
 # API que permite acceder a datos de Microsoft 365 (OneDrive, SharePoint, etc.)
+_graph_client = None
+_graph_client_lock = threading.Lock()
+
+def get_graph_client():
+    """
+    Devuelve el cliente de Microsoft Graph (uno por proceso).
+    Mantiene las conexiones keep-alive y el token cacheado entre requests.
+    """
+    global _graph_client
+    if _graph_client is None:
+        with _graph_client_lock:
+            if _graph_client is None:
+                # Leer variables de entorno
+                client = GraphClient(
+                    GRAPH_CONFIG,
+                    os.getenv("TENANT_ID"),
+                    os.getenv("CLIENT_ID"),
+                    os.getenv("CLIENT_SECRET"),
+                )
+                _graph_client = client
+    return _graph_client
+
 # Obtiene un access token para Microsoft Graph usando Client Credentials.
+# El token se reutiliza hasta poco antes de caducar.
 def get_access_token():
-    # Leer variables de entorno
-    TENANT_ID = os.getenv("TENANT_ID")
-    CLIENT_ID = os.getenv("CLIENT_ID")
-    CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-
-    # URL del endpoint de token de Azure AD (OAuth2)
-    # Hacer la petición para obtener el token
-    url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": "https://graph.microsoft.com/.default"
-    }
-    response = requests.post(url, data=data, headers=headers)
-    response.raise_for_status()
-    return response.json()["access_token"]
+    return get_graph_client().tokens.get_token()
+
+# Hace una petición a Microsoft Graph (ruta relativa a GRAPH_CONFIG["BASE_URL"]).
+# Reintenta 429/5xx respetando Retry-After y renueva el token si Graph responde 401.
+def graph_request(method, path, headers=None, **kwargs):
+    return get_graph_client().request(method, path, headers=headers, **kwargs)
 
 # ----------------- PRUEBA ----------------- #
 def saludo():
@@ -54,72 +132,106 @@ def saludo():
 -----------------------------------------------------------------------"""
 
 # Devuelve la lista de proyectos. Si se pasa el parámetro "nombre", filtra por coincidencia parcial.
-def obtener_proyectos(nombre=None):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
-    try:
-        if nombre:
-            cursor.execute(db.GET_PROJECT_BY_NAME, (f"%{nombre}%",))
-        else:
-            cursor.execute(db.GET_ALL_PROJECTS)
-        proyectos = cursor.fetchall()
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
-
-    return proyectos
-
-# Devuelve un proyecto por su ID.
-def obtener_proyecto_por_id(proyecto_id):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(db.GET_PROJECT_BY_ID, (proyecto_id,))
-        proyecto = cursor.fetchone()
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
-
-    return proyecto
+# Las filas son namedtuple con los campos de la API; "fields" limita las columnas leídas (ver app/db/filas.py).
+def obtener_proyectos(nombre=None, fields=None):
+    tipo, columnas = PROYECTO.proyeccion(fields)
+    if nombre:
+        return get_repositorio().fetch_rows(tipo, proyectar(db.GET_PROJECT_BY_NAME, columnas), (f"%{nombre}%",))
+    return get_repositorio().fetch_rows(tipo, proyectar(db.GET_ALL_PROJECTS, columnas))
+
+# Devuelve una página de proyectos ordenados por ID y el cursor de la siguiente (o None).
+# Paginación por cursor: el coste de cada página no depende de lo "profunda" que sea.
+# El ID (clave del cursor) se lee siempre, aunque no esté en "fields".
+def obtener_proyectos_pagina(nombre=None, limit=50, after=None, fields=None):
+    tipo, columnas = PROYECTO.proyeccion(fields, incluir=("idProyecto",))
+    cursor_clave = decodificar_cursor(after)
+    ultimo_id = _clave_entera(cursor_clave, "id") if cursor_clave else 0
+
+    if nombre:
+        proyectos = get_repositorio().fetch_rows(
+            tipo, proyectar(db.GET_PROJECTS_BY_NAME_PAGE, columnas), (f"%{nombre}%", ultimo_id, limit + 1)
+        )
+    else:
+        proyectos = get_repositorio().fetch_rows(tipo, proyectar(db.GET_PROJECTS_PAGE, columnas), (ultimo_id, limit + 1))
+
+    return cortar_pagina(proyectos, limit, lambda p: {"id": p.idProyecto})
+
+# True si `valor` (leído de un JSON) es un ID válido: entero de la columna serial (int4).
+# bool es subclase de int: true/false no son IDs válidos.
+_ID_MAX = 2 ** 31 - 1
+
+def id_valido(valor):
+    return not isinstance(valor, bool) and isinstance(valor, int) and 1 <= valor <= _ID_MAX
+
+# Extrae un ID del cursor de paginación.
+def _clave_entera(cursor_clave, campo):
+    valor = cursor_clave.get(campo)
+    if not id_valido(valor):
+        raise CursorInvalido("El cursor de paginación no es válido")
+    return valor
+
+# Devuelve un proyecto por su ID (namedtuple con los campos de la API) o None.
+def obtener_proyecto_por_id(proyecto_id, fields=None):
+    tipo, columnas = PROYECTO.proyeccion(fields)
+    return get_repositorio().fetch_row(tipo, proyectar(db.GET_PROJECT_BY_ID, columnas), (proyecto_id,))
+
+# Devuelve el detalle de un proyecto (datos, nº de documentos, fecha del último cambio y una página
+# de documentos) con una sola consulta, o None si no existe.
+# El cursor "siguiente" es el mismo que el del listado de documentos.
+def obtener_detalle_proyecto(proyecto_id, limit=50, after=None):
+    cursor_clave = decodificar_cursor(after)
+    after_fecha, after_id = _clave_documento(cursor_clave) if cursor_clave else (None, None)
+
+    fila = get_repositorio().fetch_one(db.GET_PROJECT_DETAIL, {
+        "proyecto_id": proyecto_id,
+        "after_fecha": after_fecha,
+        "after_id": after_id,
+        "limit": limit,
+    })
+    if not fila:
+        return None
+
+    siguiente = None
+    if fila["hay_mas"]:
+        siguiente = codificar_cursor(fecha=fila["ultima_fecha"].isoformat(), id=fila["ultimo_id"])
+
+    return {
+        "idProyecto": fila["proyecto_id"],
+        "nombre": fila["nombre"],
+        "descripcion": fila["descripcion"],
+        "proyecto_url": fila["proyecto_url"],
+        "totalDocumentos": fila["total_documentos"],
+        "ultimaModificacion": fila["ultima_modificacion"],
+        "documentos": {"datos": fila["documentos"], "siguiente": siguiente},
+    }
 
 # Inserta un nuevo proyecto en la base de datos y devuelve el ID
 def crear_proyecto(nombre, descripcion, proyecto_url, id_sharepoint):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            db.CREATE_PROJECT, 
-            (nombre, descripcion, proyecto_url, id_sharepoint)
-        )
-        proyecto_id = cursor.fetchone()["proyecto_id"]
-        conn.commit()
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
+    fila = get_repositorio().execute_returning(
+        db.CREATE_PROJECT,
+        (nombre, descripcion, proyecto_url, id_sharepoint)
+    )[0]
+    proyecto_id = fila["proyecto_id"]
 
+    response_cache.invalidate("proyectos")
     return proyecto_id
 
 # Crear carpeta en Sharepoint para el proyecto
-def crear_carpeta_sharepoint(nombre_carpeta):
-    # Token de acceso a la API de Microsoft Graph
-    token = get_access_token() 
-
+# conflicto: qué hace SharePoint si ya existe una carpeta con ese nombre ("rename": le añade un número, "fail": 409)
+def crear_carpeta_sharepoint(nombre_carpeta, conflicto="rename"):
     # Endpoint para crear carpeta en la raíz del SHAREPOINT
-    url = f"https://graph.microsoft.com/v1.0/sites/{SITE_ID}/drives/{DRIVE_ID}/root/children"
+    url = f"/sites/{SITE_ID}/drives/{DRIVE_ID}/root/children"
     headers = {
-        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
     body = {
         "name": nombre_carpeta,
         "folder": {},
-        "@microsoft.graph.conflictBehavior": "rename"
+        "@microsoft.graph.conflictBehavior": conflicto
     }
 
-    response = requests.post(url, headers=headers, json=body)
+    # Sin reintentos: si Graph ya la hubiera creado, repetir el POST crearía otra ("Nombre 1")
+    response = graph_request("POST", url, headers=headers, json=body, retry=False)
     response.raise_for_status() # Lanza error si falla
     folder_info = response.json() # JSON de Microsoft Graph
 
@@ -128,36 +240,25 @@ def crear_carpeta_sharepoint(nombre_carpeta):
 
 
 def modificar_proyecto_bbdd(proyecto_id, nombre, descripcion, proyecto_url):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(db.UPDATE_PROJECT, (nombre, descripcion, proyecto_url, proyecto_id))
-        conn.commit()
-        # Si ninguna fila fue afectada, el proyecto no existía
-        return cursor.rowcount > 0
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
+    filas = get_repositorio().execute(db.UPDATE_PROJECT, (nombre, descripcion, proyecto_url, proyecto_id))
+    response_cache.invalidate(("proyecto", proyecto_id), "proyectos")
+    # Si ninguna fila fue afectada, el proyecto no existía
+    return filas > 0
 
 def modificar_proyecto_sharepoint(proyecto_id, nuevo_nombre):
     # Obtener folder_id del proyecto
     folder_id = obtener_info_proyecto(proyecto_id)
 
-    # Token de acceso a la API de Microsoft Graph
-    token = get_access_token() 
-
     # Endpoint para actualizar el nombre de la carpeta
-    url = f"https://graph.microsoft.com/v1.0/drives/{DRIVE_ID}/items/{folder_id}"
+    url = f"/drives/{DRIVE_ID}/items/{folder_id}"
     headers = {
-        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
     body = {
         "name": nuevo_nombre
     }
 
-    response = requests.patch(url, headers=headers, json=body)
+    response = graph_request("PATCH", url, headers=headers, json=body)
     response.raise_for_status() # Lanza error si falla
 
     return response.json().get("webUrl")  # Devuelve la nueva URL pública de la carpeta
@@ -166,235 +267,884 @@ def modificar_proyecto_sharepoint(proyecto_id, nuevo_nombre):
 def eliminar_proyecto(proyecto_id):
     """
     Elimina un proyecto dado su ID.
-     - Verifica si el proyecto existe en la BD y obtiene folder_id de SharePoint.
-     - Elimina la carpeta en SharePoint.
-     - Elimina el proyecto en la BD.
+     - Lectura corta: comprueba que existe y obtiene el folder_id de SharePoint.
+     - Elimina la carpeta en SharePoint (sin ninguna conexión a la BBDD tomada).
+     - Escritura corta: elimina el proyecto solo si sigue apuntando a la misma carpeta.
     Devuelve True si se eliminó, False si no existía.
     """
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
-
-    try:
-        # 0. Comprobar si el proyecto existe y obtener folder_id
-        folder_id = obtener_info_proyecto(proyecto_id)
-    
-        # 1. Eliminar carpeta de Sharepoint
-        token = get_access_token()
-        url = f"https://graph.microsoft.com/v1.0/drives/{DRIVE_ID}/items/{folder_id}"
-        headers = {
-            "Authorization": f"Bearer {token}"
-        }
-        response = requests.delete(url, headers=headers)
+    # 0. Comprobar si el proyecto existe y obtener folder_id
+    proyecto = get_repositorio().fetch_one(db.GET_PROJECT_URL_BY_ID, (proyecto_id,))
+    if not proyecto:
+        return False
+    folder_id = proyecto["id_sharepoint"]
+
+    # 1. Eliminar carpeta de Sharepoint
+    if folder_id:
+        response = graph_request("DELETE", f"/drives/{DRIVE_ID}/items/{folder_id}")
         if response.status_code not in (204, 404):
             # 204 = eliminado correctamente, 404 = ya no existía
             raise Exception(f"No se pudo eliminar la carpeta en SharePoint: {response.text}")
 
-        # 2. Eliminar de la BBDD
-        cursor.execute(db.DELETE_PROJECT, (proyecto_id,))
-        if cursor.rowcount == 0:
-            # No existía el proyecto
-            conn.commit()
-            return False
-        conn.commit()
-        return True
-    
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
+    # 2. Eliminar de la BBDD (los documentos se eliminan en cascada) si nadie lo ha cambiado mientras tanto
+    with db_cursor(get_db_pool()) as cursor:
+        cursor.execute(db.DELETE_PROJECT_IF_UNCHANGED, (proyecto_id, folder_id))
+        eliminado = cursor.fetchone() is not None
+        if not eliminado:
+            cursor.execute(db.GET_PROJECT_URL_BY_ID, (proyecto_id,))
+            if cursor.fetchone():
+                raise Exception("El proyecto ha cambiado mientras se eliminaba, vuelve a intentarlo")
+
+    if eliminado:
+        response_cache.invalidate(("proyecto", proyecto_id), "proyectos", ("documentos", proyecto_id))
+    return eliminado
+
+# Elimina varios elementos de SharePoint agrupándolos en llamadas /$batch de hasta 20,
+# que se envían en paralelo. `items` es {clave: id_sharepoint}.
+# Devuelve {clave: None si se eliminó (204) o ya no existía (404), o el mensaje de error}.
+def _eliminar_items_sharepoint(items):
+    client = get_graph_client()
+    claves = list(items)
+    lotes = [claves[i:i + BATCH_MAX_REQUESTS] for i in range(0, len(claves), BATCH_MAX_REQUESTS)]
+
+    def enviar(lote):
+        sub_requests = [
+            {"id": str(n), "method": "DELETE", "url": f"/drives/{DRIVE_ID}/items/{items[clave]}"}
+            for n, clave in enumerate(lote)
+        ]
+        return lote, client.batch(sub_requests)
+
+    errores = {}
+    # Cada hilo con una copia del contexto: sus llamadas a Graph cuentan en las métricas de la request
+    futuros = [get_sharepoint_executor().submit(contextvars.copy_context().run, enviar, lote) for lote in lotes]
+    for futuro, lote in zip(futuros, lotes):
+        try:
+            _, respuestas = futuro.result()
+        except Exception as e:
+            for clave in lote:
+                errores[clave] = f"No se pudo contactar con SharePoint: {e}"
+            continue
+        for n, clave in enumerate(lote):
+            respuesta = respuestas.get(str(n))
+            if respuesta is None:
+                errores[clave] = "SharePoint no devolvió respuesta"
+            elif respuesta["status"] in (204, 404):
+                errores[clave] = None
+            else:
+                errores[clave] = f"SharePoint respondió {respuesta['status']}: {respuesta.get('body')}"
+    return errores
+
+# Elimina varios proyectos (carpetas en SharePoint vía $batch + filas en una transacción).
+# Devuelve un resultado por ID: eliminado, no encontrado o error de SharePoint.
+def eliminar_proyectos_lote(ids):
+    # 1. Lectura corta: IDs de SharePoint
+    filas = {
+        f["proyecto_id"]: f["id_sharepoint"]
+        for f in get_repositorio().fetch_many(db.GET_PROJECTS_SHAREPOINT_BY_IDS, (list(ids),))
+    }
+
+    # 2. SharePoint (sin conexión a la BBDD abierta)
+    errores = _eliminar_items_sharepoint({pid: sp for pid, sp in filas.items() if sp})
+
+    # 3. Borrar en una transacción las filas cuya carpeta ya no existe en SharePoint
+    borrar = [pid for pid in filas if not errores.get(pid)]
+    eliminados = set()
+    if borrar:
+        eliminados = {f["proyecto_id"] for f in get_repositorio().execute_returning(db.DELETE_PROJECTS, (borrar,))}
+        response_cache.invalidate("proyectos", *[t for pid in eliminados for t in (("proyecto", pid), ("documentos", pid))])
+
+    return [_resultado_lote(i, i in eliminados, errores.get(i), i in filas) for i in ids]
+
+# Resultado de un elemento en las eliminaciones por lotes
+def _resultado_lote(item_id, eliminado, error, existia):
+    if eliminado:
+        return {"id": item_id, "ok": True, "estado": "eliminado"}
+    if not existia:
+        return {"id": item_id, "ok": False, "estado": "no_encontrado"}
+    return {"id": item_id, "ok": False, "estado": "error", "error": error}
 
 # Devuelve el ID de la carpeta de Sharepoint asociada a un proyecto
 def obtener_info_proyecto(idProyecto):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
+    result = get_repositorio().fetch_one(db.GET_PROJECT_URL_BY_ID, (idProyecto,))
 
-    try:
-        cursor.execute(db.GET_PROJECT_URL_BY_ID, (idProyecto,))
-        result = cursor.fetchone()
-        
-        if not result or not result.get("proyecto_url"):
-            raise Exception(f"No se encontró URL de SharePoint para el proyecto {idProyecto}")
-        
-        return result["id_sharepoint"]
-    
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
+    if not result or not result.get("proyecto_url"):
+        raise Exception(f"No se encontró URL de SharePoint para el proyecto {idProyecto}")
+
+    return result["id_sharepoint"]
 
 """-----------------------------------------------------------------------
                        DOCUMENTOS
 -----------------------------------------------------------------------"""
 
-# Obtener todos los documentos de un proyecto
-def obtener_documentos(proyecto_id):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
+# Obtener todos los documentos de un proyecto (namedtuple con los campos de la API; ver "fields" en app/db/filas.py)
+def obtener_documentos(proyecto_id, fields=None):
+    tipo, columnas = DOCUMENTO.proyeccion(fields)
+    return get_repositorio().fetch_rows(tipo, proyectar(db.GET_DOCUMENTS_BY_PROJECT, columnas), (proyecto_id,))
 
-    try:
-        cursor.execute(db.GET_DOCUMENTS_BY_PROJECT, (proyecto_id,))
-        documentos = cursor.fetchall()
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
 
-    return documentos
+# Devuelve una página de documentos de un proyecto (orden: fecha de creación, ID)
+# y el cursor de la siguiente página (o None).
+# La fecha y el ID (clave del cursor) se leen siempre, aunque no estén en "fields".
+def obtener_documentos_pagina(proyecto_id, limit=50, after=None, fields=None):
+    tipo, columnas = DOCUMENTO.proyeccion(fields, incluir=("idDocumento", "fecha"))
+    cursor_clave = decodificar_cursor(after)
+
+    if cursor_clave:
+        fecha, ultimo_id = _clave_documento(cursor_clave)
+        documentos = get_repositorio().fetch_rows(
+            tipo, proyectar(db.GET_DOCUMENTS_BY_PROJECT_PAGE, columnas),
+            (proyecto_id, fecha, ultimo_id, limit + 1)
+        )
+    else:
+        documentos = get_repositorio().fetch_rows(
+            tipo, proyectar(db.GET_DOCUMENTS_BY_PROJECT_FIRST_PAGE, columnas), (proyecto_id, limit + 1)
+        )
+
+    return cortar_pagina(
+        documentos, limit,
+        lambda d: {"fecha": d.fecha.isoformat(), "id": d.idDocumento}
+    )
+
+# Extrae (fecha, id) del cursor de paginación de documentos.
+# La fecha se valida aquí: una cadena cualquiera llegaría a PostgreSQL y fallaría como timestamp (500).
+def _clave_documento(cursor_clave):
+    fecha = cursor_clave.get("fecha")
+    if not isinstance(fecha, str):
+        raise CursorInvalido("El cursor de paginación no es válido")
+    try:
+        fecha = datetime.fromisoformat(fecha)
+    except ValueError:
+        raise CursorInvalido("El cursor de paginación no es válido")
+    return fecha, _clave_entera(cursor_clave, "id")
 
 
 # Crear un nuevo documento
 def crear_documento(proyecto_id, nombre, descripcion, url, archivo_id):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute(
-            db.CREATE_DOCUMENT,
-            (proyecto_id, nombre, descripcion, url, archivo_id)
-        )
-        documento_id = cursor.fetchone()["documento_id"]
-        conn.commit()
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
+    fila = get_repositorio().execute_returning(
+        db.CREATE_DOCUMENT,
+        (proyecto_id, nombre, descripcion, url, archivo_id)
+    )[0]
+    documento_id = fila["documento_id"]
 
+    response_cache.invalidate(("documentos", proyecto_id))
     return documento_id
 
-# Subir archivo a Sharepoint
-def subir_archivo_sharepoint(nombre_archivo, contenido_bytes, carpeta_id):
-    token = get_access_token() 
-
-    # Endpoint para subir archivo en modo simple (menos de 4MB)
-    url = f"https://graph.microsoft.com/v1.0/drives/{DRIVE_ID}/items/{carpeta_id}:/{nombre_archivo}:/content"
-    
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/octet-stream"
-    }
+# Sube contenido (bytes o fichero con seek) a SharePoint.
+# Hasta SIMPLE_UPLOAD_MAX usa el PUT simple a `simple_path`; por encima, una upload session
+# por fragmentos creada en `session_path` (reanudable si falla un fragmento).
+# En memoria nunca hay más de un fragmento (CHUNK_SIZE) a la vez.
+def _subir_contenido(simple_path, session_path, contenido, upload_id=None):
+    stream = as_stream(contenido)
+    size = stream_size(stream)
 
-    response = requests.put(url, headers=headers, data=contenido_bytes)
-    response.raise_for_status()
+    if size <= UPLOAD_CONFIG["SIMPLE_UPLOAD_MAX"]:
+        headers = {
+            "Content-Type": "application/octet-stream"
+        }
+        stream.seek(0)
+        response = graph_request("PUT", simple_path, headers=headers, data=stream.read())
+        response.raise_for_status()
+        return response.json()
+
+    subida = ChunkedUpload(
+        get_graph_client(),
+        session_path,
+        stream,
+        size,
+        chunk_size=UPLOAD_CONFIG["CHUNK_SIZE"],
+        max_retries=UPLOAD_CONFIG["CHUNK_RETRIES"],
+        upload_id=upload_id,
+    )
+    return subida.run()
 
-    return response.json().get("webUrl"), response.json().get("id")
+# Subir archivo a Sharepoint
+def subir_archivo_sharepoint(nombre_archivo, contenido_bytes, carpeta_id, upload_id=None):
+    # Endpoint para subir archivo en modo simple (menos de 4MB) o por fragmentos
+    url = f"/drives/{DRIVE_ID}/items/{carpeta_id}:/{nombre_archivo}:"
+
+    item = _subir_contenido(f"{url}/content", f"{url}/createUploadSession", contenido_bytes, upload_id)
+
+    return item.get("webUrl"), item.get("id")
+
+
+# Pool de hilos compartido para llamadas a SharePoint en paralelo (uno por proceso).
+# Limita las llamadas simultáneas aunque lleguen varias peticiones por lotes a la vez.
+_sharepoint_executor = None
+_sharepoint_executor_lock = threading.Lock()
+
+def get_sharepoint_executor():
+    global _sharepoint_executor
+    if _sharepoint_executor is None:
+        with _sharepoint_executor_lock:
+            if _sharepoint_executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=UPLOAD_CONFIG["BATCH_WORKERS"], thread_name_prefix="sharepoint"
+                )
+                _sharepoint_executor = executor
+    return _sharepoint_executor
+
+# Nombres de archivo repetidos en un lote (SharePoint no distingue mayúsculas): se subirían en paralelo a la misma
+# ruta, uno sobrescribiría al otro y dos documentos acabarían apuntando al mismo archivo. Las rutas responden 400.
+def nombres_repetidos(filenames):
+    vistos, repetidos = set(), []
+    for nombre in filenames:
+        clave = nombre.casefold()
+        if clave in vistos and nombre not in repetidos:
+            repetidos.append(nombre)
+        vistos.add(clave)
+    return repetidos
+
+# Sube varios archivos a la carpeta del proyecto en paralelo y los registra en una sola inserción.
+# `archivos` es una lista de dicts con nombre, descripcion, filename y stream.
+# Devuelve un resultado por archivo (en el mismo orden), con el error si falló su subida.
+def subir_documentos_lote(proyecto_id, archivos):
+    folder_id = obtener_info_proyecto(proyecto_id)
 
+    # 1. Subidas a SharePoint en paralelo (sin conexión a la BBDD abierta)
+    executor = get_sharepoint_executor()
+    futuros = [
+        executor.submit(contextvars.copy_context().run, subir_archivo_sharepoint, a["filename"], a["stream"], folder_id)
+        for a in archivos
+    ]
+    resultados = []
+    for archivo, futuro in zip(archivos, futuros):
+        try:
+            url, archivo_id = futuro.result()
+            resultados.append({"archivo": archivo["filename"], "ok": True, "url": url, "id_sharepoint": archivo_id})
+        except Exception as e:
+            resultados.append({"archivo": archivo["filename"], "ok": False, "error": str(e)})
+
+    # 2. Registrar en la BBDD todos los subidos en una única sentencia
+    subidos = [(a, r) for a, r in zip(archivos, resultados) if r["ok"]]
+    if subidos:
+        with db_cursor(get_db_pool()) as cursor:
+            filas = execute_values(
+                cursor,
+                db.CREATE_DOCUMENTS_BATCH,
+                [(proyecto_id, a["nombre"], a["descripcion"], r["url"], r["id_sharepoint"]) for a, r in subidos],
+                page_size=len(subidos),
+                fetch=True,
+            )
+        ids = {fila["id_sharepoint"]: fila["documento_id"] for fila in filas}
+        for _, r in subidos:
+            r["documento_id"] = ids.get(r["id_sharepoint"])
+        response_cache.invalidate(("documentos", proyecto_id))
 
-# Obtener un documento por su ID
-def obtener_documento_por_id(documento_id):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
+    for r in resultados:
+        r.pop("id_sharepoint", None)
+    return resultados
 
-    try:
-        cursor.execute(db.GET_DOCUMENT_BY_ID, (documento_id,))
-        documento = cursor.fetchone()
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
 
-    return documento
+# Obtener un documento por su ID (namedtuple con los campos de la API) o None
+def obtener_documento_por_id(documento_id, fields=None):
+    tipo, columnas = DOCUMENTO.proyeccion(fields)
+    return get_repositorio().fetch_row(tipo, proyectar(db.GET_DOCUMENT_FIELDS_BY_ID, columnas), (documento_id,))
 
 
 # Modificar documento
 def modificar_documento_bbdd(documento_id, nombre, descripcion, url=None):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
+    if url:
+        # Actualiza nombre, descripción y url
+        filas = get_repositorio().execute_returning(db.UPDATE_DOCUMENT_URL, (nombre, descripcion, url, documento_id))
+    else:
+        # Actualiza solo nombre y descripción
+        filas = get_repositorio().execute_returning(db.UPDATE_DOCUMENT, (nombre, descripcion, documento_id))
+    if not filas:
+        return False
+    response_cache.invalidate(("documento", documento_id), ("documentos", filas[0]["proyecto_id"]))
+    return True
 
-    try:
-        if url:
-            # Actualiza nombre, descripción y url
-            cursor.execute(
-                db.UPDATE_DOCUMENT_URL,
-                (nombre, descripcion, url, documento_id)
-            )
-        else: 
-            # Actualiza solo nombre y descripción
-            cursor.execute(
-                db.UPDATE_DOCUMENT,
-                (nombre, descripcion, documento_id)
-            )
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
 
+def modificar_documento_sharepoint(sharepoint_id, contenido_bytes, upload_id=None):
+    url = f"/drives/{DRIVE_ID}/items/{sharepoint_id}"
 
-def modificar_documento_sharepoint(sharepoint_id, contenido_bytes):
-    token = get_access_token()
-
-    url = f"https://graph.microsoft.com/v1.0/drives/{DRIVE_ID}/items/{sharepoint_id}/content"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/octet-stream"
-    }
-
-    response = requests.put(url, headers=headers, data=contenido_bytes)
-    response.raise_for_status()
+    item = _subir_contenido(f"{url}/content", f"{url}/createUploadSession", contenido_bytes, upload_id)
+    invalidar_contenido(sharepoint_id)  # nuevo eTag: la descarga no debe seguir sirviendo la versión anterior
 
     # Devuelve la URL pública del archivo
-    return response.json().get("webUrl")
+    return item.get("webUrl")
 
+# Devuelve el progreso de una subida por fragmentos (upload_id enviado por el frontend)
+def obtener_progreso_subida(upload_id):
+    return obtener_progreso(upload_id)
 
-# Eliminar un documento
-def eliminar_documento(documento_id):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
 
-    try:
-        # Obtener id de SharePoint
-        try:
-            sharepoint_id = obtener_info_documento(documento_id)
-        except Exception:
-            sharepoint_id = None  # Si no existe, se continúa con la BBDD
-
-        # Eliminar archivo en SharePoint
-        if sharepoint_id:
-            token = get_access_token()
-            url = f"https://graph.microsoft.com/v1.0/drives/{DRIVE_ID}/items/{sharepoint_id}"
-            headers = {"Authorization": f"Bearer {token}"}
-            response = requests.delete(url, headers=headers)
-            if response.status_code not in (204, 404):
-                raise Exception(f"No se pudo eliminar el archivo en SharePoint: {response.text}")
-
-        # Eliminar de la BBDD
-        cursor.execute(db.DELETE_DOCUMENT, (documento_id,))
-        if cursor.rowcount == 0:
-            conn.commit()
+# Eliminar un documento: lectura corta, borrado en SharePoint sin conexión a la BBDD tomada
+# y escritura corta que solo elimina la fila si sigue apuntando al mismo archivo
+def eliminar_documento(documento_id):
+    # Obtener id de SharePoint
+    documento = get_repositorio().fetch_one(db.GET_DOCUMENT_BY_ID, (documento_id,))
+    if not documento:
+        return False
+    sharepoint_id = documento["id_sharepoint"]
+
+    # Eliminar archivo en SharePoint
+    if sharepoint_id:
+        url = f"/drives/{DRIVE_ID}/items/{sharepoint_id}"
+        response = graph_request("DELETE", url)
+        if response.status_code not in (204, 404):
+            raise Exception(f"No se pudo eliminar el archivo en SharePoint: {response.text}")
+
+    # Eliminar de la BBDD
+    with db_cursor(get_db_pool()) as cursor:
+        cursor.execute(db.DELETE_DOCUMENT_IF_UNCHANGED, (documento_id, sharepoint_id))
+        fila = cursor.fetchone()
+        if not fila:
+            cursor.execute(db.GET_DOCUMENT_BY_ID, (documento_id,))
+            if cursor.fetchone():
+                raise Exception("El documento ha cambiado mientras se eliminaba, vuelve a intentarlo")
             return False
 
-        conn.commit()
-        return True
+    response_cache.invalidate(("documento", documento_id), ("documentos", fila["proyecto_id"]))
+    return True
 
-    except Exception as e:
-        conn.rollback()
-        raise e
 
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
+# Elimina varios documentos de un proyecto (archivos en SharePoint vía $batch + filas en una transacción).
+# Devuelve un resultado por ID: eliminado, no encontrado o error de SharePoint.
+def eliminar_documentos_lote(proyecto_id, ids):
+    # 1. Lectura corta: IDs de SharePoint
+    filas = {
+        f["documento_id"]: f["id_sharepoint"]
+        for f in get_repositorio().fetch_many(db.GET_DOCUMENTS_SHAREPOINT_BY_IDS, (proyecto_id, list(ids)))
+    }
+
+    # 2. SharePoint (sin conexión a la BBDD abierta)
+    errores = _eliminar_items_sharepoint({did: sp for did, sp in filas.items() if sp})
+
+    # 3. Borrar en una transacción las filas cuyo archivo ya no existe en SharePoint
+    borrar = [did for did in filas if not errores.get(did)]
+    eliminados = set()
+    if borrar:
+        filas_eliminadas = get_repositorio().execute_returning(db.DELETE_DOCUMENTS, (proyecto_id, borrar))
+        eliminados = {f["documento_id"] for f in filas_eliminadas}
+        response_cache.invalidate(("documentos", proyecto_id), *[("documento", did) for did in eliminados])
+
+    return [_resultado_lote(i, i in eliminados, errores.get(i), i in filas) for i in ids]
 
 
 # Devuelve el ID del arhivo en Sharepoint
 def obtener_info_documento(documento_id):
-    pool = get_db_pool()
-    conn = pool.get_connection()
-    cursor = conn.cursor()
+    result = get_repositorio().fetch_one(db.GET_DOCUMENT_BY_ID, (documento_id,))
+
+    if not result or not result.get("id_sharepoint"):
+        raise Exception(f"No se encontró el documento con ID {documento_id} o no tiene ID de SharePoint")
+
+    return result["id_sharepoint"]
+
+"""-----------------------------------------------------------------------
+                       DESCARGA DE DOCUMENTOS
+-----------------------------------------------------------------------"""
+# El contenido de los archivos se sirve desde una caché en disco (ver app/utils/contenido.py):
+# solo se descarga de Graph la primera vez (o cuando cambia su eTag) y los más usados se quedan en disco.
+_cache_contenido = None
+_cache_contenido_lock = threading.Lock()
+
+def get_cache_contenido():
+    global _cache_contenido
+    if _cache_contenido is None:
+        with _cache_contenido_lock:
+            if _cache_contenido is None:
+                _cache_contenido = CacheContenido(CONTENT_CACHE_CONFIG)
+    return _cache_contenido
+
+# Olvida los metadatos cacheados de un archivo reemplazado (los demás workers los renuevan al caducar)
+def invalidar_contenido(sharepoint_id):
+    if _cache_contenido is not None:
+        _cache_contenido.invalidar(sharepoint_id)
+
+# Metadatos del archivo en SharePoint: nombre, tamaño, eTag, fecha y URL de descarga (firmada, sin token)
+def _metadatos_sharepoint(sharepoint_id):
+    response = graph_request(
+        "GET", f"/drives/{DRIVE_ID}/items/{sharepoint_id}",
+        params={"$select": "id,name,size,eTag,lastModifiedDateTime,file,@microsoft.graph.downloadUrl"},
+    )
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    item = response.json()
+    if "file" not in item:
+        return None  # es una carpeta
+    nombre = item.get("name") or sharepoint_id
+    modificado = item.get("lastModifiedDateTime")
+    return Metadatos(
+        item_id=sharepoint_id,
+        nombre=nombre,
+        size=item.get("size"),
+        etag=(item.get("eTag") or "").strip('"'),
+        modificado=datetime.fromisoformat(modificado.replace("Z", "+00:00")) if modificado else None,
+        mimetype=item["file"].get("mimeType") or mimetypes.guess_type(nombre)[0] or "application/octet-stream",
+        download_url=item["@microsoft.graph.downloadUrl"],
+    )
+
+# Metadatos del archivo de un documento del proyecto, o None si el documento no existe,
+# es de otro proyecto o no tiene archivo en SharePoint
+def obtener_metadatos_contenido(proyecto_id, documento_id):
+    documento = get_repositorio().fetch_one(db.GET_DOCUMENT_BY_ID, (documento_id,))
+    if not documento or documento["proyecto_id"] != proyecto_id or not documento["id_sharepoint"]:
+        return None
+    return get_cache_contenido().metadatos(documento["id_sharepoint"], _metadatos_sharepoint)
+
+# Descarga el archivo de Graph (la URL de descarga ya va firmada: no se envía el token).
+# `rango`: cabecera Range del cliente, que Graph respeta (206 / 416).
+def descargar_contenido(metadatos, rango=None):
+    headers = {"Accept-Encoding": "identity"}  # los bytes del archivo tal cual (Content-Length y Range sobre ellos)
+    if rango:
+        headers["Range"] = rango
+    return graph_request("GET", metadatos.download_url, headers=headers, authenticate=False, stream=True)
+
+def _bloques_contenido(metadatos):
+    with descargar_contenido(metadatos) as response:
+        response.raise_for_status()
+        yield from response.iter_content(CONTENT_CACHE_CONFIG["CHUNK_SIZE"])
+
+# Ruta del archivo en la caché, descargándolo de Graph si no está.
+# None si el archivo no se cachea (demasiado grande o caché desactivada): se envía directamente desde Graph.
+def contenido_en_cache(metadatos):
+    cache = get_cache_contenido()
+    if not cache.cacheable(metadatos):
+        metricas.contar("autodoc_content_requests_total", (("result", "bypass"),))
+        return None
+    ruta = cache.buscar(metadatos)
+    metricas.contar("autodoc_content_requests_total", (("result", "hit" if ruta else "miss"),))
+    return ruta or cache.guardar(metadatos, lambda: _bloques_contenido(metadatos))
+
+"""-----------------------------------------------------------------------
+                       BÚSQUEDA
+-----------------------------------------------------------------------"""
+
+# Busca proyectos y/o documentos por nombre y descripción, ordenados por relevancia.
+# - Sin distinguir mayúsculas ni tildes, con raíces en español y tolerando errores tipográficos.
+# - tipo: "todos", "proyectos" o "documentos".
+# Devuelve (resultados, cursor de la siguiente página o None).
+def buscar(texto, tipo="todos", limit=50, after=None):
+    consultas = {
+        "todos": db.SEARCH_ALL,
+        "proyectos": db.SEARCH_PROJECTS,
+        "documentos": db.SEARCH_DOCUMENTS,
+    }
+    if tipo not in consultas:
+        raise ValueError("El parámetro tipo debe ser 'todos', 'proyectos' o 'documentos'")
+
+    cursor_clave = decodificar_cursor(after) or {}
+    after_relevancia = cursor_clave.get("r")
+    after_tipo = cursor_clave.get("t")
+    if cursor_clave and (isinstance(after_relevancia, bool) or not isinstance(after_relevancia, (int, float))
+                         or after_tipo not in ("proyecto", "documento")):
+        raise CursorInvalido("El cursor de paginación no es válido")
+
+    params = {
+        "texto": texto,
+        "after_relevancia": after_relevancia,
+        "after_tipo": after_tipo,
+        "after_id": _clave_entera(cursor_clave, "id") if cursor_clave else None,
+        "limit": limit + 1,
+    }
+    with db_cursor(get_db_pool()) as cursor:
+        cursor.execute(consultas[tipo], params)
+        resultados = cursor.fetchall()
+
+    return cortar_pagina(
+        resultados, limit,
+        lambda r: {"r": r["relevancia"], "t": r["tipo"], "id": r["id"]}
+    )
+
+"""-----------------------------------------------------------------------
+                       EXPORTACIÓN
+-----------------------------------------------------------------------"""
+# Las exportaciones usan un pool propio (pocas conexiones, de larga duración) para no dejar
+# sin conexiones a las requests normales mientras un cliente descarga millones de filas.
+_export_pool = None
+
+def get_export_pool():
+    global _export_pool
+    if _export_pool is None:
+        with _db_pool_lock:
+            if _export_pool is None:
+                config = {
+                    **DB_CONFIG,
+                    "DB_POOL_MIN": 0,
+                    "DB_POOL_MAX": EXPORT_CONFIG["MAX_CONCURRENT"],
+                    "DB_POOL_TIMEOUT": EXPORT_CONFIG["QUEUE_TIMEOUT"],
+                    "DB_HOLD_WARN_MS": EXPORT_CONFIG["HOLD_WARN_MS"],
+                }
+                pool = PsqlConnectionPool(config, psycopg2.extensions.cursor)  # Filas como tuplas
+                pool.connect()
+                _export_pool = pool
+    return _export_pool
+
+# Exporta todos los proyectos, o todos los documentos (de un proyecto si se indica), en NDJSON o CSV.
+# Devuelve una Exportacion: se itera para obtener la respuesta por bloques y se cierra al terminar.
+# Lanza ValueError si el formato o "fields" no son válidos y PoolTimeoutError si no hay hueco.
+def exportar(tipo, formato, fields=None, proyecto_id=None):
+    if formato not in FORMATOS:
+        raise ValueError("El parámetro formato debe ser 'ndjson' o 'csv'")
+
+    if tipo == "proyectos":
+        tipo_fila, plantilla, params = PROYECTO, db.GET_ALL_PROJECTS, None
+    elif proyecto_id is not None:
+        tipo_fila, plantilla, params = DOCUMENTO, db.GET_DOCUMENTS_BY_PROJECT, (proyecto_id,)
+    else:
+        tipo_fila, plantilla, params = DOCUMENTO, db.EXPORT_DOCUMENTS, None
+
+    clase, columnas = tipo_fila.proyeccion(fields)
+    return Exportacion(
+        get_export_pool(), proyectar(plantilla, columnas), params,
+        clase._fields, formato, EXPORT_CONFIG["ITERSIZE"]
+    )
+
+"""-----------------------------------------------------------------------
+                       MODO ASÍNCRONO (OUTBOX)
+-----------------------------------------------------------------------"""
+# La petición HTTP solo hace una transacción: el cambio en proyectos/documentos + un job en
+# autodoc.outbox. Los workers ejecutan después la operación en SharePoint, con reintentos.
+
+_outbox_worker = None
+_outbox_worker_lock = threading.Lock()
+
+def get_outbox_worker(start=True):
+    """
+    Devuelve el pool de workers de la outbox (uno por proceso), arrancándolo si hace falta.
+    """
+    global _outbox_worker
+    if _outbox_worker is None:
+        with _outbox_worker_lock:
+            if _outbox_worker is None:
+                worker = OutboxWorker(get_db_pool(), OUTBOX_HANDLERS, ASYNC_CONFIG)
+                _outbox_worker = worker
+    if start:
+        _outbox_worker.start()
+    return _outbox_worker
+
+# Copia un archivo recibido a STAGING_DIR para que el worker lo suba después
+def _guardar_en_staging(stream):
+    os.makedirs(ASYNC_CONFIG["STAGING_DIR"], exist_ok=True)
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile(dir=ASYNC_CONFIG["STAGING_DIR"], delete=False) as destino:
+        shutil.copyfileobj(stream, destino, length=1024 * 1024)
+    return destino.name
+
+def _borrar_staging(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
 
+# Ejecuta `operacion(cursor)` en una transacción y despierta a los workers si encoló algún job
+def _transaccion_con_job(operacion, ruta_staging=None):
     try:
-        cursor.execute(db.GET_DOCUMENT_BY_ID, (documento_id,))
-        result = cursor.fetchone()
-        
-        if not result or not result.get("id_sharepoint"):
-            raise Exception(f"No se encontró el documento con ID {documento_id} o no tiene ID de SharePoint")
-        
-        return result["id_sharepoint"]
-    
-    finally:
-        cursor.close()
-        pool.release_connection(conn)
\ No newline at end of file
+        with db_cursor(get_db_pool()) as cursor:
+            resultado = operacion(cursor)
+    except Exception:
+        if ruta_staging:
+            _borrar_staging(ruta_staging)
+        raise
+    get_outbox_worker().notify()
+    return resultado
+
+# Crea el proyecto en la BBDD y encola la creación de su carpeta. Devuelve (proyecto_id, job_id).
+def crear_proyecto_async(nombre, descripcion):
+    def operacion(cursor):
+        cursor.execute(db.CREATE_PROJECT, (nombre, descripcion, None, None))
+        proyecto_id = cursor.fetchone()["proyecto_id"]
+        # marcador: nombre provisional de la carpeta, único de este job (ver _job_crear_carpeta)
+        job_id = encolar(cursor, "crear_carpeta", {"proyecto_id": proyecto_id, "nombre": nombre, "marcador": uuid.uuid4().hex})
+        return proyecto_id, job_id
+
+    resultado = _transaccion_con_job(operacion)
+    response_cache.invalidate("proyectos")
+    return resultado
+
+# Actualiza nombre y descripción en la BBDD y encola el renombrado de la carpeta.
+# Devuelve el job_id, o None si el proyecto no existe.
+def modificar_proyecto_async(proyecto_id, nombre, descripcion):
+    def operacion(cursor):
+        cursor.execute(db.UPDATE_PROJECT_FIELDS, (nombre, descripcion, proyecto_id))
+        if not cursor.fetchone():
+            return None
+        return encolar(cursor, "renombrar_carpeta", {"proyecto_id": proyecto_id, "nombre": nombre})
+
+    job_id = _transaccion_con_job(operacion)
+    response_cache.invalidate(("proyecto", proyecto_id), "proyectos")
+    return job_id
+
+# Elimina el proyecto de la BBDD y encola el borrado de su carpeta.
+# Devuelve (existía, job_id o None si no tenía carpeta).
+def eliminar_proyecto_async(proyecto_id):
+    def operacion(cursor):
+        cursor.execute(db.DELETE_PROJECT_RETURNING, (proyecto_id,))
+        fila = cursor.fetchone()
+        if not fila:
+            return False, None
+        if not fila["id_sharepoint"]:
+            return True, None
+        return True, encolar(cursor, "eliminar_item", {"id_sharepoint": fila["id_sharepoint"]})
+
+    resultado = _transaccion_con_job(operacion)
+    response_cache.invalidate(("proyecto", proyecto_id), "proyectos", ("documentos", proyecto_id))
+    return resultado
+
+# Registra el documento (sin URL aún) y encola la subida del archivo. Devuelve (documento_id, job_id).
+def crear_documento_async(proyecto_id, nombre, descripcion, filename, stream):
+    ruta = _guardar_en_staging(stream)
+
+    def operacion(cursor):
+        cursor.execute(db.CREATE_DOCUMENT, (proyecto_id, nombre, descripcion, None, None))
+        documento_id = cursor.fetchone()["documento_id"]
+        job_id = encolar(cursor, "subir_archivo", {
+            "documento_id": documento_id, "proyecto_id": proyecto_id, "filename": filename, "ruta": ruta
+        })
+        return documento_id, job_id
+
+    resultado = _transaccion_con_job(operacion, ruta)
+    response_cache.invalidate(("documentos", proyecto_id))
+    return resultado
+
+# Actualiza nombre y descripción y encola el reemplazo del archivo.
+# Devuelve el job_id, o None si el documento no existe.
+def modificar_documento_async(documento_id, nombre, descripcion, stream):
+    ruta = _guardar_en_staging(stream)
+
+    def operacion(cursor):
+        cursor.execute(db.UPDATE_DOCUMENT, (nombre, descripcion, documento_id))
+        fila = cursor.fetchone()
+        if not fila:
+            return None, None
+        job_id = encolar(cursor, "reemplazar_archivo", {"documento_id": documento_id, "ruta": ruta})
+        return fila["proyecto_id"], job_id
+
+    proyecto_id, job_id = _transaccion_con_job(operacion, ruta)
+    if job_id is None:
+        _borrar_staging(ruta)
+        return None
+    response_cache.invalidate(("documento", documento_id), ("documentos", proyecto_id))
+    return job_id
+
+# Elimina el documento de la BBDD y encola el borrado del archivo.
+# Devuelve (existía, job_id o None si no tenía archivo en SharePoint).
+def eliminar_documento_async(documento_id):
+    def operacion(cursor):
+        cursor.execute(db.DELETE_DOCUMENT_RETURNING, (documento_id,))
+        fila = cursor.fetchone()
+        if not fila:
+            return None, None
+        job_id = None
+        if fila["id_sharepoint"]:
+            job_id = encolar(cursor, "eliminar_item", {"id_sharepoint": fila["id_sharepoint"]})
+        return fila["proyecto_id"], job_id
+
+    proyecto_id, job_id = _transaccion_con_job(operacion)
+    if proyecto_id is None:
+        return False, None
+    response_cache.invalidate(("documento", documento_id), ("documentos", proyecto_id))
+    return True, job_id
+
+# Devuelve el estado de un job de la outbox
+def obtener_job(job_id):
+    return get_repositorio().fetch_one(db.GET_OUTBOX_JOB, (job_id,))
+
+# ------------------ Handlers de los jobs (los ejecuta OutboxWorker) ------------------ #
+# Reciben (payload, intentos) y devuelven el resultado a guardar. Si lanzan excepción, el job se reintenta.
+# Deben ser idempotentes: un job puede ejecutarse de nuevo si el worker muere a mitad.
+
+# La carpeta se crea con un nombre provisional único de este job y se renombra al nombre del proyecto
+# cuando su ID ya está guardado. Así un reintento solo adopta la carpeta que creó este job: con el nombre
+# del proyecto podría encontrar la de otro proyecto con el mismo nombre (y acabar eliminándola).
+def _job_crear_carpeta(payload, intentos):
+    proyecto_id, nombre = payload["proyecto_id"], payload["nombre"]
+    provisional = CARPETA_PROVISIONAL + (payload.get("marcador") or f"proyecto-{proyecto_id}")
+    proyecto = get_repositorio().fetch_one(db.GET_PROJECT_URL_BY_ID, (proyecto_id,))
+    if not proyecto:
+        return {"omitido": "El proyecto ya no existe"}
+
+    id_sharepoint = proyecto["id_sharepoint"]
+    if id_sharepoint:
+        # Un intento anterior ya guardó la carpeta: falta renombrarla si sigue con el nombre provisional
+        response = graph_request("GET", f"/drives/{DRIVE_ID}/items/{id_sharepoint}")
+        response.raise_for_status()
+        if response.json().get("name") != provisional:
+            return {"proyecto_url": proyecto["proyecto_url"]}
+    else:
+        carpeta = None
+        if intentos > 1:
+            # Un intento anterior pudo crear la carpeta provisional sin llegar a guardarla en la BBDD
+            response = graph_request("GET", f"/drives/{DRIVE_ID}/root:/{quote(provisional)}")
+            if response.status_code == 200 and "folder" in response.json():
+                carpeta = response.json()
+            elif response.status_code != 404:
+                response.raise_for_status()
+        if carpeta:
+            proyecto_url, id_sharepoint = carpeta.get("webUrl"), carpeta.get("id")
+        else:
+            proyecto_url, id_sharepoint = crear_carpeta_sharepoint(provisional, conflicto="fail")
+
+        actualizado = get_repositorio().execute(db.UPDATE_PROJECT_SHAREPOINT, (proyecto_url, id_sharepoint, proyecto_id)) > 0
+        if not actualizado:
+            # El proyecto se eliminó mientras se creaba la carpeta (es la provisional de este job)
+            _job_eliminar_item({"id_sharepoint": id_sharepoint}, intentos)
+            return {"omitido": "El proyecto ya no existe"}
+
+    # Nombre definitivo; si ya hay una carpeta con ese nombre, SharePoint le añade un número (como al crearla)
+    response = graph_request(
+        "PATCH", f"/drives/{DRIVE_ID}/items/{id_sharepoint}",
+        headers={"Content-Type": "application/json"}, json={"name": nombre},
+        params={"@microsoft.graph.conflictBehavior": "rename"},
+    )
+    response.raise_for_status()
+    proyecto_url = response.json().get("webUrl")
+    get_repositorio().execute(db.UPDATE_PROJECT_SHAREPOINT, (proyecto_url, id_sharepoint, proyecto_id))
+
+    response_cache.invalidate(("proyecto", proyecto_id), "proyectos")
+    return {"proyecto_url": proyecto_url}
+
+def _job_renombrar_carpeta(payload, intentos):
+    proyecto_id = payload["proyecto_id"]
+    proyecto_url = modificar_proyecto_sharepoint(proyecto_id, payload["nombre"])
+    with db_cursor(get_db_pool()) as cursor:
+        cursor.execute(db.GET_PROJECT_URL_BY_ID, (proyecto_id,))
+        proyecto = cursor.fetchone()
+        if proyecto:
+            cursor.execute(db.UPDATE_PROJECT_SHAREPOINT, (proyecto_url, proyecto["id_sharepoint"], proyecto_id))
+    response_cache.invalidate(("proyecto", proyecto_id), "proyectos")
+    return {"proyecto_url": proyecto_url}
+
+def _job_eliminar_item(payload, intentos):
+    response = graph_request("DELETE", f"/drives/{DRIVE_ID}/items/{payload['id_sharepoint']}")
+    if response.status_code not in (204, 404):
+        # 204 = eliminado correctamente, 404 = ya no existía
+        raise Exception(f"No se pudo eliminar en SharePoint: {response.text}")
+    return {"eliminado": payload["id_sharepoint"]}
+
+def _job_subir_archivo(payload, intentos):
+    documento_id, ruta = payload["documento_id"], payload["ruta"]
+    if not obtener_documento_por_id(documento_id):
+        _borrar_staging(ruta)
+        return {"omitido": "El documento ya no existe"}
+
+    folder_id = obtener_info_proyecto(payload["proyecto_id"])  # Falla (y se reintenta) si la carpeta aún no existe
+    with open(ruta, "rb") as archivo:
+        url, archivo_id = subir_archivo_sharepoint(payload["filename"], archivo, folder_id)
+
+    fila = get_repositorio().fetch_one(db.UPDATE_DOCUMENT_SHAREPOINT, (url, archivo_id, documento_id))
+    if not fila:
+        # El documento se eliminó mientras se subía
+        _job_eliminar_item({"id_sharepoint": archivo_id}, intentos)
+        _borrar_staging(ruta)
+        return {"omitido": "El documento ya no existe"}
+
+    _borrar_staging(ruta)
+    response_cache.invalidate(("documento", documento_id), ("documentos", fila["proyecto_id"]))
+    return {"url": url}
+
+def _job_reemplazar_archivo(payload, intentos):
+    documento_id, ruta = payload["documento_id"], payload["ruta"]
+    if not obtener_documento_por_id(documento_id):
+        _borrar_staging(ruta)
+        return {"omitido": "El documento ya no existe"}
+
+    sharepoint_id = obtener_info_documento(documento_id)
+    with open(ruta, "rb") as archivo:
+        url = modificar_documento_sharepoint(sharepoint_id, archivo)
+
+    fila = get_repositorio().fetch_one(db.UPDATE_DOCUMENT_SHAREPOINT, (url, sharepoint_id, documento_id))
+    _borrar_staging(ruta)
+    if fila:
+        response_cache.invalidate(("documento", documento_id), ("documentos", fila["proyecto_id"]))
+    return {"url": url}
+
+OUTBOX_HANDLERS = {
+    "crear_carpeta": _job_crear_carpeta,
+    "renombrar_carpeta": _job_renombrar_carpeta,
+    "eliminar_item": _job_eliminar_item,
+    "subir_archivo": _job_subir_archivo,
+    "reemplazar_archivo": _job_reemplazar_archivo,
+}
+
+
+"""-----------------------------------------------------------------------
+                    RECONCILIACIÓN CON SHAREPOINT
+-----------------------------------------------------------------------"""
+# Lleva a la BBDD los cambios hechos directamente en SharePoint (carpetas y archivos
+# creados, renombrados, movidos o eliminados) usando la consulta delta de Graph.
+
+_reconciliador = None
+_reconciliador_lock = threading.Lock()
+
+def get_reconciliador():
+    """
+    Devuelve el reconciliador del drive DRIVE_ID (uno por proceso).
+    """
+    global _reconciliador
+    if _reconciliador is None:
+        with _reconciliador_lock:
+            if _reconciliador is None:
+                _reconciliador = SharePointReconciler(
+                    get_db_pool(),
+                    get_graph_client(),
+                    DRIVE_ID,
+                    RECONCILE_CONFIG,
+                    on_change=lambda etiquetas: response_cache.invalidate(*etiquetas),
+                )
+    return _reconciliador
+
+# Ejecuta una pasada de reconciliación (la programa Flask-APScheduler, ver app/utils/programador.py).
+# Con completo=True se descarta el deltaLink y se recorre el drive entero.
+def reconciliar_sharepoint(completo=False):
+    return get_reconciliador().run(completo)
+
+
+"""-----------------------------------------------------------------------
+                        RECURSOS DEL PROCESO
+-----------------------------------------------------------------------"""
+# Pools, cliente de Graph, hilos... se crean la primera vez que se usan y son de este proceso.
+
+def cerrar_recursos():
+    """
+    Libera los recursos de este proceso. Se llama al salir y al parar un worker de gunicorn
+    (SIGTERM, ver gunicorn.conf.py), cuando ya no quedan requests en curso:
+    primero deja de coger trabajo (outbox, reconciliación) esperando al que está a medias,
+    después cierra los pools de la BBDD y la sesión de Graph. Se puede llamar varias veces.
+    """
+    global _outbox_worker, _sharepoint_executor, _export_pool, _db_pool, _repositorio, _graph_client, _reconciliador
+    outbox, _outbox_worker = _outbox_worker, None
+    if outbox is not None:
+        outbox.stop()
+    detener_programador()
+    executor, _sharepoint_executor = _sharepoint_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    detener_capturador()
+    for pool in (_export_pool, _db_pool):
+        if pool is not None:
+            pool.close_all()
+    _export_pool = _db_pool = _repositorio = _reconciliador = None
+    client, _graph_client = _graph_client, None
+    if client is not None:
+        client.close()
+
+atexit.register(cerrar_recursos)
+
+# Recursos heredados del proceso padre en un fork (nunca se usan ni se cierran, ver _tras_fork)
+_heredados = []
+
+def _tras_fork():
+    """
+    En el proceso hijo de un fork, olvida los recursos creados por el padre para que el hijo cree los suyos.
+    No se cierran: sus sockets (conexiones a PostgreSQL, keep-alive con Graph) los sigue usando el padre,
+    y cerrar una conexión de psycopg2 envía el mensaje de fin de sesión por ese socket compartido.
+    Por eso se guardan en _heredados: así tampoco se cierran al liberarse su memoria.
+    """
+    global _db_pool, _db_pool_lock, _repositorio, _graph_client, _graph_client_lock
+    global _sharepoint_executor, _sharepoint_executor_lock, _export_pool, _cache_contenido, _cache_contenido_lock
+    global _outbox_worker, _outbox_worker_lock, _reconciliador, _reconciliador_lock
+    _heredados.extend(r for r in (_db_pool, _export_pool, _graph_client, _sharepoint_executor,
+                                  _outbox_worker, _reconciliador) if r is not None)
+    _db_pool = _repositorio = _graph_client = _sharepoint_executor = None
+    _export_pool = _outbox_worker = _reconciliador = _cache_contenido = None
+    # Un lock copiado mientras otro hilo del padre lo tenía quedaría bloqueado para siempre
+    _db_pool_lock = threading.Lock()
+    _graph_client_lock = threading.Lock()
+    _sharepoint_executor_lock = threading.Lock()
+    _outbox_worker_lock = threading.Lock()
+    _reconciliador_lock = threading.Lock()
+    _cache_contenido_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_tras_fork)
@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import os
+from app.db.repositorio_async import RepositorioAsync
+from app.config.config import DB_CONFIG, GRAPH_CONFIG, UPLOAD_CONFIG, ASGI_CONFIG # Configuración de la BBDD, Graph, subidas y modo asyncio
+from app.utils.graph_client import BATCH_MAX_REQUESTS
+from app.utils.graph_async import AsyncChunkedUpload, AsyncGraphClient
+from app.utils.graph_upload import as_stream, stream_size
+from app.utils import metricas
+from app.utils.cache import response_cache # Caché de respuestas GET (se invalida en cada escritura)
+from app.utils.funciones import DRIVE_ID, SITE_ID, _resultado_lote, invalidar_contenido
+from app.db import queries as db # Consultas a la BBDD
+
+# Versión con corrutinas de las escrituras de funciones.py, para el modo asyncio (ver app/asgi.py).
+# Mismas consultas, mismos pasos y mismas invalidaciones de la caché; las llamadas a Graph y a la BBDD
+# no bloquean un hilo, así un proceso atiende muchas subidas y eliminaciones a la vez.
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# ------------------ Recursos por proceso (se crean en iniciar) ------------------ #
+_repositorio = None
+_graph_client = None
+_subidas = None  # Semáforo: subidas a SharePoint simultáneas
+
+async def iniciar():
+    """
+    Crea el pool de asyncpg, el cliente de Graph y el límite de subidas del proceso
+    (al arrancar la aplicación ASGI, dentro de su bucle de eventos).
+    """
+    global _repositorio, _graph_client, _subidas
+    repositorio = RepositorioAsync(DB_CONFIG, ASGI_CONFIG["DB_POOL_MIN"], ASGI_CONFIG["DB_POOL_MAX"])
+    await repositorio.abrir()
+    _repositorio = repositorio
+    _graph_client = AsyncGraphClient(
+        GRAPH_CONFIG,
+        os.getenv("TENANT_ID"),
+        os.getenv("CLIENT_ID"),
+        os.getenv("CLIENT_SECRET"),
+        max_connections=ASGI_CONFIG["GRAPH_MAX_CONNECTIONS"],
+    )
+    _subidas = asyncio.Semaphore(ASGI_CONFIG["MAX_CONCURRENT_UPLOADS"])
+
+async def cerrar():
+    """
+    Cierra el cliente de Graph y el pool de asyncpg (al parar la aplicación ASGI).
+    """
+    global _repositorio, _graph_client
+    if _graph_client is not None:
+        client, _graph_client = _graph_client, None
+        await client.aclose()
+    if _repositorio is not None:
+        repositorio, _repositorio = _repositorio, None
+        await repositorio.cerrar()
+
+def get_repositorio():
+    return _repositorio
+
+# Estado del pool de asyncpg para GET /metrics
+@metricas.registrar_medidor
+def _metricas_pool():
+    if _repositorio is None:
+        return []
+    stats = _repositorio.stats()
+    etiqueta = (("pool", "async"),)
+    return [
+        ("autodoc_db_pool_connections", etiqueta + (("state", "in_use"),), stats["size"] - stats["idle"]),
+        ("autodoc_db_pool_connections", etiqueta + (("state", "idle"),), stats["idle"]),
+        ("autodoc_db_pool_max_connections", etiqueta, stats["max"]),
+    ]
+
+def get_graph_client():
+    return _graph_client
+
+# Invalida la caché de respuestas en este proceso y publica la invalidación para el resto (como
+# ResponseCache.invalidate, pero con el pool de asyncpg en lugar de bloquear el bucle de eventos).
+async def invalidar_cache(*etiquetas):
+    etiquetas = response_cache.invalidate_local(*etiquetas)
+    if response_cache.shared is None or not etiquetas:
+        return
+    try:
+        await _repositorio.execute(db.PUBLISH_CACHE_INVALIDATION, (etiquetas,))
+    except Exception:
+        logger.exception(f"[CACHE] Could not publish invalidation of {etiquetas}, other workers may serve stale responses for {response_cache.ttl}s.")
+
+# Igual que funciones.graph_request, sin bloquear el bucle de eventos
+async def graph_request(method, path, headers=None, **kwargs):
+    return await _graph_client.request(method, path, headers=headers, **kwargs)
+
+"""-----------------------------------------------------------------------
+                       PROYECTOS
+-----------------------------------------------------------------------"""
+
+# Inserta un nuevo proyecto en la base de datos y devuelve el ID
+async def crear_proyecto(nombre, descripcion, proyecto_url, id_sharepoint):
+    fila = (await _repositorio.execute_returning(
+        db.CREATE_PROJECT,
+        (nombre, descripcion, proyecto_url, id_sharepoint)
+    ))[0]
+    proyecto_id = fila["proyecto_id"]
+
+    await invalidar_cache("proyectos")
+    return proyecto_id
+
+# Crear carpeta en Sharepoint para el proyecto
+async def crear_carpeta_sharepoint(nombre_carpeta):
+    url = f"/sites/{SITE_ID}/drives/{DRIVE_ID}/root/children"
+    headers = {
+        "Content-Type": "application/json"
+    }
+    body = {
+        "name": nombre_carpeta,
+        "folder": {},
+        "@microsoft.graph.conflictBehavior": "rename"
+    }
+
+    # Sin reintentos: si Graph ya la hubiera creado, repetir el POST crearía otra ("Nombre 1")
+    response = await graph_request("POST", url, headers=headers, json=body, retry=False)
+    response.raise_for_status() # Lanza error si falla
+    folder_info = response.json()
+
+    # Devuelve la URL de la carpeta creada y su ID
+    return folder_info.get("webUrl"), folder_info.get("id")
+
+async def modificar_proyecto_bbdd(proyecto_id, nombre, descripcion, proyecto_url):
+    filas = await _repositorio.execute(db.UPDATE_PROJECT, (nombre, descripcion, proyecto_url, proyecto_id))
+    await invalidar_cache(("proyecto", proyecto_id), "proyectos")
+    # Si ninguna fila fue afectada, el proyecto no existía
+    return filas > 0
+
+async def modificar_proyecto_sharepoint(proyecto_id, nuevo_nombre):
+    folder_id = await obtener_info_proyecto(proyecto_id)
+
+    url = f"/drives/{DRIVE_ID}/items/{folder_id}"
+    headers = {
+        "Content-Type": "application/json"
+    }
+    body = {
+        "name": nuevo_nombre
+    }
+
+    response = await graph_request("PATCH", url, headers=headers, json=body)
+    response.raise_for_status() # Lanza error si falla
+
+    return response.json().get("webUrl")  # Devuelve la nueva URL pública de la carpeta
+
+# Elimina un proyecto dado su ID (lectura corta, SharePoint sin conexión tomada y escritura corta,
+# como funciones.eliminar_proyecto). Devuelve True si se eliminó, False si no existía.
+async def eliminar_proyecto(proyecto_id):
+    proyecto = await _repositorio.fetch_one(db.GET_PROJECT_URL_BY_ID, (proyecto_id,))
+    if not proyecto:
+        return False
+    folder_id = proyecto["id_sharepoint"]
+
+    if folder_id:
+        response = await graph_request("DELETE", f"/drives/{DRIVE_ID}/items/{folder_id}")
+        if response.status_code not in (204, 404):
+            # 204 = eliminado correctamente, 404 = ya no existía
+            raise Exception(f"No se pudo eliminar la carpeta en SharePoint: {response.text}")
+
+    # Eliminar de la BBDD (los documentos se eliminan en cascada) si nadie lo ha cambiado mientras tanto
+    async with _repositorio.transaccion() as consultas:
+        eliminado = await consultas.fetch_one(db.DELETE_PROJECT_IF_UNCHANGED, (proyecto_id, folder_id)) is not None
+        if not eliminado and await consultas.fetch_one(db.GET_PROJECT_URL_BY_ID, (proyecto_id,)):
+            raise Exception("El proyecto ha cambiado mientras se eliminaba, vuelve a intentarlo")
+
+    if eliminado:
+        await invalidar_cache(("proyecto", proyecto_id), "proyectos", ("documentos", proyecto_id))
+    return eliminado
+
+# Elimina varios elementos de SharePoint en llamadas /$batch de hasta 20, enviadas a la vez.
+# `items` es {clave: id_sharepoint}. Devuelve {clave: None si se eliminó o ya no existía, o el mensaje de error}.
+async def _eliminar_items_sharepoint(items):
+    claves = list(items)
+    lotes = [claves[i:i + BATCH_MAX_REQUESTS] for i in range(0, len(claves), BATCH_MAX_REQUESTS)]
+
+    def sub_requests(lote):
+        return [
+            {"id": str(n), "method": "DELETE", "url": f"/drives/{DRIVE_ID}/items/{items[clave]}"}
+            for n, clave in enumerate(lote)
+        ]
+
+    respuestas_lotes = await asyncio.gather(
+        *[_graph_client.batch(sub_requests(lote)) for lote in lotes], return_exceptions=True
+    )
+
+    errores = {}
+    for lote, respuestas in zip(lotes, respuestas_lotes):
+        if isinstance(respuestas, Exception):
+            for clave in lote:
+                errores[clave] = f"No se pudo contactar con SharePoint: {respuestas}"
+            continue
+        for n, clave in enumerate(lote):
+            respuesta = respuestas.get(str(n))
+            if respuesta is None:
+                errores[clave] = "SharePoint no devolvió respuesta"
+            elif respuesta["status"] in (204, 404):
+                errores[clave] = None
+            else:
+                errores[clave] = f"SharePoint respondió {respuesta['status']}: {respuesta.get('body')}"
+    return errores
+
+# Elimina varios proyectos (carpetas en SharePoint vía $batch + filas en una transacción).
+# Devuelve un resultado por ID: eliminado, no encontrado o error de SharePoint.
+async def eliminar_proyectos_lote(ids):
+    filas = {
+        f["proyecto_id"]: f["id_sharepoint"]
+        for f in await _repositorio.fetch_many(db.GET_PROJECTS_SHAREPOINT_BY_IDS, (list(ids),))
+    }
+
+    errores = await _eliminar_items_sharepoint({pid: sp for pid, sp in filas.items() if sp})
+
+    borrar = [pid for pid in filas if not errores.get(pid)]
+    eliminados = set()
+    if borrar:
+        eliminados = {f["proyecto_id"] for f in await _repositorio.execute_returning(db.DELETE_PROJECTS, (borrar,))}
+        await invalidar_cache("proyectos", *[t for pid in eliminados for t in (("proyecto", pid), ("documentos", pid))])
+
+    return [_resultado_lote(i, i in eliminados, errores.get(i), i in filas) for i in ids]
+
+# Devuelve el ID de la carpeta de Sharepoint asociada a un proyecto
+async def obtener_info_proyecto(idProyecto):
+    result = await _repositorio.fetch_one(db.GET_PROJECT_URL_BY_ID, (idProyecto,))
+
+    if not result or not result.get("proyecto_url"):
+        raise Exception(f"No se encontró URL de SharePoint para el proyecto {idProyecto}")
+
+    return result["id_sharepoint"]
+
+"""-----------------------------------------------------------------------
+                       DOCUMENTOS
+-----------------------------------------------------------------------"""
+
+# Crear un nuevo documento
+async def crear_documento(proyecto_id, nombre, descripcion, url, archivo_id):
+    fila = (await _repositorio.execute_returning(
+        db.CREATE_DOCUMENT,
+        (proyecto_id, nombre, descripcion, url, archivo_id)
+    ))[0]
+    documento_id = fila["documento_id"]
+
+    await invalidar_cache(("documentos", proyecto_id))
+    return documento_id
+
+def _leer(stream):
+    stream.seek(0)
+    return stream.read()
+
+# Sube contenido a SharePoint como funciones._subir_contenido (PUT simple o upload session por fragmentos).
+# Como mucho MAX_CONCURRENT_UPLOADS subidas a la vez por proceso; el resto espera turno.
+# El archivo recibido puede estar en disco: se lee en un hilo para no bloquear el bucle de eventos.
+async def _subir_contenido(simple_path, session_path, contenido, upload_id=None):
+    stream = as_stream(contenido)
+    size = stream_size(stream)
+
+    async with _subidas:
+        if size <= UPLOAD_CONFIG["SIMPLE_UPLOAD_MAX"]:
+            headers = {
+                "Content-Type": "application/octet-stream"
+            }
+            datos = await asyncio.to_thread(_leer, stream)
+            response = await graph_request("PUT", simple_path, headers=headers, content=datos)
+            response.raise_for_status()
+            return response.json()
+
+        subida = AsyncChunkedUpload(
+            _graph_client,
+            session_path,
+            stream,
+            size,
+            chunk_size=UPLOAD_CONFIG["CHUNK_SIZE"],
+            max_retries=UPLOAD_CONFIG["CHUNK_RETRIES"],
+            upload_id=upload_id,
+        )
+        return await subida.run()
+
+# Subir archivo a Sharepoint
+async def subir_archivo_sharepoint(nombre_archivo, contenido_bytes, carpeta_id, upload_id=None):
+    url = f"/drives/{DRIVE_ID}/items/{carpeta_id}:/{nombre_archivo}:"
+
+    item = await _subir_contenido(f"{url}/content", f"{url}/createUploadSession", contenido_bytes, upload_id)
+
+    return item.get("webUrl"), item.get("id")
+
+# Sube varios archivos a la carpeta del proyecto a la vez y los registra en una sola inserción.
+# `archivos` es una lista de dicts con nombre, descripcion, filename y stream.
+# Devuelve un resultado por archivo (en el mismo orden), con el error si falló su subida.
+async def subir_documentos_lote(proyecto_id, archivos):
+    folder_id = await obtener_info_proyecto(proyecto_id)
+
+    # 1. Subidas a SharePoint a la vez (sin conexión a la BBDD tomada)
+    subidas = await asyncio.gather(
+        *[subir_archivo_sharepoint(a["filename"], a["stream"], folder_id) for a in archivos],
+        return_exceptions=True
+    )
+    resultados = []
+    for archivo, subida in zip(archivos, subidas):
+        if isinstance(subida, Exception):
+            resultados.append({"archivo": archivo["filename"], "ok": False, "error": str(subida)})
+        else:
+            url, archivo_id = subida
+            resultados.append({"archivo": archivo["filename"], "ok": True, "url": url, "id_sharepoint": archivo_id})
+
+    # 2. Registrar en la BBDD todos los subidos en una única sentencia
+    subidos = [(a, r) for a, r in zip(archivos, resultados) if r["ok"]]
+    if subidos:
+        filas = await _repositorio.execute_returning(db.CREATE_DOCUMENTS_UNNEST, (
+            proyecto_id,
+            [a["nombre"] for a, _ in subidos],
+            [a["descripcion"] for a, _ in subidos],
+            [r["url"] for _, r in subidos],
+            [r["id_sharepoint"] for _, r in subidos],
+        ))
+        ids = {fila["id_sharepoint"]: fila["documento_id"] for fila in filas}
+        for _, r in subidos:
+            r["documento_id"] = ids.get(r["id_sharepoint"])
+        await invalidar_cache(("documentos", proyecto_id))
+
+    for r in resultados:
+        r.pop("id_sharepoint", None)
+    return resultados
+
+# Modificar documento
+async def modificar_documento_bbdd(documento_id, nombre, descripcion, url=None):
+    if url:
+        filas = await _repositorio.execute_returning(db.UPDATE_DOCUMENT_URL, (nombre, descripcion, url, documento_id))
+    else:
+        filas = await _repositorio.execute_returning(db.UPDATE_DOCUMENT, (nombre, descripcion, documento_id))
+    if not filas:
+        return False
+    await invalidar_cache(("documento", documento_id), ("documentos", filas[0]["proyecto_id"]))
+    return True
+
+async def modificar_documento_sharepoint(sharepoint_id, contenido_bytes, upload_id=None):
+    url = f"/drives/{DRIVE_ID}/items/{sharepoint_id}"
+
+    item = await _subir_contenido(f"{url}/content", f"{url}/createUploadSession", contenido_bytes, upload_id)
+    invalidar_contenido(sharepoint_id)
+
+    # Devuelve la URL pública del archivo
+    return item.get("webUrl")
+
+# Eliminar un documento (lectura corta, SharePoint sin conexión tomada y escritura corta,
+# como funciones.eliminar_documento)
+async def eliminar_documento(documento_id):
+    documento = await _repositorio.fetch_one(db.GET_DOCUMENT_BY_ID, (documento_id,))
+    if not documento:
+        return False
+    sharepoint_id = documento["id_sharepoint"]
+
+    if sharepoint_id:
+        response = await graph_request("DELETE", f"/drives/{DRIVE_ID}/items/{sharepoint_id}")
+        if response.status_code not in (204, 404):
+            raise Exception(f"No se pudo eliminar el archivo en SharePoint: {response.text}")
+
+    async with _repositorio.transaccion() as consultas:
+        fila = await consultas.fetch_one(db.DELETE_DOCUMENT_IF_UNCHANGED, (documento_id, sharepoint_id))
+        if not fila:
+            if await consultas.fetch_one(db.GET_DOCUMENT_BY_ID, (documento_id,)):
+                raise Exception("El documento ha cambiado mientras se eliminaba, vuelve a intentarlo")
+            return False
+
+    await invalidar_cache(("documento", documento_id), ("documentos", fila["proyecto_id"]))
+    return True
+
+# Elimina varios documentos de un proyecto (archivos en SharePoint vía $batch + filas en una transacción).
+# Devuelve un resultado por ID: eliminado, no encontrado o error de SharePoint.
+async def eliminar_documentos_lote(proyecto_id, ids):
+    filas = {
+        f["documento_id"]: f["id_sharepoint"]
+        for f in await _repositorio.fetch_many(db.GET_DOCUMENTS_SHAREPOINT_BY_IDS, (proyecto_id, list(ids)))
+    }
+
+    errores = await _eliminar_items_sharepoint({did: sp for did, sp in filas.items() if sp})
+
+    borrar = [did for did in filas if not errores.get(did)]
+    eliminados = set()
+    if borrar:
+        filas_eliminadas = await _repositorio.execute_returning(db.DELETE_DOCUMENTS, (proyecto_id, borrar))
+        eliminados = {f["documento_id"] for f in filas_eliminadas}
+        await invalidar_cache(("documentos", proyecto_id), *[("documento", did) for did in eliminados])
+
+    return [_resultado_lote(i, i in eliminados, errores.get(i), i in filas) for i in ids]
+
+# Devuelve el ID del archivo en Sharepoint
+async def obtener_info_documento(documento_id):
+    result = await _repositorio.fetch_one(db.GET_DOCUMENT_BY_ID, (documento_id,))
+
+    if not result or not result.get("id_sharepoint"):
+        raise Exception(f"No se encontró el documento con ID {documento_id} o no tiene ID de SharePoint")
+
+    return result["id_sharepoint"]
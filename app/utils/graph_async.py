@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+import httpx
+
+from app.utils import metricas
+from app.utils.graph_client import BATCH_MAX_REQUESTS, IDEMPOTENT_METHODS, GraphClientBase, _batch_idempotente
+from app.utils.graph_token import AsyncGraphTokenCache
+from app.utils.graph_upload import ChunkedUpload, _next_offset, _set_progress
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+
+class AsyncGraphClient(GraphClientBase):
+    """
+    Cliente de Microsoft Graph para el modo asyncio (ver app/asgi.py), con httpx.AsyncClient.
+    Mismas reglas que GraphClient (token cacheado, renovación tras 401, reintentos de 429/5xx
+    respetando Retry-After, POST solo tras 429 o sin llegar a conectar), pero mientras espera a Graph el proceso sigue atendiendo otras peticiones.
+    - Como mucho `max_connections` conexiones con Graph a la vez; el resto de llamadas espera turno.
+    """
+
+    def __init__(self, config, tenant_id, client_id, client_secret, max_connections=100):
+        super().__init__(config)
+        connect_timeout, read_timeout = self.timeout
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.session = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=self.timeout,
+        )
+        self.tokens = AsyncGraphTokenCache(
+            tenant_id, client_id, client_secret,
+            refresh_margin=config.get("TOKEN_REFRESH_MARGIN", 300),
+            login_url=config.get("LOGIN_URL", "https://login.microsoftonline.com"),
+            session=self.session,
+            timeout=self.timeout,
+        )
+
+    async def request(self, method, path, headers=None, retry=True, authenticate=True, idempotent=None, **kwargs):
+        """
+        Hace una petición a Graph y devuelve la respuesta (sin raise_for_status).
+        `retry=False` desactiva los reintentos; `authenticate=False` no envía el token;
+        `idempotent` como en GraphClient.request. El cuerpo binario se pasa con `content=` (httpx).
+        """
+        url = self.url(path)
+        max_retries = self.max_retries if retry else 0
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        token_renewed = False
+        attempt = 0
+        start = time.perf_counter()
+
+        while True:
+            token = None
+            if authenticate:
+                with metricas.medir(metricas.TOKEN):
+                    token = await self.tokens.get_token()
+            all_headers = {"Authorization": f"Bearer {token}"} if token else {}
+            all_headers.update(headers or {})
+            try:
+                with metricas.medir(metricas.GRAPH):
+                    response = await self.session.request(method, url, headers=all_headers, **kwargs)
+            except httpx.TransportError as e:
+                self._contar_respuesta(method, "error")
+                # ConnectError/ConnectTimeout/PoolTimeout: la petición no llegó a enviarse
+                sin_enviar = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                if attempt >= max_retries or not (idempotent or sin_enviar):
+                    self._record(method, time.perf_counter() - start, attempt)
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"[GRAPH] {method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+            else:
+                self._contar_respuesta(method, response.status_code)
+                if response.status_code == 401 and authenticate and not token_renewed:
+                    # Token revocado o caducado: renovar y reintentar una vez
+                    self.tokens.invalidate(token)
+                    token_renewed = True
+                    continue
+                if not self._reintentable(response.status_code, idempotent) or attempt >= max_retries:
+                    elapsed = time.perf_counter() - start
+                    self._record(method, elapsed, attempt)
+                    response.graph_latency = elapsed  # latencia total incluyendo reintentos
+                    logger.debug(f"[GRAPH] {method} {url} -> {response.status_code} in {elapsed * 1000:.0f}ms")
+                    return response
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"[GRAPH] {method} {url} -> {response.status_code}, retrying in {delay:.1f}s")
+
+            attempt += 1
+            with metricas.medir(metricas.GRAPH_RETRY):
+                await asyncio.sleep(delay)
+
+    async def batch(self, sub_requests):
+        """
+        Igual que GraphClient.batch: hasta BATCH_MAX_REQUESTS peticiones en una llamada a /$batch,
+        reintentando las sub-peticiones rechazadas con 429/5xx.
+        """
+        if len(sub_requests) > BATCH_MAX_REQUESTS:
+            raise ValueError(f"Graph admite como máximo {BATCH_MAX_REQUESTS} peticiones por $batch")
+
+        resultados = {}
+        pendientes = list(sub_requests)
+        attempt = 0
+        while pendientes:
+            response = await self.request("POST", "/$batch", json={"requests": pendientes}, idempotent=_batch_idempotente(pendientes))
+            response.raise_for_status()
+
+            reintentar, delay = self._batch_results(pendientes, response.json(), attempt, resultados)
+            if not reintentar:
+                break
+            logger.warning(f"[GRAPH] $batch: {len(reintentar)} sub-requests throttled, retrying in {delay:.1f}s")
+            with metricas.medir(metricas.GRAPH_RETRY):
+                await asyncio.sleep(delay)
+            pendientes = reintentar
+            attempt += 1
+
+        return resultados
+
+    async def aclose(self):
+        """
+        Cierra las conexiones keep-alive.
+        """
+        await self.session.aclose()
+
+
+class AsyncChunkedUpload(ChunkedUpload):
+    """
+    ChunkedUpload con AsyncGraphClient: mismos fragmentos, reanudación y progreso.
+    Cada fragmento se lee del archivo en un hilo (el archivo recibido puede estar en disco)
+    para no bloquear el bucle de eventos.
+    """
+
+    async def _create_session(self):
+        body = {"item": {"@microsoft.graph.conflictBehavior": self.conflict_behavior}}
+        response = await self.client.request("POST", self.create_path, json=body, idempotent=True)  # ver ChunkedUpload._create_session
+        response.raise_for_status()
+        self.upload_url = response.json()["uploadUrl"]
+
+    async def _query_offset(self):
+        response = await self.client.request("GET", self.upload_url, authenticate=False)
+        if response.status_code == 404:
+            raise Exception("La sesión de subida de SharePoint ha caducado.")
+        response.raise_for_status()
+        offset = _next_offset(response.json())
+        return self.offset if offset is None else offset
+
+    async def _put_chunk(self):
+        chunk, headers = await asyncio.to_thread(self._read_chunk)
+        # Sin reintentos del cliente: si falla, se reanuda desde el rango que confirme Graph
+        return await self.client.request("PUT", self.upload_url, headers=headers, content=chunk,
+                                         retry=False, authenticate=False)
+
+    async def cancel(self):
+        if self.upload_url:
+            try:
+                await self.client.request("DELETE", self.upload_url, authenticate=False, retry=False)
+            except httpx.HTTPError:
+                pass
+
+    async def run(self):
+        """
+        Ejecuta la subida completa y devuelve el JSON del driveItem creado.
+        """
+        _set_progress(self.upload_id, estado="subiendo", subido=0, total=self.size)
+        fallos = 0
+
+        try:
+            await self._create_session()
+            while True:
+                response = None
+                try:
+                    response = await self._put_chunk()
+                except httpx.TransportError as e:
+                    logger.warning(f"[GRAPH] Chunk at byte {self.offset} failed: {e!r}")
+
+                resultado = self._chunk_result(response)
+                if resultado == "completado":
+                    return response.json()
+                if resultado == "aceptado":
+                    fallos = 0
+                    continue
+
+                fallos += 1
+                if fallos > self.max_retries:
+                    raise Exception(f"La subida falló {fallos} veces seguidas en el byte {self.offset}.")
+                await asyncio.sleep(self.client._retry_delay(fallos - 1, response))
+                self.offset = await self._query_offset()
+                _set_progress(self.upload_id, subido=self.offset, reintentos=fallos)
+
+        except Exception as e:
+            _set_progress(self.upload_id, estado="error", error=str(e))
+            await self.cancel()
+            raise
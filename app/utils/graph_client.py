@@ -0,0 +1,260 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from app.db.psql_connection_pool import note_io
+from app.utils import metricas
+from app.utils.graph_token import GraphTokenCache
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Códigos de Graph que indican saturación/fallo temporal y se pueden reintentar
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Métodos que se reintentan tras 5xx o errores de red: repetirlos deja SharePoint igual que hacerlos una vez.
+# Un POST (p. ej. crear una carpeta con conflictBehavior "rename") solo se reintenta tras 429 o si no llegó
+# a enviarse (error al conectar): si Graph ya lo había procesado, repetirlo crearía "Nombre 1", "Nombre 2"...
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "PATCH")
+
+# Máximo de sub-peticiones que Graph acepta en una llamada a /$batch
+BATCH_MAX_REQUESTS = 20
+
+
+def _sin_enviar(error):
+    """
+    True si la petición no llegó a Graph: no se pudo abrir la conexión (se puede reenviar aunque sea un POST).
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    motivo = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(motivo, NewConnectionError)
+
+
+def _batch_idempotente(sub_requests):
+    """
+    Un /$batch se puede reenviar entero si todas sus sub-peticiones se pueden repetir.
+    """
+    return all(r["method"].upper() in IDEMPOTENT_METHODS for r in sub_requests)
+
+
+class GraphClientBase:
+    """
+    Lo común a los clientes de Microsoft Graph (GraphClient y AsyncGraphClient del modo asyncio):
+    configuración de reintentos, URLs, cálculo de esperas y estadísticas de latencia.
+    """
+
+    def __init__(self, config):
+        self.base_url = config["BASE_URL"].rstrip("/")
+        self.timeout = (config.get("CONNECT_TIMEOUT", 5), config.get("READ_TIMEOUT", 60))
+        self.max_retries = config.get("MAX_RETRIES", 4)
+        self.backoff_factor = config.get("BACKOFF_FACTOR", 0.5)
+        self.max_backoff = config.get("MAX_BACKOFF", 30)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {}  # método -> {"count", "total", "max", "retries"}
+
+    def url(self, path):
+        """
+        Devuelve la URL completa de Graph para una ruta relativa ("/drives/...").
+        """
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def _retry_delay(self, attempt, response=None):
+        """
+        Segundos a esperar antes del siguiente intento.
+        Usa Retry-After si Graph lo envía; si no, backoff exponencial con jitter.
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                # Retry-After también puede venir como fecha HTTP
+                try:
+                    fecha = email.utils.parsedate_to_datetime(retry_after)
+                    delay = fecha.timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = self.backoff_factor * (2 ** attempt)
+            return min(max(delay, 0), self.max_backoff)
+        delay = self.backoff_factor * (2 ** attempt)
+        return min(delay + random.uniform(0, self.backoff_factor), self.max_backoff)
+
+    def _reintentable(self, status, idempotent):
+        """
+        True si la respuesta `status` se puede reintentar (ver IDEMPOTENT_METHODS).
+        """
+        return status in RETRY_STATUS if idempotent else status == 429
+
+    def _record(self, method, elapsed, retries):
+        with self._stats_lock:
+            s = self._stats.setdefault(method, {"count": 0, "total": 0.0, "max": 0.0, "retries": 0})
+            s["count"] += 1
+            s["total"] += elapsed
+            s["max"] = max(s["max"], elapsed)
+            s["retries"] += retries
+
+    def _contar_respuesta(self, method, status):
+        """
+        Cuenta cada respuesta de Graph (también las que se reintentan) por método y código de estado.
+        """
+        metricas.contar("autodoc_graph_responses_total", (("method", method), ("status", str(status))))
+
+    def stats(self):
+        """
+        Devuelve latencias acumuladas por método HTTP (número, media, máxima y reintentos).
+        """
+        with self._stats_lock:
+            return {
+                method: {
+                    "count": s["count"],
+                    "avg_ms": round(s["total"] / s["count"] * 1000, 1),
+                    "max_ms": round(s["max"] * 1000, 1),
+                    "retries": s["retries"],
+                }
+                for method, s in self._stats.items()
+            }
+
+    def _batch_results(self, pendientes, payload, attempt, resultados):
+        """
+        Guarda en `resultados` las respuestas de una llamada a /$batch.
+        Devuelve (sub-peticiones rechazadas con 429/5xx que se pueden reintentar, segundos de espera).
+        """
+        reintentar = []
+        delay = 0
+        por_id = {r["id"]: r for r in pendientes}
+        for sub in payload.get("responses", []):
+            resultados[sub["id"]] = {"status": sub["status"], "body": sub.get("body")}
+            if sub["status"] in RETRY_STATUS and attempt < self.max_retries:
+                reintentar.append(por_id[sub["id"]])
+                retry_after = (sub.get("headers") or {}).get("Retry-After")
+                try:
+                    sub_delay = float(retry_after) if retry_after else self._retry_delay(attempt)
+                except ValueError:
+                    sub_delay = self._retry_delay(attempt)
+                delay = max(delay, min(sub_delay, self.max_backoff))
+        return reintentar, delay
+
+
+class GraphClient(GraphClientBase):
+    """
+    Cliente HTTP único para Microsoft Graph.
+    - Reutiliza conexiones TLS keep-alive (requests.Session con pool de conexiones).
+    - Añade el access token cacheado y lo renueva una vez si Graph responde 401.
+    - Reintenta 429/5xx y errores de red con backoff exponencial, respetando Retry-After
+      (los POST solo tras 429 o si no se llegó a conectar, ver IDEMPOTENT_METHODS).
+    - Mide la latencia de cada llamada (ver stats()) y la anota en las métricas de la petición (app/utils/metricas.py).
+    """
+
+    def __init__(self, config, tenant_id, client_id, client_secret):
+        super().__init__(config)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=config.get("POOL_CONNECTIONS", 10),
+            pool_maxsize=config.get("POOL_MAXSIZE", 20),
+            max_retries=0,  # Los reintentos los gestiona request()
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.tokens = GraphTokenCache(
+            tenant_id, client_id, client_secret,
+            refresh_margin=config.get("TOKEN_REFRESH_MARGIN", 300),
+            login_url=config.get("LOGIN_URL", "https://login.microsoftonline.com"),
+            session=self.session,
+            timeout=self.timeout,
+        )
+
+    def request(self, method, path, headers=None, retry=True, authenticate=True, idempotent=None, **kwargs):
+        """
+        Hace una petición a Graph y devuelve la respuesta (sin raise_for_status).
+        `retry=False` desactiva los reintentos (p. ej. cuerpos que no se pueden reenviar).
+        `authenticate=False` no envía el token (las uploadUrl de Graph ya van firmadas).
+        `idempotent` indica si se puede reenviar tras 5xx o errores de red (por defecto, según el método).
+        """
+        url = self.url(path)
+        note_io(f"Graph {method} {path.split('?')[0]}")  # Ninguna llamada a Graph debe hacerse con una conexión a la BBDD tomada
+        kwargs.setdefault("timeout", self.timeout)
+        max_retries = self.max_retries if retry else 0
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        token_renewed = False
+        attempt = 0
+        start = time.perf_counter()
+
+        while True:
+            token = None
+            if authenticate:
+                with metricas.medir(metricas.TOKEN):
+                    token = self.tokens.get_token()
+            all_headers = {"Authorization": f"Bearer {token}"} if token else {}
+            all_headers.update(headers or {})
+            try:
+                with metricas.medir(metricas.GRAPH):
+                    response = self.session.request(method, url, headers=all_headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._contar_respuesta(method, "error")
+                if attempt >= max_retries or not (idempotent or _sin_enviar(e)):
+                    self._record(method, time.perf_counter() - start, attempt)
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"[GRAPH] {method} {url} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                self._contar_respuesta(method, response.status_code)
+                if response.status_code == 401 and authenticate and not token_renewed:
+                    # Token revocado o caducado: renovar y reintentar una vez
+                    self.tokens.invalidate(token)
+                    token_renewed = True
+                    continue
+                if not self._reintentable(response.status_code, idempotent) or attempt >= max_retries:
+                    elapsed = time.perf_counter() - start
+                    self._record(method, elapsed, attempt)
+                    response.graph_latency = elapsed  # latencia total incluyendo reintentos
+                    logger.debug(f"[GRAPH] {method} {url} -> {response.status_code} in {elapsed * 1000:.0f}ms")
+                    return response
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"[GRAPH] {method} {url} -> {response.status_code}, retrying in {delay:.1f}s")
+
+            attempt += 1
+            with metricas.medir(metricas.GRAPH_RETRY):
+                time.sleep(delay)
+
+    def batch(self, sub_requests):
+        """
+        Envía hasta BATCH_MAX_REQUESTS peticiones en una sola llamada a /$batch.
+        `sub_requests` es una lista de dicts {"id", "method", "url"} (url relativa a BASE_URL).
+        Las sub-peticiones que Graph rechaza con 429/5xx se reintentan (respetando su Retry-After).
+        Devuelve {id: {"status": código, "body": cuerpo}} con la última respuesta de cada una.
+        """
+        if len(sub_requests) > BATCH_MAX_REQUESTS:
+            raise ValueError(f"Graph admite como máximo {BATCH_MAX_REQUESTS} peticiones por $batch")
+
+        resultados = {}
+        pendientes = list(sub_requests)
+        attempt = 0
+        while pendientes:
+            response = self.request("POST", "/$batch", json={"requests": pendientes}, idempotent=_batch_idempotente(pendientes))
+            response.raise_for_status()
+
+            reintentar, delay = self._batch_results(pendientes, response.json(), attempt, resultados)
+            if not reintentar:
+                break
+            logger.warning(f"[GRAPH] $batch: {len(reintentar)} sub-requests throttled, retrying in {delay:.1f}s")
+            with metricas.medir(metricas.GRAPH_RETRY):
+                time.sleep(delay)
+            pendientes = reintentar
+            attempt += 1
+
+        return resultados
+
+    def close(self):
+        """
+        Cierra las conexiones keep-alive de la sesión.
+        """
+        self.session.close()
\ No newline at end of file
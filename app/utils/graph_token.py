@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+import time
+import requests
+
+from app.utils import metricas
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+
+class GraphTokenCache:
+    """
+    Caché del access token de Microsoft Graph (Client Credentials).
+    - Guarda el token hasta su caducidad (campo expires_in de Azure AD).
+    - Lo renueva antes de que caduque (refresh_margin segundos antes).
+    - Solo un hilo pide token nuevo a la vez; el resto espera ese mismo resultado
+      o sigue usando el token actual mientras aún sea válido.
+    - Si la renovación anticipada falla (p. ej. Azure AD no responde), se sigue usando el token
+      actual mientras sea válido; el error solo llega a la petición cuando ya no queda token.
+    """
+
+    def __init__(self, tenant_id, client_id, client_secret, refresh_margin=300,
+                 login_url="https://login.microsoftonline.com", session=None, timeout=30):
+        self.url = f"{login_url}/{tenant_id}/oauth2/v2.0/token"
+        self.session = session or requests  # Session compartida si se indica (keep-alive)
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+
+        self._token = None
+        self._expires_at = 0.0  # time.monotonic() en el que caduca el token
+        self._refresh_lock = threading.Lock()  # garantiza un único refresh en vuelo
+        self.refresh_count = 0  # número de tokens pedidos a Azure AD
+
+    def _is_valid(self, now):
+        return self._token is not None and now < self._expires_at
+
+    def _is_fresh(self, now):
+        return self._token is not None and now < self._expires_at - self.refresh_margin
+
+    def get_token(self):
+        """
+        Devuelve un token válido, pidiéndolo a Azure AD solo si hace falta.
+        """
+        now = time.monotonic()
+        if self._is_fresh(now):
+            return self._token
+
+        if self._is_valid(now):
+            # Dentro del margen de renovación: un hilo renueva y el resto sigue con el token actual
+            if not self._refresh_lock.acquire(blocking=False):
+                return self._token
+        else:
+            # Sin token válido: todos esperan al refresh en curso
+            self._refresh_lock.acquire()
+
+        try:
+            # Otro hilo puede haberlo renovado mientras esperábamos el lock
+            now = time.monotonic()
+            if self._is_fresh(now):
+                return self._token
+            try:
+                return self._refresh()
+            except Exception as e:
+                return self._refresh_failed(e, now)
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_failed(self, error, now):
+        """
+        Si falla la renovación anticipada y el token actual aún es válido, se sigue usando
+        (se vuelve a intentar en la siguiente llamada). Sin token válido, el error se propaga.
+        """
+        if not self._is_valid(now):
+            raise error
+        logger.warning(f"[GRAPH] Token refresh failed ({error}), using the current token "
+                       f"(expires in {self._expires_at - now:.0f}s).")
+        return self._token
+
+    def _refresh(self):
+        """
+        Pide un token nuevo al endpoint OAuth2 de Azure AD.
+        """
+        headers, data = self._token_request()
+        requested_at = time.monotonic()
+        response = self.session.post(self.url, data=data, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return self._store(response.json(), requested_at)
+
+    def _token_request(self):
+        """
+        Cabeceras y formulario de la petición de token (Client Credentials).
+        """
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scope": "https://graph.microsoft.com/.default"
+        }
+        return headers, data
+
+    def _store(self, payload, requested_at):
+        """
+        Guarda el token recibido; caduca expires_in segundos después de pedirlo.
+        """
+        self._token = payload["access_token"]
+        self._expires_at = requested_at + int(payload.get("expires_in", 3599))
+        self.refresh_count += 1
+        metricas.contar("autodoc_graph_token_refreshes_total")
+        logger.info("[GRAPH] Access token refreshed (expires in %ss).", payload.get("expires_in"))
+        return self._token
+
+    def invalidate(self, token=None):
+        """
+        Descarta el token cacheado (p. ej. tras un 401).
+        Si se indica `token`, solo se descarta si sigue siendo el actual,
+        para no tirar un token que otro hilo acaba de renovar.
+        """
+        with self._refresh_lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+
+class AsyncGraphTokenCache(GraphTokenCache):
+    """
+    La misma caché para el modo asyncio (ver app/asgi.py), con `session` = httpx.AsyncClient.
+    Solo una corrutina pide token nuevo a la vez (asyncio.Lock); mientras tanto, si el token
+    actual aún es válido, el resto lo sigue usando sin esperar.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._refresh_lock = asyncio.Lock()
+
+    async def get_token(self):
+        """
+        Devuelve un token válido, pidiéndolo a Azure AD solo si hace falta.
+        """
+        now = time.monotonic()
+        if self._is_fresh(now):
+            return self._token
+        if self._is_valid(now) and self._refresh_lock.locked():
+            return self._token  # otra corrutina ya lo está renovando
+
+        async with self._refresh_lock:
+            # Otra corrutina puede haberlo renovado mientras esperábamos el lock
+            now = time.monotonic()
+            if self._is_fresh(now):
+                return self._token
+            try:
+                return await self._refresh()
+            except Exception as e:
+                return self._refresh_failed(e, now)
+
+    async def _refresh(self):
+        headers, data = self._token_request()
+        requested_at = time.monotonic()
+        response = await self.session.post(self.url, data=data, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return self._store(response.json(), requested_at)
+
+    def invalidate(self, token=None):
+        # Todo corre en el hilo del bucle de eventos: no hace falta lock
+        if token is None or token == self._token:
+            self._token = None
+            self._expires_at = 0.0
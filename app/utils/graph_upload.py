@@ -0,0 +1,239 @@
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+
+from app.config.config import UPLOAD_CONFIG
+from app.utils.graph_client import RETRY_STATUS
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Graph exige que los fragmentos sean múltiplos de 320 KiB
+CHUNK_ALIGNMENT = 320 * 1024
+
+# ------------------ Progreso de subidas ------------------ #
+# Cada subida guarda su estado en un archivo JSON de PROGRESS_DIR (compartido por los workers): la consulta
+# de GET /subidas/<id> puede llegar a un worker distinto del que está subiendo el archivo.
+# upload_id -> estado de las subidas de este proceso (los campos se van actualizando y se escribe el estado completo)
+_progress = OrderedDict()
+_progress_lock = threading.Lock()
+_PROGRESS_MAX = 1000  # subidas recordadas en memoria como máximo (las más antiguas se descartan)
+
+
+def _ruta_progreso(upload_id):
+    # El upload_id lo elige el cliente: el nombre del archivo es su hash (nada de "../")
+    return os.path.join(UPLOAD_CONFIG["PROGRESS_DIR"], hashlib.sha256(upload_id.encode()).hexdigest() + ".json")
+
+
+def _set_progress(upload_id, **campos):
+    if not upload_id:
+        return
+    with _progress_lock:
+        nueva = upload_id not in _progress
+        estado = _progress.pop(upload_id, {"upload_id": upload_id})
+        estado.update(campos, actualizado=time.time())
+        _progress[upload_id] = estado
+        while len(_progress) > _PROGRESS_MAX:
+            _progress.popitem(last=False)
+        estado = dict(estado)
+
+    ruta = _ruta_progreso(upload_id)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(UPLOAD_CONFIG["PROGRESS_DIR"], exist_ok=True)
+        with open(temporal, "w") as archivo:
+            json.dump(estado, archivo)
+        os.replace(temporal, ruta)  # quien consulta nunca lee un archivo a medias
+        if nueva:
+            _recortar_progreso()
+    except OSError as e:
+        logger.warning(f"[UPLOAD] Could not save the progress of upload {upload_id}: {e}")
+
+
+def _recortar_progreso():
+    """
+    Borra el progreso de las subidas sin cambios desde hace más de PROGRESS_TTL segundos.
+    """
+    limite = time.time() - UPLOAD_CONFIG["PROGRESS_TTL"]
+    for entrada in os.scandir(UPLOAD_CONFIG["PROGRESS_DIR"]):
+        with contextlib.suppress(FileNotFoundError):  # otro worker puede haberlo borrado ya
+            if entrada.stat().st_mtime < limite:
+                os.remove(entrada.path)
+
+
+def obtener_progreso(upload_id):
+    """
+    Devuelve el estado de una subida (bytes subidos, tamaño total y estado) o None.
+    Lo lee del archivo compartido: la subida puede estar en cualquier worker.
+    """
+    try:
+        with open(_ruta_progreso(upload_id)) as archivo:
+            return json.load(archivo)
+    except FileNotFoundError:
+        return None
+
+
+# ------------------ Utilidades ------------------ #
+def as_stream(contenido):
+    """
+    Devuelve el contenido como objeto file-like con seek() (bytes -> BytesIO).
+    """
+    if isinstance(contenido, (bytes, bytearray, memoryview)):
+        return io.BytesIO(contenido)
+    return contenido
+
+
+def stream_size(stream):
+    """
+    Tamaño en bytes de un objeto file-like con seek(), sin leerlo.
+    """
+    actual = stream.tell()
+    size = stream.seek(0, io.SEEK_END)
+    stream.seek(actual)
+    return size
+
+
+def _next_offset(payload):
+    """
+    Primer byte pendiente según nextExpectedRanges (p. ej. ["26214400-"]).
+    """
+    rangos = payload.get("nextExpectedRanges") or []
+    if not rangos:
+        return None
+    return int(rangos[0].split("-")[0])
+
+
+# ------------------ Subida por fragmentos ------------------ #
+class ChunkedUpload:
+    """
+    Sube un archivo a SharePoint mediante una upload session de Microsoft Graph.
+    - Envía el archivo en fragmentos de `chunk_size` bytes.
+    - Si un fragmento falla (red, 429, 5xx), consulta a Graph qué rango espera
+      y continúa desde ahí, sin volver a enviar lo ya confirmado.
+    - Publica el progreso bajo `upload_id` (ver obtener_progreso).
+    """
+
+    def __init__(self, client, create_path, stream, size, chunk_size, max_retries=5,
+                 conflict_behavior="replace", upload_id=None):
+        self.client = client
+        self.create_path = create_path  # ruta .../createUploadSession
+        self.stream = stream
+        self.size = size
+        # Redondear al múltiplo de 320 KiB (mínimo uno)
+        self.chunk_size = max(CHUNK_ALIGNMENT, chunk_size - chunk_size % CHUNK_ALIGNMENT)
+        self.max_retries = max_retries
+        self.conflict_behavior = conflict_behavior
+        self.upload_id = upload_id
+        self.upload_url = None
+        self.offset = 0  # primer byte que Graph aún no ha confirmado
+
+    def _create_session(self):
+        body = {"item": {"@microsoft.graph.conflictBehavior": self.conflict_behavior}}
+        # Reenviarla es seguro: una sesión de subida repetida no crea nada y caduca sola
+        response = self.client.request("POST", self.create_path, json=body, idempotent=True)
+        response.raise_for_status()
+        self.upload_url = response.json()["uploadUrl"]
+
+    def _query_offset(self):
+        """
+        Pregunta a Graph cuál es el siguiente rango que espera (reanudación).
+        """
+        response = self.client.request("GET", self.upload_url, authenticate=False)
+        if response.status_code == 404:
+            raise Exception("La sesión de subida de SharePoint ha caducado.")
+        response.raise_for_status()
+        offset = _next_offset(response.json())
+        return self.offset if offset is None else offset
+
+    def _read_chunk(self):
+        """
+        Lee el fragmento que empieza en self.offset y devuelve (bytes, cabeceras del PUT).
+        """
+        end = min(self.offset + self.chunk_size, self.size) - 1
+        self.stream.seek(self.offset)
+        chunk = self.stream.read(end - self.offset + 1)
+        headers = {
+            "Content-Length": str(len(chunk)),
+            "Content-Range": f"bytes {self.offset}-{end}/{self.size}",
+        }
+        return chunk, headers
+
+    def _put_chunk(self):
+        chunk, headers = self._read_chunk()
+        # Sin reintentos del cliente: si falla, se reanuda desde el rango que confirme Graph
+        return self.client.request("PUT", self.upload_url, headers=headers, data=chunk,
+                                   retry=False, authenticate=False)
+
+    def _chunk_result(self, response):
+        """
+        Interpreta la respuesta a un fragmento (None si falló la red):
+        - "completado": era el último y Graph devuelve el driveItem.
+        - "aceptado": se avanza al siguiente rango que espera Graph.
+        - "reintentar": red, 429, 5xx o 416 (se reanuda desde el rango que confirme Graph).
+        Cualquier otra respuesta lanza excepción.
+        """
+        if response is None:
+            return "reintentar"
+        if response.status_code in (200, 201):
+            _set_progress(self.upload_id, estado="completado", subido=self.size)
+            return "completado"
+        if response.status_code == 202:
+            siguiente = _next_offset(response.json())
+            self.offset = siguiente if siguiente is not None else self.offset + self.chunk_size
+            _set_progress(self.upload_id, subido=self.offset)
+            return "aceptado"
+        if response.status_code not in RETRY_STATUS + (416,):
+            response.raise_for_status()
+            raise Exception(f"Respuesta inesperada de SharePoint: {response.status_code}")
+        return "reintentar"
+
+    def cancel(self):
+        """
+        Cancela la sesión de subida en Graph (libera los fragmentos ya subidos).
+        """
+        if self.upload_url:
+            try:
+                self.client.request("DELETE", self.upload_url, authenticate=False, retry=False)
+            except requests.RequestException:
+                pass
+
+    def run(self):
+        """
+        Ejecuta la subida completa y devuelve el JSON del driveItem creado.
+        """
+        _set_progress(self.upload_id, estado="subiendo", subido=0, total=self.size)
+        fallos = 0
+
+        try:
+            self._create_session()
+            while True:
+                response = None
+                try:
+                    response = self._put_chunk()
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    logger.warning(f"[GRAPH] Chunk at byte {self.offset} failed: {e}")
+
+                resultado = self._chunk_result(response)
+                if resultado == "completado":
+                    return response.json()
+                if resultado == "aceptado":
+                    fallos = 0
+                    continue
+
+                fallos += 1
+                if fallos > self.max_retries:
+                    raise Exception(f"La subida falló {fallos} veces seguidas en el byte {self.offset}.")
+                time.sleep(self.client._retry_delay(fallos - 1, response))
+                self.offset = self._query_offset()
+                _set_progress(self.upload_id, subido=self.offset, reintentos=fallos)
+
+        except Exception as e:
+            _set_progress(self.upload_id, estado="error", error=str(e))
+            self.cancel()
+            raise
\ No newline at end of file
@@ -0,0 +1,380 @@
+import atexit
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+from app.config.config import METRICS_CONFIG
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Métricas de la aplicación:
+# - Desglose de cada petición por dependencia (espera por el pool, SQL, token, Graph) en la cabecera Server-Timing.
+# - Histogramas por ruta y por dependencia, contadores de respuestas de Graph y de tokens renovados
+#   y el estado de los pools, en formato de texto de Prometheus (GET /metrics).
+# Cada worker es un proceso con sus propias métricas: las vuelca en METRICS_CONFIG["DIR"] y /metrics
+# suma las de todos (de los workers ya terminados se conservan los contadores, no los gauges).
+
+ENABLED = METRICS_CONFIG["ENABLED"]
+BUCKETS = tuple(sorted(float(b) for b in METRICS_CONFIG["BUCKETS"]))
+
+# Dependencias que se miden en cada petición (nombres de la cabecera Server-Timing)
+DB_POOL = "db_pool"          # espera por una conexión del pool
+DB = "db"                    # ejecución de consultas
+TOKEN = "token"              # obtener el access token de Graph (renovarlo si hace falta)
+GRAPH = "graph"              # llamadas HTTP a Graph
+GRAPH_RETRY = "graph_retry"  # esperas entre reintentos de Graph (429/5xx, Retry-After)
+
+# nombre -> (tipo, descripción)
+METRICAS = {
+    "autodoc_http_request_duration_seconds": ("histogram", "HTTP request duration by route."),
+    "autodoc_dependency_duration_seconds": ("histogram", "Time spent per call on each dependency (db_pool, db, token, graph, graph_retry)."),
+    "autodoc_graph_responses_total": ("counter", "Microsoft Graph responses by method and status code (status=error: network error)."),
+    "autodoc_graph_token_refreshes_total": ("counter", "Access tokens requested from Azure AD."),
+    "autodoc_db_pool_connections": ("gauge", "Database pool connections by state."),
+    "autodoc_db_pool_waiters": ("gauge", "Requests waiting for a free database connection."),
+    "autodoc_db_pool_max_connections": ("gauge", "Maximum connections of the database pool."),
+    "autodoc_db_query_calls_total": ("counter", "Executions by query (queries.py constant or normalized SQL)."),
+    "autodoc_db_query_seconds_total": ("counter", "Execution time by query."),
+    "autodoc_db_query_rows_total": ("counter", "Rows returned or affected by query."),
+    "autodoc_db_slow_queries_total": ("counter", "Executions over SLOW_QUERY_THRESHOLD_MS by query."),
+    "autodoc_content_requests_total": ("counter", "Document content downloads by result (hit, miss, bypass, not_modified)."),
+}
+
+
+class Registro:
+    """
+    Contadores e histogramas de este proceso (thread-safe).
+    Las etiquetas son tuplas de pares (nombre, valor), en el orden en que se quieren mostrar.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._contadores = {}   # (métrica, etiquetas) -> valor
+        self._histogramas = {}  # (métrica, etiquetas) -> [observaciones por bucket..., +Inf, suma]
+
+    def contar(self, metrica, etiquetas=(), valor=1):
+        clave = (metrica, etiquetas)
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, metrica, segundos, etiquetas=()):
+        clave = (metrica, etiquetas)
+        indice = bisect.bisect_left(self.buckets, segundos)
+        with self._lock:
+            valores = self._histogramas.get(clave)
+            if valores is None:
+                valores = self._histogramas[clave] = [0] * (len(self.buckets) + 1) + [0.0]
+            valores[indice] += 1
+            valores[-1] += segundos
+
+    def instantanea(self):
+        """
+        Copia serializable en JSON de los contadores e histogramas.
+        """
+        with self._lock:
+            return {
+                "contadores": [[m, list(e), v] for (m, e), v in self._contadores.items()],
+                "histogramas": [[m, list(e), list(v)] for (m, e), v in self._histogramas.items()],
+            }
+
+
+_registro = Registro()
+_medidores = []  # funciones que devuelven los gauges del proceso: [(métrica, etiquetas, valor)]
+
+
+def registrar_medidor(funcion):
+    """
+    Añade una función que devuelve gauges [(métrica, etiquetas, valor)] (p. ej. el estado de un pool).
+    Se llama al volcar las métricas, así no cuesta nada mientras se atienden peticiones.
+    """
+    _medidores.append(funcion)
+    return funcion
+
+
+def contar(metrica, etiquetas=(), valor=1):
+    if ENABLED:
+        _registro.contar(metrica, etiquetas, valor)
+        _asegurar_volcado()
+
+
+def observar(metrica, segundos, etiquetas=()):
+    if ENABLED:
+        _registro.observar(metrica, segundos, etiquetas)
+        _asegurar_volcado()
+
+
+# ------------------ Tiempos de la petición en curso ------------------ #
+_peticion = contextvars.ContextVar("metricas_peticion", default=None)
+
+
+class TiemposPeticion:
+    """
+    Tiempo acumulado por dependencia durante una petición (también desde los hilos o corrutinas que lance).
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.fases = {}  # dependencia -> [segundos, llamadas]
+        self._lock = threading.Lock()
+
+    def anotar(self, dependencia, segundos):
+        with self._lock:
+            fase = self.fases.get(dependencia)
+            if fase is None:
+                self.fases[dependencia] = [segundos, 1]
+            else:
+                fase[0] += segundos
+                fase[1] += 1
+
+    def duracion(self):
+        return time.perf_counter() - self.inicio
+
+    def server_timing(self):
+        """
+        Valor de la cabecera Server-Timing: milisegundos y llamadas por dependencia, y el total de la petición.
+        Las llamadas en paralelo (p. ej. subidas por lotes) suman su tiempo aunque se solapen.
+        """
+        with self._lock:
+            fases = [f'{nombre};dur={segundos * 1000:.1f};desc="{llamadas}"'
+                     for nombre, (segundos, llamadas) in self.fases.items()]
+        fases.append(f"total;dur={self.duracion() * 1000:.1f}")
+        return ", ".join(fases)
+
+
+def iniciar_peticion():
+    """
+    Empieza a medir la petición actual. Devuelve sus TiemposPeticion (None si las métricas están desactivadas).
+    """
+    if not ENABLED:
+        return None
+    tiempos = TiemposPeticion()
+    _peticion.set(tiempos)
+    return tiempos
+
+
+def finalizar_peticion(tiempos, metodo, ruta, status):
+    """
+    Registra la duración de la petición en el histograma de su ruta (la plantilla, p. ej. /proyectos/<int:id>).
+    """
+    if tiempos is not None:
+        observar("autodoc_http_request_duration_seconds", tiempos.duracion(),
+                 (("method", metodo), ("route", ruta), ("status", str(status))))
+
+
+def anotar(dependencia, segundos):
+    """
+    Registra `segundos` en una dependencia: en su histograma y en la petición en curso (si la hay).
+    """
+    if not ENABLED:
+        return
+    observar("autodoc_dependency_duration_seconds", segundos, (("dependency", dependencia),))
+    tiempos = _peticion.get()
+    if tiempos is not None:
+        tiempos.anotar(dependencia, segundos)
+
+
+@contextlib.contextmanager
+def medir(dependencia):
+    """
+    Mide el bloque como una llamada a `dependencia` (también con await dentro del bloque).
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        anotar(dependencia, time.perf_counter() - inicio)
+
+
+# ------------------ Volcado y exposición (varios procesos) ------------------ #
+_volcado_lock = threading.Lock()
+_volcador = None  # hilo que vuelca las métricas del proceso cada FLUSH_INTERVAL segundos
+
+
+def _ruta_proceso():
+    return os.path.join(METRICS_CONFIG["DIR"], f"{os.getpid()}.json")
+
+
+def _instantanea_proceso():
+    datos = _registro.instantanea()
+    gauges = []
+    for medidor in _medidores:
+        try:
+            gauges.extend([m, list(e), v] for m, e, v in medidor())
+        except Exception as e:
+            logger.warning(f"[METRICS] Gauge {medidor.__name__} failed: {e}")
+    datos["gauges"] = gauges
+    return datos
+
+
+def volcar():
+    """
+    Escribe las métricas del proceso en DIR/<pid>.json (de forma atómica: los demás procesos nunca leen uno a medias).
+    """
+    ruta = _ruta_proceso()
+    temporal = f"{ruta}.tmp"
+    try:
+        os.makedirs(METRICS_CONFIG["DIR"], exist_ok=True)
+        with open(temporal, "w") as f:
+            json.dump(_instantanea_proceso(), f)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        logger.warning(f"[METRICS] Could not write {ruta}: {e}")
+
+
+def _bucle_volcado(parar):
+    while not parar.wait(METRICS_CONFIG["FLUSH_INTERVAL"]):
+        volcar()
+
+
+def _asegurar_volcado():
+    global _volcador
+    if _volcador is not None:
+        return
+    with _volcado_lock:
+        if _volcador is None:
+            hilo = threading.Thread(target=_bucle_volcado, args=(threading.Event(),),
+                                    name="metricas-volcado", daemon=True)
+            hilo.start()
+            _volcador = hilo
+
+
+def limpiar():
+    """
+    Borra las métricas volcadas por procesos anteriores. Se llama al arrancar el servidor
+    (antes de crear los workers), así los contadores empiezan de cero en cada despliegue.
+    """
+    directorio = METRICS_CONFIG["DIR"]
+    if not os.path.isdir(directorio):
+        return
+    for nombre in os.listdir(directorio):
+        if nombre.endswith(".json") or nombre.endswith(".json.tmp"):
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(directorio, nombre))
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _instantaneas():
+    """
+    Métricas de todos los procesos: las de este (al momento) y las volcadas por los demás.
+    Los gauges de procesos que ya no existen se descartan.
+    """
+    propio = os.getpid()
+    instantaneas = [_instantanea_proceso()]
+    directorio = METRICS_CONFIG["DIR"]
+    nombres = os.listdir(directorio) if os.path.isdir(directorio) else []
+    for nombre in nombres:
+        pid = nombre[:-len(".json")]
+        if not nombre.endswith(".json") or not pid.isdigit() or int(pid) == propio:
+            continue
+        try:
+            with open(os.path.join(directorio, nombre)) as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _vivo(int(pid)):
+            datos["gauges"] = []
+        instantaneas.append(datos)
+    return instantaneas
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(etiquetas, extra=()):
+    pares = [*etiquetas, *extra]
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + "}"
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def agregados():
+    """
+    Métricas sumadas de todos los workers: (contadores, histogramas, gauges),
+    cada uno {(métrica, etiquetas): valor}.
+    """
+    contadores, histogramas, gauges = {}, {}, {}
+    for datos in _instantaneas():
+        for metrica, etiquetas, valor in datos["contadores"]:
+            clave = (metrica, tuple(map(tuple, etiquetas)))
+            contadores[clave] = contadores.get(clave, 0) + valor
+        for metrica, etiquetas, valores in datos["histogramas"]:
+            clave = (metrica, tuple(map(tuple, etiquetas)))
+            acumulado = histogramas.get(clave)
+            if acumulado is None or len(acumulado) != len(valores):
+                histogramas[clave] = list(valores)  # (otro proceso con otros BUCKETS: el último manda)
+            else:
+                histogramas[clave] = [a + v for a, v in zip(acumulado, valores)]
+        for metrica, etiquetas, valor in datos["gauges"]:
+            clave = (metrica, tuple(map(tuple, etiquetas)))
+            gauges[clave] = gauges.get(clave, 0) + valor
+    return contadores, histogramas, gauges
+
+
+def exponer():
+    """
+    Texto de GET /metrics (formato de exposición de Prometheus 0.0.4) con las métricas de todos los workers.
+    """
+    contadores, histogramas, gauges = agregados()
+    series = {}  # métrica -> líneas
+    for (metrica, etiquetas), valor in sorted(contadores.items()):
+        series.setdefault(metrica, []).append(f"{metrica}{_etiquetas(etiquetas)} {_numero(valor)}")
+    for (metrica, etiquetas), valor in sorted(gauges.items()):
+        series.setdefault(metrica, []).append(f"{metrica}{_etiquetas(etiquetas)} {_numero(valor)}")
+    for (metrica, etiquetas), valores in sorted(histogramas.items()):
+        lineas = series.setdefault(metrica, [])
+        limites = [_numero(float(b)) for b in BUCKETS[:len(valores) - 2]] + ["+Inf"]
+        acumulado = 0
+        for limite, n in zip(limites, valores[:-1]):
+            acumulado += n
+            lineas.append(f"{metrica}_bucket{_etiquetas(etiquetas, [('le', limite)])} {acumulado}")
+        lineas.append(f"{metrica}_sum{_etiquetas(etiquetas)} {_numero(float(valores[-1]))}")
+        lineas.append(f"{metrica}_count{_etiquetas(etiquetas)} {acumulado}")
+
+    salida = []
+    for metrica, (tipo, descripcion) in METRICAS.items():
+        if metrica in series:
+            salida += [f"# HELP {metrica} {descripcion}", f"# TYPE {metrica} {tipo}", *series.pop(metrica)]
+    for metrica, lineas in series.items():  # métricas sin descripción en METRICAS
+        salida += [f"# TYPE {metrica} untyped", *lineas]
+    return "\n".join(salida) + "\n"
+
+
+def _al_salir():
+    # Último volcado del proceso (p. ej. al parar un worker): sus contadores siguen sumando en /metrics
+    if _volcador is not None:
+        volcar()
+
+
+def _reiniciar_tras_fork():
+    """
+    En el proceso hijo de un fork: métricas propias (empiezan de cero) y sin el hilo de volcado del padre.
+    """
+    global _registro, _volcador, _volcado_lock
+    _registro = Registro()
+    _volcador = None
+    _volcado_lock = threading.Lock()
+
+
+if ENABLED:
+    atexit.register(_al_salir)
+os.register_at_fork(after_in_child=_reiniciar_tras_fork)
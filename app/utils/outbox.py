@@ -0,0 +1,153 @@
+import json
+import logging
+import threading
+
+from app.db.psql_connection_pool import db_cursor
+from app.db import queries as db # Consultas a la BBDD
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+
+def encolar(cursor, tipo, payload):
+    """
+    Registra un job en autodoc.outbox usando el cursor (y la transacción) de quien llama,
+    para que el job exista si y solo si el cambio en la BBDD se confirma.
+    Devuelve el job_id.
+    """
+    cursor.execute(db.ENQUEUE_OUTBOX_JOB, (tipo, json.dumps(payload)))
+    return cursor.fetchone()["job_id"]
+
+
+class OutboxWorker:
+    """
+    Pool de hilos que consume la tabla autodoc.outbox.
+    - Cada hilo reserva un job (FOR UPDATE SKIP LOCKED), lo ejecuta sin tener
+      conexión a la BBDD abierta y guarda el resultado.
+    - Si el handler falla, el job se reprograma con backoff exponencial hasta
+      MAX_ATTEMPTS; después queda en estado "error".
+    - Mientras el handler se ejecuta, la reserva (LEASE_SECONDS) se renueva cada tercio de
+      su duración: un job largo (p. ej. una subida por fragmentos) no lo vuelve a reservar otro worker.
+    - El resultado solo se guarda si el job sigue reservado por este intento (ver RENEW_OUTBOX_LEASE).
+    """
+
+    def __init__(self, pool, handlers, config):
+        self.pool = pool
+        self.handlers = handlers  # tipo -> función(payload, intentos) -> resultado (dict)
+        self.workers = config.get("WORKERS", 4)
+        self.poll_interval = config.get("POLL_INTERVAL", 1.0)
+        self.max_attempts = config.get("MAX_ATTEMPTS", 8)
+        self.retry_base = config.get("RETRY_BASE", 2)
+        self.retry_max = config.get("RETRY_MAX", 300)
+        self.lease = config.get("LEASE_SECONDS", 600)
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Arranca los hilos (una sola vez).
+        """
+        if self._threads:
+            return
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"outbox-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"[OUTBOX] {self.workers} workers started.")
+
+    def notify(self):
+        """
+        Despierta a los workers (se acaba de encolar un job en este proceso).
+        """
+        self._wakeup.set()
+
+    def stop(self, timeout=10):
+        """
+        Detiene los workers esperando a que terminen el job en curso.
+        """
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wait(self):
+        """
+        Bloquea hasta que se llame a stop() (proceso dedicado a la outbox).
+        """
+        while not self._stop.wait(1):
+            pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                procesado = self.run_once()
+            except Exception as e:
+                logger.error(f"[OUTBOX] Worker error: {e}")
+                procesado = False
+            if not procesado:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self):
+        """
+        Reserva y ejecuta un job. Devuelve False si la cola estaba vacía.
+        """
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(db.CLAIM_OUTBOX_JOB, (self.lease,))
+            job = cursor.fetchone()
+        if not job:
+            return False
+
+        handler = self.handlers.get(job["tipo"])
+        terminado = threading.Event()
+        latido = threading.Thread(target=self._renovar, args=(job, terminado), name=f"outbox-lease-{job['job_id']}", daemon=True)
+        latido.start()
+        try:
+            if handler is None:
+                raise Exception(f"Tipo de job desconocido: {job['tipo']}")
+            resultado = handler(job["payload"], job["intentos"])
+        except Exception as e:
+            espera = min(self.retry_base * (2 ** (job["intentos"] - 1)), self.retry_max)
+            logger.warning(f"[OUTBOX] Job {job['job_id']} ({job['tipo']}) failed "
+                           f"(attempt {job['intentos']}): {e}")
+            self._guardar(job, db.FAIL_OUTBOX_JOB, (self.max_attempts, espera, str(e), job["job_id"], job["intentos"]))
+            return True
+        finally:
+            terminado.set()
+            latido.join()
+
+        if self._guardar(job, db.COMPLETE_OUTBOX_JOB, (json.dumps(resultado or {}), job["job_id"], job["intentos"])):
+            logger.debug(f"[OUTBOX] Job {job['job_id']} ({job['tipo']}) completed.")
+        return True
+
+    def _renovar(self, job, terminado):
+        """
+        Renueva la reserva del job cada tercio de LEASE_SECONDS hasta que el handler termine.
+        """
+        while not terminado.wait(self.lease / 3):
+            try:
+                with db_cursor(self.pool) as cursor:
+                    cursor.execute(db.RENEW_OUTBOX_LEASE, (self.lease, job["job_id"], job["intentos"]))
+                    renovado = cursor.rowcount > 0
+            except Exception as e:
+                logger.error(f"[OUTBOX] Could not renew the lease of job {job['job_id']}: {e}")
+                continue  # se vuelve a intentar en el siguiente latido, antes de que caduque
+            if not renovado:
+                logger.warning(f"[OUTBOX] Job {job['job_id']} ({job['tipo']}) lease lost (attempt {job['intentos']}), "
+                               f"another worker may be running it.")
+                return
+
+    def _guardar(self, job, consulta, parametros):
+        """
+        Guarda el resultado del intento. False si el job ya no estaba reservado por este intento
+        (la reserva caducó y otro worker lo volvió a reservar): no se pisa su estado.
+        """
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(consulta, parametros)
+            guardado = cursor.rowcount > 0
+        if not guardado:
+            logger.warning(f"[OUTBOX] Job {job['job_id']} ({job['tipo']}) attempt {job['intentos']} finished "
+                           f"after losing its lease, result discarded.")
+        return guardado
\ No newline at end of file
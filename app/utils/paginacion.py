@@ -0,0 +1,59 @@
+import base64
+import json
+from app.config.config import PAGINATION_CONFIG
+
+
+class CursorInvalido(ValueError):
+    """
+    Se lanza cuando el cursor ("after") o el "limit" recibidos no son válidos.
+    """
+
+
+def codificar_cursor(**clave):
+    """
+    Convierte la clave del último elemento de la página en un cursor opaco (base64 URL-safe).
+    """
+    raw = json.dumps(clave, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    """
+    Devuelve la clave codificada en el cursor, o None si no se indica cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        clave = json.loads(raw)
+    except ValueError:
+        raise CursorInvalido("El cursor de paginación no es válido")
+    if not isinstance(clave, dict):
+        raise CursorInvalido("El cursor de paginación no es válido")
+    return clave
+
+
+def parse_limit(valor):
+    """
+    Valida el parámetro "limit" (entero entre 1 y MAX_LIMIT, DEFAULT_LIMIT si no viene).
+    """
+    if valor in (None, ""):
+        return PAGINATION_CONFIG["DEFAULT_LIMIT"]
+    try:
+        limit = int(valor)
+    except ValueError:
+        raise CursorInvalido("El parámetro limit debe ser un número entero")
+    if limit < 1:
+        raise CursorInvalido("El parámetro limit debe ser mayor que 0")
+    return min(limit, PAGINATION_CONFIG["MAX_LIMIT"])
+
+
+def cortar_pagina(filas, limit, clave):
+    """
+    Recibe hasta limit + 1 filas y devuelve (página, cursor siguiente o None).
+    `clave` extrae de una fila el diccionario que identifica su posición.
+    """
+    if len(filas) <= limit:
+        return filas, None
+    pagina = filas[:limit]
+    return pagina, codificar_cursor(**clave(pagina[-1]))
\ No newline at end of file
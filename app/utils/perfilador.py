@@ -0,0 +1,181 @@
+import contextlib
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from app.config.config import PROFILER_CONFIG
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Perfilador bajo demanda para depurar peticiones lentas en producción (ver los hooks en routes/services.py):
+# - Se perfila la petición que lleve la cabecera HEADER con uno de los SECRETS, o una fracción SAMPLE de todas.
+# - cProfile recoge la pila de llamadas del hilo de la petición: la ruta de Flask, funciones.py, el pool,
+#   el repositorio y requests (las subidas en paralelo de los lotes van en otros hilos y no aparecen).
+# - Cada perfil se guarda en DIR en formato pstats (snakeviz, `python -m pstats`); se conservan los
+#   MAX_FILES más recientes de todos los workers.
+# - Como mucho una petición perfilada a la vez por proceso: cProfile ralentiza la petición y en
+#   Python 3.12+ no admite dos perfiles activos. Sin secretos ni muestreo no se hace nada por petición.
+
+SECRETOS = [s.encode() for s in PROFILER_CONFIG["SECRETS"]]
+CABECERA = PROFILER_CONFIG["HEADER"]
+MUESTREO = PROFILER_CONFIG["SAMPLE"]
+ACTIVO = bool(SECRETOS) or MUESTREO > 0
+
+ORDENES = ("cumulative", "tottime", "calls")  # orden del resumen en texto (ver texto())
+
+# <fecha>_<pid>_<método>_<status>_<ms>ms_<ruta>.prof
+# (en la ruta "/" se guarda como "~" y el resto de caracteres que no valen en un nombre de archivo como "-")
+_NOMBRE = re.compile(r"^(\d{8}T\d{6}\.\d{3})_(\d+)_([A-Z]+)_(\d{3})_(\d+)ms_([\w\-~]*)\.prof$")
+_NO_VALIDO = re.compile(r"[^\w\-]+")
+
+_lock = threading.Lock()  # una petición perfilada a la vez por proceso
+
+
+class Perfil:
+    """
+    Perfil de una petición en curso (lo devuelve iniciar()).
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.inicio = time.perf_counter()
+        self.activo = True
+
+
+def autorizado(secreto):
+    """
+    True si `secreto` (valor de la cabecera) es uno de los PROFILER_SECRETS.
+    """
+    if not secreto or not SECRETOS:
+        return False
+    secreto = secreto.encode()
+    # compare_digest con cada secreto (sin cortar en el primero) para no revelar cuál coincide por el tiempo
+    return sum(hmac.compare_digest(secreto, s) for s in SECRETOS) > 0
+
+
+def solicitado(secreto):
+    """
+    True si hay que perfilar la petición: cabecera con un secreto válido o elegida por el muestreo.
+    """
+    return autorizado(secreto) or (MUESTREO > 0 and random.random() < MUESTREO)
+
+
+def iniciar():
+    """
+    Empieza a perfilar el hilo actual. None si ya hay otra petición perfilándose en este proceso.
+    """
+    if not _lock.acquire(blocking=False):
+        logger.debug("[PROFILER] Another request is being profiled in this process, skipping.")
+        return None
+    try:
+        perfil = Perfil()
+        perfil.profile.enable()
+    except Exception:
+        _lock.release()
+        logger.exception("[PROFILER] Could not start the profiler.")
+        return None
+    return perfil
+
+
+def descartar(perfil):
+    """
+    Detiene el perfil sin guardarlo (p. ej. si la petición terminó sin pasar por finalizar()).
+    """
+    if perfil is None or not perfil.activo:
+        return
+    perfil.activo = False
+    try:
+        perfil.profile.disable()
+    finally:
+        _lock.release()
+
+
+def finalizar(perfil, metodo, ruta, status):
+    """
+    Detiene el perfil y lo guarda en DIR. Devuelve el nombre del archivo (None si no se pudo guardar).
+    """
+    if perfil is None or not perfil.activo:
+        return None
+    duracion = time.perf_counter() - perfil.inicio
+    descartar(perfil)
+
+    ruta = "~".join(_NO_VALIDO.sub("-", parte) for parte in ruta.strip("/").split("/"))[:100]
+    fecha = datetime.now().strftime("%Y%m%dT%H%M%S.%f")[:-3]
+    nombre = f"{fecha}_{os.getpid()}_{metodo}_{status}_{round(duracion * 1000)}ms_{ruta}.prof"
+    directorio = PROFILER_CONFIG["DIR"]
+    try:
+        os.makedirs(directorio, exist_ok=True)
+        temporal = os.path.join(directorio, f".{nombre}.tmp")
+        perfil.profile.dump_stats(temporal)
+        os.replace(temporal, os.path.join(directorio, nombre))  # /perfiles nunca ve un archivo a medias
+        _recortar(directorio)
+    except OSError:
+        logger.exception(f"[PROFILER] Could not write profile {nombre}.")
+        return None
+    logger.info(f"[PROFILER] {metodo} /{ruta.replace('~', '/')} profiled ({duracion * 1000:.0f}ms): {nombre}")
+    return nombre
+
+
+def _recortar(directorio):
+    """
+    Borra los perfiles más antiguos hasta dejar MAX_FILES (el nombre empieza por la fecha).
+    """
+    perfiles = sorted(n for n in os.listdir(directorio) if _NOMBRE.match(n))
+    for nombre in perfiles[:max(0, len(perfiles) - PROFILER_CONFIG["MAX_FILES"])]:
+        with contextlib.suppress(FileNotFoundError):  # otro worker puede haberlo borrado ya
+            os.remove(os.path.join(directorio, nombre))
+
+
+def listar():
+    """
+    Perfiles guardados (de todos los workers), del más reciente al más antiguo.
+    """
+    directorio = PROFILER_CONFIG["DIR"]
+    if not os.path.isdir(directorio):
+        return []
+    perfiles = []
+    for nombre in sorted(os.listdir(directorio), reverse=True):
+        coincidencia = _NOMBRE.match(nombre)
+        if not coincidencia:
+            continue
+        fecha, pid, metodo, status, ms, ruta = coincidencia.groups()
+        with contextlib.suppress(FileNotFoundError):
+            perfiles.append({
+                "nombre": nombre,
+                "fecha": datetime.strptime(fecha, "%Y%m%dT%H%M%S.%f").isoformat(timespec="milliseconds"),
+                "pid": int(pid),
+                "metodo": metodo,
+                "ruta": "/" + ruta.replace("~", "/"),
+                "status": int(status),
+                "duracion_ms": int(ms),
+                "bytes": os.path.getsize(os.path.join(directorio, nombre)),
+            })
+    return perfiles
+
+
+def ruta_perfil(nombre):
+    """
+    Ruta del archivo del perfil `nombre`, o None si no es un nombre de perfil o ya no existe.
+    """
+    if not _NOMBRE.match(nombre):  # solo nombres generados por finalizar(): nada de "../"
+        return None
+    ruta = os.path.join(PROFILER_CONFIG["DIR"], nombre)
+    return ruta if os.path.isfile(ruta) else None
+
+
+def texto(ruta, orden="cumulative", limite=50):
+    """
+    Resumen en texto del perfil: las `limite` funciones con más tiempo según `orden` (ver ORDENES).
+    """
+    salida = io.StringIO()
+    estadisticas = pstats.Stats(ruta, stream=salida)
+    estadisticas.strip_dirs().sort_stats(orden).print_stats(limite)
+    return salida.getvalue()
@@ -0,0 +1,53 @@
+import logging
+import os
+
+from app.config.config import RECONCILE_CONFIG
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+_scheduler = None  # uno por proceso
+
+
+def iniciar_programador(app):
+    """
+    Programa la reconciliación periódica SharePoint -> BBDD con Flask-APScheduler.
+    Es opcional: si el paquete no está instalado o falta DRIVE_ID, no se programa nada.
+    Con varios procesos cada uno programa la tarea, pero solo una pasada se ejecuta a la vez
+    (se reserva en autodoc.sharepoint_delta).
+    """
+    global _scheduler
+    if _scheduler is not None:
+        return _scheduler
+    if not RECONCILE_CONFIG["ENABLED"] or not os.getenv("DRIVE_ID"):
+        return None
+    try:
+        from flask_apscheduler import APScheduler
+    except ImportError:
+        logger.warning("[DELTA] Flask-APScheduler is not installed, scheduled reconciliation disabled.")
+        return None
+
+    from app.utils import funciones as funcs
+
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+    scheduler.add_job(
+        id="reconciliar_sharepoint",
+        func=funcs.reconciliar_sharepoint,
+        trigger="interval",
+        seconds=RECONCILE_CONFIG["INTERVAL"],
+        max_instances=1,   # nunca dos pasadas a la vez en el mismo proceso
+        coalesce=True,     # si se retrasa, una sola pasada en lugar de varias seguidas
+    )
+    scheduler.start()
+    _scheduler = scheduler
+    return scheduler
+
+
+def detener_programador(wait=True):
+    """
+    Detiene el programador de este proceso (con wait, espera a que termine la pasada en curso).
+    """
+    global _scheduler
+    scheduler, _scheduler = _scheduler, None
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=wait)
@@ -0,0 +1,305 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from psycopg2.extras import Json, execute_values
+
+from app.db.psql_connection_pool import db_cursor
+from app.db import queries as db # Consultas a la BBDD
+from app.utils.graph_client import BATCH_MAX_REQUESTS
+
+logger = logging.getLogger("autodoc")  # Logger para mensajes de depuración
+
+# Campos del driveItem que usa la reconciliación (páginas de delta más pequeñas)
+DELTA_SELECT = "id,name,webUrl,parentReference,folder,file,deleted,root,createdDateTime"
+
+# Límites de las columnas de autodoc.proyectos / autodoc.documentos
+NOMBRE_MAX = 150
+URL_MAX = 250
+
+# Prefijo de las carpetas que crea el job "crear_carpeta" antes de darles el nombre del proyecto
+# (ver funciones._job_crear_carpeta): no son proyectos nuevos ni renombrados, el job los registra.
+CARPETA_PROVISIONAL = "autodoc-pendiente-"
+
+
+def _fecha(valor):
+    """
+    Convierte una fecha ISO de Graph ("2024-05-01T10:00:00Z") en datetime con zona horaria.
+    """
+    try:
+        return datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+class SharePointReconciler:
+    """
+    Sincroniza la BBDD con el contenido real del drive de SharePoint usando la consulta delta de Graph.
+    - Proyectos = carpetas en la raíz del drive; documentos = archivos dentro de esas carpetas.
+    - Guarda el deltaLink en autodoc.sharepoint_delta: la primera pasada recorre el drive completo
+      y las siguientes solo leen los cambios desde la anterior.
+    - Cada página se aplica en una transacción (inserciones/actualizaciones en bloque) junto con el
+      enlace para continuar, así una pasada interrumpida sigue donde se quedó.
+    - Los elementos creados hace menos de GRACE segundos se aplazan: AutoDoc puede estar
+      registrándolos en ese momento y se evitan filas duplicadas.
+    """
+
+    def __init__(self, pool, client, drive_id, config, on_change=None):
+        self.pool = pool
+        self.client = client  # GraphClient
+        self.drive_id = drive_id
+        self.page_size = config.get("PAGE_SIZE", 1000)
+        self.grace = timedelta(seconds=config.get("GRACE", 900))
+        self.lease = config.get("LEASE_SECONDS", 900)
+        self.prune = config.get("PRUNE_ON_RESYNC", True)
+        self.on_change = on_change  # recibe las etiquetas de caché afectadas
+        self.root_id = None
+
+    # ------------------ Estado (autodoc.sharepoint_delta) ------------------ #
+    def _reservar(self, completo):
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(db.INIT_DELTA_STATE, (self.drive_id,))
+            cursor.execute(db.CLAIM_DELTA_STATE, (self.lease, self.drive_id))
+            estado = cursor.fetchone()
+            if estado and completo:
+                cursor.execute(db.RESET_DELTA_STATE, (self.drive_id,))
+                estado["delta_link"] = estado["next_link"] = None
+        return estado
+
+    def _liberar(self):
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(db.RELEASE_DELTA_STATE, (self.drive_id,))
+
+    def _notificar(self, etiquetas):
+        if etiquetas and self.on_change:
+            self.on_change(etiquetas)
+
+    # ------------------ Pasada ------------------ #
+    def run(self, completo=False):
+        """
+        Ejecuta una pasada de reconciliación. `completo=True` descarta el deltaLink y recorre el drive entero.
+        Devuelve un resumen, o None si ya hay otra pasada en curso (en este u otro proceso).
+        """
+        estado = self._reservar(completo)
+        if estado is None:
+            logger.info("[DELTA] Another reconciliation is running, skipped.")
+            return None
+
+        resumen = {"paginas": 0, "cambios": 0, "eliminados": 0, "completo": False}
+        try:
+            self.root_id = self._get_root_id()
+            pendientes = dict(estado["pendientes"] or {})
+            self._revisar_pendientes(pendientes, resumen)
+
+            inicial = f"/drives/{self.drive_id}/root/delta?$select={DELTA_SELECT}&$top={self.page_size}"
+            url = estado["next_link"] or estado["delta_link"]
+            # Solo si el recorrido completo se hace entero en esta pasada se pueden detectar los borrados
+            vistos = set() if url is None else None
+            url = url or inicial
+            reiniciado = False
+
+            while True:
+                response = self.client.request("GET", url)
+                if response.status_code == 410 and not reiniciado:
+                    # El token delta ha caducado: Graph obliga a recorrer el drive de nuevo
+                    logger.warning("[DELTA] Delta token expired, starting a full resync.")
+                    url = response.headers.get("Location") or inicial
+                    vistos, reiniciado = set(), True
+                    continue
+                response.raise_for_status()
+                pagina = response.json()
+
+                siguiente = pagina.get("@odata.nextLink")
+                with db_cursor(self.pool) as cursor:
+                    etiquetas = self._aplicar(cursor, pagina.get("value", []), pendientes, vistos, resumen)
+                    if siguiente:
+                        cursor.execute(db.SAVE_DELTA_PROGRESS, (siguiente, Json(pendientes), self.lease, self.drive_id))
+                    else:
+                        cursor.execute(db.SAVE_DELTA_LINK, (pagina.get("@odata.deltaLink"), Json(pendientes), self.drive_id))
+                self._notificar(etiquetas)
+                resumen["paginas"] += 1
+                if not siguiente:
+                    break
+                url = siguiente
+
+            if vistos is not None:
+                resumen["completo"] = True
+                if self.prune and vistos:
+                    resumen["eliminados"] += self._podar(vistos, estado["inicio"])
+            resumen["pendientes"] = len(pendientes)
+        finally:
+            self._liberar()
+
+        logger.info(f"[DELTA] Reconciliation finished: {resumen}")
+        return resumen
+
+    def _get_root_id(self):
+        response = self.client.request("GET", f"/drives/{self.drive_id}/root?$select=id")
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _consultar(self, ids):
+        """
+        Consulta varios elementos con $batch. Devuelve {id: driveItem o None si ya no existe}.
+        """
+        elementos = {}
+        ids = list(ids)
+        for inicio in range(0, len(ids), BATCH_MAX_REQUESTS):
+            grupo = ids[inicio:inicio + BATCH_MAX_REQUESTS]
+            sub_requests = [
+                {"id": str(n), "method": "GET", "url": f"/drives/{self.drive_id}/items/{item_id}?$select={DELTA_SELECT}"}
+                for n, item_id in enumerate(grupo)
+            ]
+            resultados = self.client.batch(sub_requests)
+            for n, item_id in enumerate(grupo):
+                resultado = resultados.get(str(n), {})
+                if resultado.get("status") == 200:
+                    elementos[item_id] = resultado.get("body") or {"id": item_id}
+                elif resultado.get("status") == 404:
+                    elementos[item_id] = None
+                else:
+                    raise Exception(f"No se pudo consultar el elemento {item_id} en SharePoint: {resultado}")
+        return elementos
+
+    def _revisar_pendientes(self, pendientes, resumen):
+        """
+        Aplica los elementos aplazados que ya han superado el periodo de gracia.
+        """
+        ahora = datetime.now(timezone.utc)
+        vencidos = [i for i, creado in pendientes.items()
+                    if _fecha(creado) is None or _fecha(creado) + self.grace <= ahora]
+        if not vencidos:
+            return
+        elementos = self._consultar(vencidos)
+        for item_id in vencidos:
+            del pendientes[item_id]
+        with db_cursor(self.pool) as cursor:
+            etiquetas = self._aplicar(cursor, [e for e in elementos.values() if e], pendientes, None, resumen)
+        self._notificar(etiquetas)
+
+    def _podar(self, vistos, inicio):
+        """
+        Tras un recorrido completo, elimina las filas cuyo elemento ya no está en el drive.
+        Solo se consideran las filas anteriores a la pasada, y se confirma con Graph (404) antes de borrar.
+        """
+        with db_cursor(self.pool) as cursor:
+            cursor.execute(db.DELTA_LINKED_ITEMS, (inicio, inicio))
+            candidatos = {fila["id_sharepoint"] for fila in cursor.fetchall()} - vistos
+        if not candidatos:
+            return 0
+
+        desaparecidos = [i for i, item in self._consultar(candidatos).items() if item is None]
+        if not desaparecidos:
+            return 0
+        etiquetas = set()
+        with db_cursor(self.pool) as cursor:
+            eliminados = self._eliminar(cursor, desaparecidos, etiquetas)
+        self._notificar(etiquetas)
+        logger.info(f"[DELTA] {eliminados} rows removed (items no longer in SharePoint).")
+        return eliminados
+
+    # ------------------ Aplicar cambios ------------------ #
+    def _valido(self, item):
+        url = item.get("webUrl") or ""
+        if len(url) > URL_MAX:
+            logger.warning(f"[DELTA] Item {item['id']} skipped: webUrl longer than {URL_MAX} characters.")
+            return False
+        return True
+
+    def _eliminar(self, cursor, ids, etiquetas):
+        cursor.execute(db.DELTA_DELETE_PROJECTS, (ids,))
+        proyectos = cursor.fetchall()
+        for fila in proyectos:
+            etiquetas.update(["proyectos", ("proyecto", fila["proyecto_id"]), ("documentos", fila["proyecto_id"])])
+        cursor.execute(db.DELTA_DELETE_DOCUMENTS, (ids,))
+        documentos = cursor.fetchall()
+        for fila in documentos:
+            etiquetas.update([("documento", fila["documento_id"]), ("documentos", fila["proyecto_id"])])
+        return len(proyectos) + len(documentos)
+
+    def _aplicar(self, cursor, items, pendientes, vistos, resumen):
+        """
+        Aplica una página de cambios de delta. Devuelve las etiquetas de caché afectadas.
+        """
+        ahora = datetime.now(timezone.utc)
+        ultimos = {}
+        for item in items:
+            if "root" not in item:
+                ultimos[item["id"]] = item  # Un elemento puede repetirse: vale su última versión
+        etiquetas = set()
+
+        borrados = [i for i, item in ultimos.items() if "deleted" in item]
+        for item_id in borrados:
+            pendientes.pop(item_id, None)
+        if borrados:
+            resumen["cambios"] += self._eliminar(cursor, borrados, etiquetas)
+
+        vivos = [item for item in ultimos.values() if "deleted" not in item]
+        if vistos is not None:
+            vistos.update(item["id"] for item in vivos)
+        vivos = [item for item in vivos if self._valido(item)]
+
+        def padre(item):
+            return (item.get("parentReference") or {}).get("id")
+
+        def reciente(item):
+            creado = _fecha(item.get("createdDateTime"))
+            return creado is not None and creado + self.grace > ahora
+
+        # Proyectos: carpetas ya registradas (renombradas o movidas) y carpetas nuevas en la raíz
+        carpetas = [item for item in vivos if "folder" in item and not item["name"].startswith(CARPETA_PROVISIONAL)]
+        if carpetas:
+            cursor.execute(db.DELTA_GET_PROJECTS, ([c["id"] for c in carpetas],))
+            registradas = {fila["id_sharepoint"] for fila in cursor.fetchall()}
+
+            cambios = [(c["id"], c["name"][:NOMBRE_MAX], c.get("webUrl")) for c in carpetas if c["id"] in registradas]
+            nuevas = []
+            for carpeta in carpetas:
+                if carpeta["id"] in registradas or padre(carpeta) != self.root_id:
+                    continue
+                if reciente(carpeta):
+                    pendientes[carpeta["id"]] = carpeta["createdDateTime"]
+                else:
+                    nuevas.append((carpeta["name"][:NOMBRE_MAX], carpeta.get("webUrl"), carpeta["id"]))
+
+            for consulta, filas in ((db.DELTA_UPDATE_PROJECTS, cambios), (db.DELTA_INSERT_PROJECTS, nuevas)):
+                if filas:
+                    for fila in execute_values(cursor, consulta, filas, page_size=len(filas), fetch=True):
+                        etiquetas.update(["proyectos", ("proyecto", fila["proyecto_id"])])
+                        resumen["cambios"] += 1
+
+        # Documentos: archivos ya registrados (URL y proyecto) y archivos nuevos en carpetas de proyectos
+        archivos = [item for item in vivos if "file" in item]
+        if archivos:
+            cursor.execute(db.DELTA_GET_DOCUMENTS, ([a["id"] for a in archivos],))
+            registrados = {fila["id_sharepoint"]: fila for fila in cursor.fetchall()}
+            cursor.execute(db.DELTA_GET_PROJECTS, (list({padre(a) for a in archivos if padre(a)}),))
+            proyecto_de_carpeta = {fila["id_sharepoint"]: fila["proyecto_id"] for fila in cursor.fetchall()}
+
+            cambios, nuevos = [], []
+            for archivo in archivos:
+                proyecto_id = proyecto_de_carpeta.get(padre(archivo))
+                if archivo["id"] in registrados:
+                    cambios.append((archivo["id"], archivo.get("webUrl"), proyecto_id))
+                elif reciente(archivo) and (proyecto_id or padre(archivo) in pendientes):
+                    pendientes[archivo["id"]] = archivo["createdDateTime"]
+                elif proyecto_id:
+                    nuevos.append((proyecto_id, archivo["name"][:NOMBRE_MAX], archivo.get("webUrl"), archivo["id"]))
+                # Archivos fuera de las carpetas de proyectos (p. ej. subcarpetas): se ignoran
+
+            if cambios:
+                filas = execute_values(cursor, db.DELTA_UPDATE_DOCUMENTS, cambios,
+                                       template="(%s, %s, %s::int)", page_size=len(cambios), fetch=True)
+                # Si el archivo se ha movido, cambian los listados del proyecto anterior y del nuevo
+                anterior = {fila["documento_id"]: fila["proyecto_id"] for fila in registrados.values()}
+                for fila in filas:
+                    etiquetas.update([
+                        ("documento", fila["documento_id"]),
+                        ("documentos", fila["proyecto_id"]),
+                        ("documentos", anterior[fila["documento_id"]]),
+                    ])
+                    resumen["cambios"] += 1
+            if nuevos:
+                for fila in execute_values(cursor, db.DELTA_INSERT_DOCUMENTS, nuevos, page_size=len(nuevos), fetch=True):
+                    etiquetas.add(("documentos", fila["proyecto_id"]))
+                    resumen["cambios"] += 1
+
+        return etiquetas
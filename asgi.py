@@ -0,0 +1,22 @@
+# Punto de entrada del modo asyncio: python asgi.py (o uvicorn asgi:app). Ver app/asgi.py
+from app.asgi import create_asgi_app
+from app.config.config import APP_HOST, APP_PORT, SERVER_CONFIG
+
+if __name__ == "__main__":
+    import uvicorn
+    from app.utils import metricas
+
+    metricas.limpiar()  # /metrics desde cero (ver gunicorn.conf.py)
+
+    # Un proceso por worker, cada uno con su bucle de eventos, sus pools y su aplicación
+    uvicorn.run(
+        "app.asgi:create_asgi_app",
+        factory=True,
+        host=APP_HOST,
+        port=APP_PORT,
+        workers=SERVER_CONFIG["WORKERS"],
+        timeout_keep_alive=SERVER_CONFIG["KEEPALIVE"],
+        timeout_graceful_shutdown=SERVER_CONFIG["GRACEFUL_TIMEOUT"],
+    )
+else:
+    app = create_asgi_app()
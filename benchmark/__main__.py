@@ -0,0 +1,303 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+
+from benchmark.carga import Muestreador, Registro, ejecutar_carga
+from benchmark.escenarios import ESCENARIOS, Contexto
+
+# Pruebas de carga de la API con Microsoft Graph simulado (benchmark/graph_falso.py) y la BBDD local.
+#
+#   python -m benchmark ejecutar --servidor gunicorn --escenarios lecturas subidas --concurrencia 32
+#   python -m benchmark comparar benchmark/resultados/<anterior>.json benchmark/resultados/<nuevo>.json
+#
+# Cada escenario arranca su propio servidor (mismos comandos que en producción) apuntando al Graph simulado,
+# prepara sus datos a través de la API, mide y elimina lo que ha creado. Los resultados se guardan en JSON.
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTADOS_DIR = os.path.join(RAIZ, "benchmark", "resultados")
+SERVIDORES = {
+    "gunicorn": [sys.executable, "-m", "gunicorn", "wsgi:app"],
+    "asgi": [sys.executable, "asgi.py"],
+    "flask": [sys.executable, "main.py"],
+}
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _esperar(url, proceso, log, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if proceso is not None and proceso.poll() is not None:
+            raise RuntimeError(f"El proceso terminó al arrancar (código {proceso.returncode}); ver {log}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} no responde tras {timeout}s; ver {log}")
+
+
+def _parar(proceso, timeout=40):
+    if proceso is None or proceso.poll() is not None:
+        return
+    proceso.terminate()  # SIGTERM: mismo apagado ordenado que en producción
+    try:
+        proceso.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+        proceso.wait()
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Entorno:
+    """
+    Graph simulado y servidor de la aplicación para un escenario (context manager).
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.graph = None
+        self.servidor = None
+        self.log = os.path.join(tempfile.gettempdir(), "autodoc-benchmark.log")
+        self.contenido = None
+
+    def __enter__(self):
+        args = self.args
+        self._salida = open(self.log, "w")
+        if args.servidor == "externo":
+            self.url = args.url
+            self.graph_url = args.graph_url
+            _esperar(f"{self.url}/saludo", None, self.log)
+            return self
+
+        puerto_graph = _puerto_libre()
+        self.graph_url = f"http://127.0.0.1:{puerto_graph}"
+        self.graph = subprocess.Popen(
+            [sys.executable, "-m", "benchmark.graph_falso", "--puerto", str(puerto_graph),
+             "--latencia", str(args.latencia), "--jitter", str(args.jitter),
+             "--throttle", str(args.throttle), "--retry-after", str(args.retry_after), "--semilla", str(args.semilla)],
+            cwd=RAIZ, stdout=self._salida, stderr=subprocess.STDOUT,
+        )
+        _esperar(f"{self.graph_url}/_stats", self.graph, self.log)
+
+        puerto = _puerto_libre()
+        self.url = f"http://127.0.0.1:{puerto}"
+        self.contenido = tempfile.mkdtemp(prefix="autodoc-benchmark-contenido-")
+        entorno = dict(
+            os.environ,
+            APP_HOST="127.0.0.1",
+            APP_PORT=str(puerto),
+            GRAPH_BASE_URL=f"{self.graph_url}/v1.0",
+            GRAPH_LOGIN_URL=self.graph_url,
+            TENANT_ID="benchmark",
+            CLIENT_ID="benchmark",
+            CLIENT_SECRET="benchmark",
+            SITE_ID="benchmark-site",
+            DRIVE_ID="benchmark-drive",
+            RECONCILE_ENABLED="false",  # sin consultas delta durante la medición
+            # Los ids del Graph simulado se repiten en cada ejecución: caché de descargas vacía y propia
+            CONTENT_CACHE_DIR=self.contenido,
+        )
+        if args.workers:
+            entorno["SERVER_WORKERS"] = str(args.workers)
+        self.servidor = subprocess.Popen(SERVIDORES[args.servidor], cwd=RAIZ, env=entorno,
+                                         stdout=self._salida, stderr=subprocess.STDOUT)
+        _esperar(f"{self.url}/saludo", self.servidor, self.log)
+        return self
+
+    def __exit__(self, *exc):
+        _parar(self.servidor)
+        _parar(self.graph)
+        self._salida.close()
+        if self.contenido:
+            shutil.rmtree(self.contenido, ignore_errors=True)
+
+    @property
+    def pid(self):
+        return self.servidor.pid if self.servidor is not None else None
+
+    def stats_graph(self):
+        if not self.graph_url:
+            return {}
+        try:
+            return requests.get(f"{self.graph_url}/_stats", timeout=5).json()
+        except (requests.RequestException, ValueError):
+            return {}
+
+
+def ejecutar_escenario(escenario, args, db_config):
+    with Entorno(args) as entorno:
+        contexto = Contexto(entorno.url, args.concurrencia)
+        print(f"[{escenario.nombre}] preparando datos...", flush=True)
+        escenario.preparar(contexto)
+        try:
+            if args.calentamiento and not escenario.hasta_agotar:
+                ejecutar_carga(escenario, contexto, args.concurrencia, args.calentamiento, Registro(), args.semilla)
+
+            print(f"[{escenario.nombre}] midiendo {args.duracion}s con {args.concurrencia} clientes...", flush=True)
+            graph_antes = entorno.stats_graph()
+            registro = Registro()
+            with Muestreador(db_config, entorno.pid) as muestreador:
+                duracion = ejecutar_carga(escenario, contexto, args.concurrencia, args.duracion, registro, args.semilla)
+            graph_despues = entorno.stats_graph()
+        finally:
+            contexto.limpiar()
+
+    resultado = {"descripcion": escenario.descripcion, **registro.resumen(duracion), **muestreador.resumen()}
+    resultado["graph"] = {
+        clave: graph_despues.get(clave, 0) - graph_antes.get(clave, 0)
+        for clave in ("peticiones", "throttled", "tokens")
+    }
+    return resultado
+
+
+def _imprimir(resultados):
+    print(f"\n{'escenario':<14}{'peticiones':>11}{'errores':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'conex. BBDD':>13}{'RSS MB':>9}")
+    for nombre, r in resultados.items():
+        lat = r["latencia_ms"]
+        print(f"{nombre:<14}{r['peticiones']:>11}{r['errores']:>9}{r['rps'] or 0:>9}{lat['p50'] or 0:>9}"
+              f"{lat['p95'] or 0:>9}{lat['p99'] or 0:>9}"
+              f"{r['db_conexiones']['en_uso_max']:>6}/{r['db_conexiones']['abiertas_max']:<6}{r['rss_max_mb'] or '-':>9}")
+
+
+def comando_ejecutar(args):
+    from app.config.config import DB_CONFIG  # mismas variables de entorno que el servidor
+
+    resultados = {}
+    for nombre in args.escenarios:
+        resultados[nombre] = ejecutar_escenario(ESCENARIOS[nombre], args, DB_CONFIG)
+
+    commit = _commit()
+    informe = {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "etiqueta": args.etiqueta,
+        "servidor": args.servidor,
+        "parametros": {
+            "concurrencia": args.concurrencia, "duracion": args.duracion, "workers": args.workers,
+            "latencia_graph_ms": args.latencia, "jitter_graph_ms": args.jitter,
+            "throttle": args.throttle, "retry_after": args.retry_after, "semilla": args.semilla,
+        },
+        "maquina": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "escenarios": resultados,
+    }
+    _imprimir(resultados)
+
+    os.makedirs(args.salida, exist_ok=True)
+    nombre = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{args.etiqueta or commit or 'local'}-{args.servidor}.json"
+    ruta = os.path.join(args.salida, nombre)
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {ruta}")
+
+
+# Métricas que se comparan: (ruta en el resultado, True si más es mejor, None si solo es informativa)
+_METRICAS = {
+    "req/s": (("rps",), True),
+    "p50 ms": (("latencia_ms", "p50"), False),
+    "p95 ms": (("latencia_ms", "p95"), False),
+    "p99 ms": (("latencia_ms", "p99"), False),
+    "conexiones BBDD": (("db_conexiones", "en_uso_max"), None),  # pocas conexiones: el % varía mucho
+    "RSS MB": (("rss_max_mb",), False),
+}
+
+
+def _valor(resultado, ruta):
+    for clave in ruta:
+        resultado = (resultado or {}).get(clave)
+    return resultado
+
+
+def comando_comparar(args):
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.nuevo, encoding="utf-8") as f:
+        nuevo = json.load(f)
+    print(f"base:  {base.get('commit')} {base.get('etiqueta') or ''} ({base['fecha']}, {base['servidor']})")
+    print(f"nuevo: {nuevo.get('commit')} {nuevo.get('etiqueta') or ''} ({nuevo['fecha']}, {nuevo['servidor']})")
+    if base.get("parametros") != nuevo.get("parametros") or base["servidor"] != nuevo["servidor"]:
+        print("AVISO: el servidor o los parámetros de las dos ejecuciones no coinciden.")
+
+    regresiones = 0
+    for escenario in base["escenarios"]:
+        if escenario not in nuevo["escenarios"]:
+            continue
+        print(f"\n[{escenario}]")
+        for metrica, (ruta, mas_es_mejor) in _METRICAS.items():
+            antes = _valor(base["escenarios"][escenario], ruta)
+            despues = _valor(nuevo["escenarios"][escenario], ruta)
+            if not antes or despues is None:
+                continue
+            cambio = (despues - antes) / antes * 100
+            peor = -cambio if mas_es_mejor else cambio
+            marca = ""
+            if mas_es_mejor is not None and peor > args.umbral:
+                marca = "  REGRESIÓN"
+                regresiones += 1
+            print(f"  {metrica:<16}{antes:>10} -> {despues:<10} ({cambio:+.1f}%){marca}")
+        errores = nuevo["escenarios"][escenario]["errores"]
+        if errores > base["escenarios"][escenario]["errores"]:
+            print(f"  errores: {base['escenarios'][escenario]['errores']} -> {errores}  REGRESIÓN")
+            regresiones += 1
+
+    print(f"\n{regresiones} regresiones (umbral {args.umbral}%).")
+    return 1 if regresiones else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Pruebas de carga de la API de AutoDoc.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    ejecutar = comandos.add_parser("ejecutar", help="Ejecuta los escenarios y guarda los resultados.")
+    ejecutar.add_argument("--escenarios", nargs="+", choices=list(ESCENARIOS), default=list(ESCENARIOS))
+    ejecutar.add_argument("--servidor", choices=[*SERVIDORES, "externo"], default="gunicorn",
+                          help="cómo se arranca la aplicación (externo: ya arrancada en --url)")
+    ejecutar.add_argument("--url", default="http://127.0.0.1:5000", help="aplicación ya arrancada (--servidor externo)")
+    ejecutar.add_argument("--graph-url", default=None, help="Graph simulado ya arrancado (--servidor externo)")
+    ejecutar.add_argument("--workers", type=int, default=None, help="SERVER_WORKERS del servidor")
+    ejecutar.add_argument("--concurrencia", type=int, default=16, help="clientes simultáneos")
+    ejecutar.add_argument("--duracion", type=float, default=30, help="segundos de medición por escenario")
+    ejecutar.add_argument("--calentamiento", type=float, default=5, help="segundos de carga antes de medir")
+    ejecutar.add_argument("--latencia", type=float, default=40, help="ms de latencia del Graph simulado")
+    ejecutar.add_argument("--jitter", type=float, default=10, help="ms aleatorios añadidos a la latencia")
+    ejecutar.add_argument("--throttle", type=float, default=0.01, help="probabilidad de 429 del Graph simulado")
+    ejecutar.add_argument("--retry-after", type=int, default=1, help="segundos de Retry-After en los 429")
+    ejecutar.add_argument("--semilla", type=int, default=1)
+    ejecutar.add_argument("--etiqueta", default=None, help="nombre de la ejecución (p. ej. la versión)")
+    ejecutar.add_argument("--salida", default=RESULTADOS_DIR)
+
+    comparar = comandos.add_parser("comparar", help="Compara dos resultados guardados.")
+    comparar.add_argument("base")
+    comparar.add_argument("nuevo")
+    comparar.add_argument("--umbral", type=float, default=10, help="% de empeoramiento que cuenta como regresión")
+
+    args = parser.parse_args()
+    if args.comando == "ejecutar":
+        comando_ejecutar(args)
+        return 0
+    return comando_comparar(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import os
+import random
+import threading
+import time
+import psycopg2
+
+# Generador de carga y métricas de las pruebas de carga (ver benchmark/__main__.py)
+
+
+def percentil(valores_ordenados, p):
+    """
+    Percentil `p` (0-100) por rango más cercano de una lista ya ordenada.
+    """
+    if not valores_ordenados:
+        return None
+    indice = max(0, min(len(valores_ordenados) - 1, round(p / 100 * len(valores_ordenados) + 0.5) - 1))
+    return valores_ordenados[indice]
+
+
+def resumir_latencias(latencias):
+    """
+    p50/p95/p99, media y máximo (en ms) de una lista de latencias en segundos.
+    """
+    ordenadas = sorted(latencias)
+    if not ordenadas:
+        return {"p50": None, "p95": None, "p99": None, "media": None, "max": None}
+    return {
+        "p50": round(percentil(ordenadas, 50) * 1000, 1),
+        "p95": round(percentil(ordenadas, 95) * 1000, 1),
+        "p99": round(percentil(ordenadas, 99) * 1000, 1),
+        "media": round(sum(ordenadas) / len(ordenadas) * 1000, 1),
+        "max": round(ordenadas[-1] * 1000, 1),
+    }
+
+
+def _es_error(status):
+    # None = error de conexión; 207 (lote con fallos parciales) cuenta como respuesta correcta
+    return status is None or status >= 400
+
+
+class Registro:
+    """
+    Peticiones medidas: (operación, segundos, status). Lo comparten todos los hilos de carga.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.muestras = []
+
+    def anotar(self, operacion, segundos, status):
+        with self._lock:
+            self.muestras.append((operacion, segundos, status))
+
+    def resumen(self, duracion):
+        muestras = list(self.muestras)
+        por_operacion = {}
+        for operacion in sorted({m[0] for m in muestras}):
+            propias = [m for m in muestras if m[0] == operacion]
+            por_operacion[operacion] = {
+                "peticiones": len(propias),
+                "errores": sum(1 for m in propias if _es_error(m[2])),
+                "latencia_ms": resumir_latencias([m[1] for m in propias]),
+            }
+        return {
+            "peticiones": len(muestras),
+            "errores": sum(1 for m in muestras if _es_error(m[2])),
+            "duracion_s": round(duracion, 2),
+            "rps": round(len(muestras) / duracion, 1) if duracion else None,
+            "latencia_ms": resumir_latencias([m[1] for m in muestras]),
+            "por_operacion": por_operacion,
+        }
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _descendientes(pid):
+    """
+    PIDs de `pid` y de todos sus procesos hijos (workers de gunicorn/uvicorn), leyendo /proc.
+    """
+    hijos = {}
+    for entrada in os.listdir("/proc"):
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entrada}/stat") as f:
+                # "pid (nombre) estado ppid ...": el nombre puede tener espacios
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        hijos.setdefault(ppid, []).append(int(entrada))
+    resultado, pendientes = [], [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        resultado.append(actual)
+        pendientes.extend(hijos.get(actual, ()))
+    return resultado
+
+
+class Muestreador:
+    """
+    Hilo que cada `intervalo` segundos anota:
+    - conexiones de la aplicación a PostgreSQL (abiertas y en uso) según pg_stat_activity,
+    - memoria residente (RSS) del servidor y sus workers, si se indica `pid` (solo Linux).
+    """
+
+    def __init__(self, db_config, pid=None, intervalo=0.2):
+        self.db_config = db_config
+        self.pid = pid
+        self.intervalo = intervalo
+        self.conexiones = []  # (abiertas, en uso)
+        self.rss_kb = []
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def __enter__(self):
+        self._conn = psycopg2.connect(
+            host=self.db_config["DB_HOST"], port=self.db_config["DB_PORT"], dbname=self.db_config["DB_NAME"],
+            user=self.db_config["DB_USER"], password=self.db_config["DB_PASS"],
+            connect_timeout=self.db_config["DB_CONN_TIMEOUT"],
+        )
+        self._conn.autocommit = True
+        self._hilo = threading.Thread(target=self._bucle, name="benchmark-muestreo", daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._hilo.join()
+        self._conn.close()
+
+    def _bucle(self):
+        medir_rss = self.pid is not None and os.path.isdir("/proc")
+        with self._conn.cursor() as cursor:
+            while not self._parar.is_set():
+                cursor.execute(
+                    "SELECT count(*), count(*) FILTER (WHERE state <> 'idle') FROM pg_stat_activity "
+                    "WHERE datname = current_database() AND pid <> pg_backend_pid() AND backend_type = 'client backend'"
+                )
+                self.conexiones.append(cursor.fetchone())
+                if medir_rss:
+                    self.rss_kb.append(sum(_rss_kb(p) for p in _descendientes(self.pid)))
+                self._parar.wait(self.intervalo)
+
+    def resumen(self):
+        abiertas = [a for a, _ in self.conexiones] or [0]
+        en_uso = [u for _, u in self.conexiones] or [0]
+        return {
+            "db_conexiones": {
+                "abiertas_max": max(abiertas),
+                "en_uso_max": max(en_uso),
+                "en_uso_media": round(sum(en_uso) / len(en_uso), 1),
+            },
+            "rss_max_mb": round(max(self.rss_kb) / 1024, 1) if self.rss_kb else None,
+        }
+
+
+def ejecutar_carga(escenario, contexto, concurrencia, duracion, registro, semilla=0):
+    """
+    Lanza `concurrencia` hilos que repiten operaciones del escenario (elegidas según sus pesos)
+    durante `duracion` segundos o hasta que el escenario se quede sin trabajo (p. ej. nada que eliminar).
+    Devuelve los segundos transcurridos.
+    """
+    operaciones = list(escenario.mezcla)
+    pesos = [escenario.mezcla[o] for o in operaciones]
+    fin = time.monotonic() + duracion
+
+    def hilo(n):
+        rng = random.Random(semilla * 1000 + n)
+        sesion = contexto.nueva_sesion()
+        try:
+            while time.monotonic() < fin:
+                operacion = rng.choices(operaciones, pesos)[0]
+                inicio = time.perf_counter()
+                try:
+                    status = escenario.ejecutar(operacion, sesion, contexto, rng)
+                except Exception:
+                    status = None  # error de conexión o timeout
+                if status is False:  # sin trabajo pendiente para esta operación
+                    if escenario.agotado(contexto):
+                        return
+                    continue
+                registro.anotar(operacion, time.perf_counter() - inicio, status)
+        finally:
+            sesion.close()
+
+    inicio = time.monotonic()
+    hilos = [threading.Thread(target=hilo, args=(n,), name=f"benchmark-carga-{n}") for n in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return time.monotonic() - inicio
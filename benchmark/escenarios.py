@@ -0,0 +1,273 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Escenarios de las pruebas de carga: mezcla de operaciones (con su peso), datos que se preparan
+# antes de medir y limpieza al terminar. Todo se hace a través de la API, como el frontend.
+
+PALABRAS = ["informe", "contrato", "factura", "memoria", "plano", "presupuesto", "acta", "anexo"]
+LOTE = 50  # archivos por petición al preparar documentos con /documentos/lote
+
+
+class Contexto:
+    """
+    Estado compartido por los hilos de carga de un escenario: URL de la aplicación, proyectos y documentos
+    que se pueden leer, y pilas de documentos/proyectos que se pueden eliminar.
+    """
+
+    def __init__(self, url, concurrencia, timeout=120):
+        self.url = url.rstrip("/")
+        self.concurrencia = concurrencia
+        self.timeout = timeout
+        self.proyectos = []          # proyectos con documentos para las lecturas
+        self.documentos = {}         # proyecto_id -> [documento_id]
+        self.proyecto_trabajo = None  # proyecto donde se suben y eliminan documentos
+        self.creados = []            # proyectos a eliminar al terminar
+        self._lock = threading.Lock()
+        self._eliminables = []       # documentos de proyecto_trabajo que se pueden eliminar
+        self._proyectos_eliminables = []
+        self.archivos = {
+            "pequeno": os.urandom(64 * 1024),
+            "lote": os.urandom(16 * 1024),
+            "grande": os.urandom(6 * 1024 * 1024),  # por encima de SIMPLE_UPLOAD_MAX: subida por fragmentos
+            "minimo": b"x" * 1024,
+        }
+
+    def nueva_sesion(self):
+        sesion = requests.Session()
+        adaptador = requests.adapters.HTTPAdapter(pool_maxsize=4)
+        sesion.mount("http://", adaptador)
+        return sesion
+
+    def pedir(self, sesion, metodo, ruta, **kwargs):
+        return sesion.request(metodo, f"{self.url}{ruta}", timeout=self.timeout, **kwargs)
+
+    # --------------- Pilas de trabajo (compartidas entre hilos) --------------- #
+    def anadir_eliminables(self, ids):
+        with self._lock:
+            self._eliminables.extend(i for i in ids if i is not None)
+
+    def tomar_eliminables(self, n):
+        with self._lock:
+            tomados = self._eliminables[-n:]
+            del self._eliminables[-n:]
+        return tomados
+
+    def quedan_eliminables(self):
+        return len(self._eliminables) + len(self._proyectos_eliminables)
+
+    def tomar_proyecto_eliminable(self):
+        with self._lock:
+            return self._proyectos_eliminables.pop() if self._proyectos_eliminables else None
+
+    # --------------- Preparación (no se mide) --------------- #
+    def crear_proyecto(self, sesion, nombre):
+        respuesta = self.pedir(sesion, "POST", "/proyectos", json={"nombre": nombre, "descripcion": f"{nombre} (benchmark)"})
+        respuesta.raise_for_status()
+        proyecto_id = respuesta.json()["proyecto_id"]
+        with self._lock:
+            self.creados.append(proyecto_id)
+        return proyecto_id
+
+    def subir_lote(self, sesion, proyecto_id, n, contenido, prefijo="doc"):
+        archivos = [("files", (f"{prefijo}-{PALABRAS[i % len(PALABRAS)]}-{i}.bin", contenido)) for i in range(n)]
+        respuesta = self.pedir(sesion, "POST", f"/proyectos/{proyecto_id}/documentos/lote",
+                               data={"descripcion": "benchmark"}, files=archivos)
+        return [r.get("documento_id") for r in respuesta.json().get("resultados", []) if r.get("ok")]
+
+    def preparar_lecturas(self, proyectos, documentos_por_proyecto, archivo="minimo"):
+        with self.nueva_sesion() as sesion:
+            for n in range(proyectos):
+                self.proyectos.append(self.crear_proyecto(sesion, f"Benchmark {PALABRAS[n % len(PALABRAS)]} {n}"))
+
+        def cargar(proyecto_id):
+            with self.nueva_sesion() as sesion:
+                ids = []
+                for inicio in range(0, documentos_por_proyecto, LOTE):
+                    n = min(LOTE, documentos_por_proyecto - inicio)
+                    ids += self.subir_lote(sesion, proyecto_id, n, self.archivos[archivo], prefijo=f"p{proyecto_id}-{inicio}")
+                self.documentos[proyecto_id] = ids
+
+        with ThreadPoolExecutor(self.concurrencia) as executor:
+            list(executor.map(cargar, self.proyectos))
+
+    def preparar_trabajo(self, documentos=0, proyectos_eliminables=0):
+        with self.nueva_sesion() as sesion:
+            self.proyecto_trabajo = self.crear_proyecto(sesion, "Benchmark trabajo")
+
+        def cargar(inicio):
+            with self.nueva_sesion() as sesion:
+                n = min(LOTE, documentos - inicio)
+                self.anadir_eliminables(self.subir_lote(sesion, self.proyecto_trabajo, n, self.archivos["minimo"]))
+
+        def crear(n):
+            with self.nueva_sesion() as sesion:
+                proyecto_id = self.crear_proyecto(sesion, f"Benchmark eliminar {n}")
+            with self._lock:
+                self._proyectos_eliminables.append(proyecto_id)
+
+        with ThreadPoolExecutor(self.concurrencia) as executor:
+            list(executor.map(cargar, range(0, documentos, LOTE)))
+            list(executor.map(crear, range(proyectos_eliminables)))
+
+    def limpiar(self):
+        """
+        Elimina los proyectos creados (sus documentos se eliminan en cascada).
+        """
+        with self.nueva_sesion() as sesion:
+            for inicio in range(0, len(self.creados), 100):
+                self.pedir(sesion, "DELETE", "/proyectos", json={"ids": self.creados[inicio:inicio + 100]})
+        self.creados = []
+
+
+# ------------------ Operaciones: devuelven el status HTTP (False si no hay trabajo) ------------------ #
+def _proyecto_con_documentos(contexto, rng):
+    proyecto_id = rng.choice(contexto.proyectos)
+    return proyecto_id, contexto.documentos.get(proyecto_id) or [0]
+
+def listar_proyectos(sesion, contexto, rng):
+    return contexto.pedir(sesion, "GET", "/proyectos", params={"limit": 50}).status_code
+
+def obtener_proyecto(sesion, contexto, rng):
+    return contexto.pedir(sesion, "GET", f"/proyectos/{rng.choice(contexto.proyectos)}").status_code
+
+def listar_documentos(sesion, contexto, rng):
+    proyecto_id = rng.choice(contexto.proyectos or [contexto.proyecto_trabajo])
+    return contexto.pedir(sesion, "GET", f"/proyectos/{proyecto_id}/documentos", params={"limit": 50}).status_code
+
+def obtener_documento(sesion, contexto, rng):
+    proyecto_id, documentos = _proyecto_con_documentos(contexto, rng)
+    return contexto.pedir(sesion, "GET", f"/proyectos/{proyecto_id}/documentos/{rng.choice(documentos)}").status_code
+
+def detalle_proyecto(sesion, contexto, rng):
+    proyecto_id = rng.choice(contexto.proyectos)
+    return contexto.pedir(sesion, "GET", f"/proyectos/{proyecto_id}/detalle", params={"limit": 20}).status_code
+
+def buscar(sesion, contexto, rng):
+    return contexto.pedir(sesion, "GET", "/buscar", params={"q": rng.choice(PALABRAS), "limit": 20}).status_code
+
+POPULARES = 10  # documentos de cada proyecto que concentran las descargas
+
+def _documento_popular(contexto, rng):
+    proyecto_id, documentos = _proyecto_con_documentos(contexto, rng)
+    return f"/proyectos/{proyecto_id}/documentos/{rng.choice(documentos[:POPULARES])}/contenido"
+
+def descargar_documento(sesion, contexto, rng):
+    respuesta = contexto.pedir(sesion, "GET", _documento_popular(contexto, rng))
+    respuesta.content  # descargar el cuerpo completo
+    return respuesta.status_code
+
+def descargar_rango(sesion, contexto, rng):
+    inicio = rng.randrange(len(contexto.archivos["pequeno"]) // 2)
+    respuesta = contexto.pedir(sesion, "GET", _documento_popular(contexto, rng),
+                               headers={"Range": f"bytes={inicio}-{inicio + 16 * 1024 - 1}"})
+    respuesta.content
+    return respuesta.status_code
+
+def _subir(sesion, contexto, rng, contenido):
+    respuesta = contexto.pedir(
+        sesion, "POST", f"/proyectos/{contexto.proyecto_trabajo}/documentos",
+        data={"nombre": f"{rng.choice(PALABRAS)} subido", "descripcion": "benchmark"},
+        files={"file": (f"{rng.choice(PALABRAS)}-{rng.randrange(10 ** 9)}.bin", contenido)},
+    )
+    if respuesta.ok:
+        contexto.anadir_eliminables([respuesta.json().get("documento_id")])
+    return respuesta.status_code
+
+def subir_pequeno(sesion, contexto, rng):
+    return _subir(sesion, contexto, rng, contexto.archivos["pequeno"])
+
+def subir_grande(sesion, contexto, rng):
+    return _subir(sesion, contexto, rng, contexto.archivos["grande"])
+
+def subir_lote(sesion, contexto, rng):
+    archivos = [("files", (f"lote-{rng.randrange(10 ** 9)}.bin", contexto.archivos["lote"])) for _ in range(5)]
+    respuesta = contexto.pedir(sesion, "POST", f"/proyectos/{contexto.proyecto_trabajo}/documentos/lote",
+                               data={"descripcion": "benchmark"}, files=archivos)
+    if respuesta.status_code in (200, 207):
+        contexto.anadir_eliminables(r.get("documento_id") for r in respuesta.json()["resultados"] if r["ok"])
+    return respuesta.status_code
+
+def eliminar_documento(sesion, contexto, rng):
+    ids = contexto.tomar_eliminables(1)
+    if not ids:
+        return False
+    return contexto.pedir(sesion, "DELETE", f"/proyectos/{contexto.proyecto_trabajo}/documentos/{ids[0]}").status_code
+
+def eliminar_documentos_lote(sesion, contexto, rng):
+    ids = contexto.tomar_eliminables(20)
+    if not ids:
+        return False
+    return contexto.pedir(sesion, "DELETE", f"/proyectos/{contexto.proyecto_trabajo}/documentos",
+                          json={"ids": ids}).status_code
+
+def eliminar_proyecto(sesion, contexto, rng):
+    proyecto_id = contexto.tomar_proyecto_eliminable()
+    if proyecto_id is None:
+        return False
+    return contexto.pedir(sesion, "DELETE", f"/proyectos/{proyecto_id}").status_code
+
+OPERACIONES = {f.__name__: f for f in (
+    listar_proyectos, obtener_proyecto, listar_documentos, obtener_documento, detalle_proyecto, buscar,
+    descargar_documento, descargar_rango,
+    subir_pequeno, subir_grande, subir_lote, eliminar_documento, eliminar_documentos_lote, eliminar_proyecto,
+)}
+
+
+class Escenario:
+    """
+    Mezcla de operaciones {nombre: peso} y datos a preparar:
+    - lecturas: (proyectos, documentos por proyecto[, archivo de Contexto.archivos]) para las operaciones de lectura.
+    - eliminables: (documentos, proyectos) creados antes de medir para las eliminaciones.
+    Con `hasta_agotar`, la carga termina cuando ya no queda nada que eliminar.
+    """
+
+    def __init__(self, nombre, descripcion, mezcla, lecturas=(0, 0), eliminables=(0, 0), hasta_agotar=False):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.mezcla = mezcla
+        self.lecturas = lecturas
+        self.eliminables = eliminables
+        self.hasta_agotar = hasta_agotar
+
+    def preparar(self, contexto):
+        if self.lecturas[0]:
+            contexto.preparar_lecturas(*self.lecturas)
+        contexto.preparar_trabajo(*self.eliminables)
+
+    def ejecutar(self, operacion, sesion, contexto, rng):
+        return OPERACIONES[operacion](sesion, contexto, rng)
+
+    def agotado(self, contexto):
+        return self.hasta_agotar and not contexto.quedan_eliminables()
+
+
+ESCENARIOS = {e.nombre: e for e in (
+    Escenario(
+        "lecturas", "Listados, detalle y búsqueda (la carga habitual del frontend)",
+        {"listar_proyectos": 25, "listar_documentos": 25, "obtener_proyecto": 10, "obtener_documento": 15,
+         "detalle_proyecto": 10, "buscar": 15},
+        lecturas=(8, 200),
+    ),
+    Escenario(
+        "subidas", "Subidas de documentos: pequeñas, por lotes y grandes (por fragmentos)",
+        {"subir_pequeno": 60, "subir_lote": 20, "subir_grande": 5, "listar_documentos": 15},
+    ),
+    Escenario(
+        "eliminaciones", "Ráfaga de eliminaciones de documentos (individuales y por lotes) y proyectos",
+        {"eliminar_documento": 60, "eliminar_documentos_lote": 30, "eliminar_proyecto": 10},
+        eliminables=(3000, 100), hasta_agotar=True,
+    ),
+    Escenario(
+        "mixto", "Lecturas con subidas y eliminaciones intercaladas",
+        {"listar_proyectos": 20, "listar_documentos": 20, "obtener_documento": 15, "buscar": 10,
+         "detalle_proyecto": 5, "subir_pequeno": 15, "subir_lote": 5, "eliminar_documento": 10},
+        lecturas=(4, 100), eliminables=(500, 0),
+    ),
+    Escenario(
+        "descargas", "Descargas de los documentos más populares, completas y por rangos (caché en disco)",
+        {"descargar_documento": 70, "descargar_rango": 20, "listar_documentos": 10},
+        lecturas=(4, 50, "pequeno"),
+    ),
+)}
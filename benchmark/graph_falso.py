@@ -0,0 +1,338 @@
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+# Microsoft Graph y Azure AD simulados para las pruebas de carga (ver benchmark/__main__.py).
+# Responde a las llamadas que hace la aplicación: token (Client Credentials), crear/renombrar/eliminar
+# carpetas, PUT simple, upload sessions por fragmentos, /$batch y metadatos y descarga (con Range) de archivos.
+# Los archivos no se guardan (solo su tamaño): al descargarlos se generan bytes que dependen del id y la versión.
+# - latencia: milisegundos de espera en cada respuesta (más un jitter aleatorio).
+# - throttle: probabilidad de responder 429 con Retry-After (como Graph cuando se superan sus límites).
+#
+#   python -m benchmark.graph_falso --puerto 8765 --latencia 40 --throttle 0.02
+#   GRAPH_BASE_URL=http://127.0.0.1:8765/v1.0 GRAPH_LOGIN_URL=http://127.0.0.1:8765 python main.py
+
+_ITEM = re.compile(r"^/drives/[^/]+/items/([^/:]+)$")
+_CONTENIDO = re.compile(r"^/drives/[^/]+/items/([^/:]+)(?::/(.+):)?/content$")
+_SESION = re.compile(r"^/drives/[^/]+/items/([^/:]+)(?::/(.+):)?/createUploadSession$")
+_CARPETA = re.compile(r"^/sites/[^/]+/drives/[^/]+/root/children$")
+_SUBIDA = re.compile(r"^/subidas/(\d+)$")
+_RANGO = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+_DESCARGA = re.compile(r"^/descargas/([^/]+)$")
+_RANGO_PEDIDO = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class GraphFalso:
+    """
+    Estado del Graph simulado: elementos del drive, upload sessions y contadores de peticiones.
+    """
+
+    def __init__(self, latencia=40, jitter=10, throttle=0.0, retry_after=1, semilla=None):
+        self.latencia = latencia / 1000
+        self.jitter = jitter / 1000
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.base = ""  # http://host:puerto (se asigna al arrancar el servidor)
+        self._random = random.Random(semilla)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.items = {}      # id -> {"name", "size"}
+        self.sesiones = {}   # id de sesión -> {"item": id o None, "name", "size", "recibido"}
+        self.contadores = {"peticiones": 0, "throttled": 0, "tokens": 0, "bytes_recibidos": 0,
+                           "descargas": 0, "bytes_enviados": 0}
+
+    def _contar(self, clave, n=1):
+        with self._lock:
+            self.contadores[clave] += n
+
+    def esperar(self):
+        with self._lock:
+            demora = self.latencia + self._random.uniform(0, self.jitter)
+        time.sleep(demora)
+
+    def limitar(self):
+        """
+        True si esta petición se rechaza con 429 (según la probabilidad `throttle`).
+        """
+        if not self.throttle:
+            return False
+        with self._lock:
+            rechazar = self._random.random() < self.throttle
+        if rechazar:
+            self._contar("throttled")
+        return rechazar
+
+    def _nuevo_item(self, nombre, size=0, carpeta=False):
+        item_id = f"ITEM{next(self._ids)}"
+        item = {"id": item_id, "name": nombre, "size": size, "webUrl": f"{self.base}/web/{item_id}"}
+        if carpeta:
+            item["folder"] = {"childCount": 0}
+        else:
+            item["file"] = {"mimeType": "application/octet-stream"}
+        self._nueva_version(item)
+        with self._lock:
+            self.items[item_id] = item
+        return item
+
+    def _nueva_version(self, item):
+        version = item.get("version", 0) + 1
+        item.update(version=version, eTag=f'"{{{item["id"]}}},{version}"',
+                    lastModifiedDateTime=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+
+    # --------------- Operaciones del drive: devuelven (status, cuerpo JSON) --------------- #
+    def crear_carpeta(self, body):
+        return 201, self._nuevo_item(body.get("name", "carpeta"), carpeta=True)
+
+    def renombrar(self, item_id, body):
+        item = self.items.get(item_id)
+        if item is None:
+            return 404, _error("itemNotFound")
+        item["name"] = body.get("name", item["name"])
+        return 200, item
+
+    def eliminar(self, item_id):
+        with self._lock:
+            existia = self.items.pop(item_id, None) is not None
+        return (204, None) if existia else (404, _error("itemNotFound"))
+
+    def subir(self, padre, nombre, datos):
+        self._contar("bytes_recibidos", len(datos))
+        if nombre is None:  # reemplazar contenido de un archivo existente
+            item = self.items.get(padre)
+            if item is None:
+                return 404, _error("itemNotFound")
+            item["size"] = len(datos)
+            self._nueva_version(item)
+            return 200, item
+        return 201, self._nuevo_item(nombre, len(datos))
+
+    def crear_sesion(self, padre, nombre):
+        sesion_id = next(self._ids)
+        with self._lock:
+            self.sesiones[sesion_id] = {"item": None if nombre else padre, "name": nombre, "recibido": 0}
+        return 200, {"uploadUrl": f"{self.base}/subidas/{sesion_id}", "expirationDateTime": "2099-01-01T00:00:00Z"}
+
+    def fragmento(self, sesion_id, rango, datos):
+        sesion = self.sesiones.get(sesion_id)
+        if sesion is None:
+            return 404, _error("itemNotFound")
+        match = _RANGO.match(rango or "")
+        if not match:
+            return 400, _error("invalidRange")
+        inicio, fin, total = map(int, match.groups())
+        if inicio != sesion["recibido"] or fin - inicio + 1 != len(datos):
+            return 416, _error("invalidRange")
+        sesion["recibido"] = fin + 1
+        self._contar("bytes_recibidos", len(datos))
+        if sesion["recibido"] < total:
+            return 202, {"nextExpectedRanges": [f"{sesion['recibido']}-"]}
+        with self._lock:
+            self.sesiones.pop(sesion_id, None)
+        if sesion["item"]:
+            item = self.items.get(sesion["item"])
+            if item is None:
+                return 404, _error("itemNotFound")
+            item["size"] = total
+            self._nueva_version(item)
+            return 200, item
+        return 201, self._nuevo_item(sesion["name"], total)
+
+    def obtener(self, item_id):
+        item = self.items.get(item_id)
+        if item is None:
+            return 404, _error("itemNotFound")
+        return 200, dict(item, **{"@microsoft.graph.downloadUrl": f"{self.base}/descargas/{item_id}"})
+
+    def contenido(self, item_id, rango):
+        """
+        (status, bytes, cabeceras) de la descarga de un archivo, con un único rango "bytes=a-b" como Graph.
+        """
+        item = self.items.get(item_id)
+        if item is None or "file" not in item:
+            return 404, b"", {}
+        size = item["size"]
+        inicio, fin = 0, size - 1
+        match = _RANGO_PEDIDO.match(rango or "")
+        if match and (match.group(1) or match.group(2)):
+            if not match.group(1):  # "bytes=-n": los n últimos
+                inicio = max(0, size - int(match.group(2)))
+            else:
+                inicio = int(match.group(1))
+                fin = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if inicio >= size or inicio > fin:
+                return 416, b"", {"Content-Range": f"bytes */{size}"}
+        patron = hashlib.sha256(item["eTag"].encode()).digest()
+        datos = (patron * (fin // len(patron) + 1))[inicio:fin + 1]
+        self._contar("descargas")
+        self._contar("bytes_enviados", len(datos))
+        if match and (inicio, fin) != (0, size - 1):
+            return 206, datos, {"Content-Range": f"bytes {inicio}-{fin}/{size}"}
+        return 200, datos, {}
+
+    def estado_sesion(self, sesion_id):
+        sesion = self.sesiones.get(sesion_id)
+        if sesion is None:
+            return 404, _error("itemNotFound")
+        return 200, {"nextExpectedRanges": [f"{sesion['recibido']}-"]}
+
+    def cancelar_sesion(self, sesion_id):
+        with self._lock:
+            self.sesiones.pop(sesion_id, None)
+        return 204, None
+
+    def despachar(self, metodo, ruta, body, datos=b""):
+        """
+        Ejecuta una petición a la API del drive (también las sub-peticiones de /$batch).
+        """
+        if metodo == "POST" and _CARPETA.match(ruta):
+            return self.crear_carpeta(body or {})
+        match = _SESION.match(ruta)
+        if metodo == "POST" and match:
+            return self.crear_sesion(match.group(1), match.group(2) and unquote(match.group(2)))
+        match = _CONTENIDO.match(ruta)
+        if metodo == "PUT" and match:
+            return self.subir(match.group(1), match.group(2) and unquote(match.group(2)), datos)
+        match = _ITEM.match(ruta)
+        if match and metodo == "GET":
+            return self.obtener(match.group(1))
+        if match and metodo == "PATCH":
+            return self.renombrar(match.group(1), body or {})
+        if match and metodo == "DELETE":
+            return self.eliminar(match.group(1))
+        return 404, _error("invalidRequest", f"Ruta no simulada: {metodo} {ruta}")
+
+    def batch(self, body):
+        respuestas = []
+        for sub in (body or {}).get("requests", []):
+            if self.limitar():
+                respuestas.append({"id": sub["id"], "status": 429, "headers": {"Retry-After": str(self.retry_after)},
+                                   "body": _error("TooManyRequests")})
+                continue
+            status, cuerpo = self.despachar(sub["method"], sub["url"], sub.get("body"))
+            respuestas.append({"id": sub["id"], "status": status, "body": cuerpo})
+        return 200, {"responses": respuestas}
+
+
+def _error(codigo, mensaje=""):
+    return {"error": {"code": codigo, "message": mensaje}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como Graph
+    graph = None  # GraphFalso (se asigna en crear_servidor)
+
+    def log_message(self, format, *args):
+        pass  # sin una línea por petición
+
+    def _responder(self, status, cuerpo=None, headers=None):
+        datos = json.dumps(cuerpo).encode("utf-8") if cuerpo is not None else b""
+        self.send_response(status)
+        for nombre, valor in (headers or {}).items():
+            self.send_header(nombre, valor)
+        if datos:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _enviar(self, status, datos, headers):
+        self.send_response(status)
+        for nombre, valor in headers.items():
+            self.send_header(nombre, valor)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(datos)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _leer(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(longitud) if longitud else b""
+
+    def _atender(self):
+        graph = self.graph
+        ruta = urlsplit(self.path).path
+        datos = self._leer()
+
+        if ruta == "/_stats":
+            return self._responder(200, dict(graph.contadores, items=len(graph.items)))
+
+        graph._contar("peticiones")
+        graph.esperar()
+
+        if ruta.endswith("/oauth2/v2.0/token"):
+            graph._contar("tokens")
+            return self._responder(200, {"token_type": "Bearer", "expires_in": 3599,
+                                         "access_token": f"token-falso-{time.time():.0f}"})
+        if graph.limitar():
+            return self._responder(429, _error("TooManyRequests"), {"Retry-After": str(graph.retry_after)})
+
+        match = _SUBIDA.match(ruta)
+        if match:
+            sesion_id = int(match.group(1))
+            if self.command == "PUT":
+                return self._responder(*graph.fragmento(sesion_id, self.headers.get("Content-Range"), datos))
+            if self.command == "GET":
+                return self._responder(*graph.estado_sesion(sesion_id))
+            return self._responder(*graph.cancelar_sesion(sesion_id))
+
+        match = _DESCARGA.match(ruta)
+        if match and self.command == "GET":  # URL de descarga firmada: sin token
+            return self._enviar(*graph.contenido(match.group(1), self.headers.get("Range")))
+
+        if not ruta.startswith("/v1.0/"):
+            return self._responder(404, _error("invalidRequest"))
+        ruta = ruta[len("/v1.0"):]
+        es_json = "json" in (self.headers.get("Content-Type") or "")
+        body = json.loads(datos) if es_json and datos else None
+        if ruta == "/$batch" and self.command == "POST":
+            return self._responder(*graph.batch(body))
+        return self._responder(*graph.despachar(self.command, ruta, body, datos))
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _atender
+
+
+def crear_servidor(host="127.0.0.1", puerto=0, **opciones):
+    """
+    Crea el servidor HTTP del Graph simulado (sin arrancarlo: serve_forever()).
+    Con puerto 0 se elige uno libre (servidor.server_port).
+    """
+    graph = GraphFalso(**opciones)
+    handler = type("Handler", (_Handler,), {"graph": graph})
+    servidor = ThreadingHTTPServer((host, puerto), handler)
+    servidor.daemon_threads = True
+    graph.base = f"http://{host}:{servidor.server_port}"
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microsoft Graph simulado para las pruebas de carga.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=40, help="ms de espera en cada respuesta")
+    parser.add_argument("--jitter", type=float, default=10, help="ms aleatorios añadidos a la latencia")
+    parser.add_argument("--throttle", type=float, default=0.0, help="probabilidad de responder 429 (0-1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="segundos indicados en Retry-After")
+    parser.add_argument("--semilla", type=int, default=None)
+    args = parser.parse_args()
+
+    servidor = crear_servidor(args.host, args.puerto, latencia=args.latencia, jitter=args.jitter,
+                              throttle=args.throttle, retry_after=args.retry_after, semilla=args.semilla)
+    print(f"Graph simulado en {servidor.server_address[0]}:{servidor.server_port}", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# Configuración de gunicorn (se carga sola al arrancar desde la raíz del proyecto): gunicorn wsgi:app
+# Los valores están en SERVER_CONFIG (app/config/config.py) y se cambian con variables de entorno SERVER_*.
+from app.config.config import APP_HOST, APP_PORT, SERVER_CONFIG
+
+bind = f"{APP_HOST}:{APP_PORT}"
+workers = SERVER_CONFIG["WORKERS"]      # procesos: aprovechan todos los núcleos (la caché de respuestas se invalida en todos, ver CACHE_SHARED)
+threads = SERVER_CONFIG["THREADS"]      # hilos por proceso (la mayor parte del tiempo se espera a Graph/PostgreSQL)
+worker_class = "gthread"
+timeout = SERVER_CONFIG["TIMEOUT"]
+graceful_timeout = SERVER_CONFIG["GRACEFUL_TIMEOUT"]
+keepalive = SERVER_CONFIG["KEEPALIVE"]
+max_requests = SERVER_CONFIG["MAX_REQUESTS"]
+max_requests_jitter = max_requests // 10
+
+# La aplicación se importa en cada worker después del fork: el proceso maestro no crea
+# pools, sesiones HTTP ni hilos que luego compartirían varios procesos.
+preload_app = False
+
+accesslog = "-"
+
+
+def on_starting(server):
+    # Métricas de /metrics desde cero: se borran las que volcaron los workers de un arranque anterior
+    from app.utils import metricas
+    metricas.limpiar()
+
+
+def worker_exit(server, worker):
+    # Con SIGTERM gunicorn deja de aceptar conexiones y espera a las requests en curso (graceful_timeout);
+    # después cada worker termina sus jobs de la outbox y cierra sus conexiones.
+    from app.utils import funciones as funcs
+    funcs.cerrar_recursos()
@@ -1,6 +1,17 @@
-from app import app
+import os
 
-from app.config.config import APP_PORT # Puerto 5000
+from app import create_app, iniciar_servicios
+
+from app.config.config import APP_HOST, APP_PORT, APP_DEBUG # Puerto 5000
+
+# Servidor de desarrollo de Flask (un solo proceso). En producción: gunicorn wsgi:app (ver gunicorn.conf.py)
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=APP_PORT, debug=True)
\ No newline at end of file
+    from app.utils import metricas
+
+    metricas.limpiar()  # /metrics desde cero (ver gunicorn.conf.py)
+    # Con el recargador de debug, este proceso solo vigila los archivos: los servicios van en el que atiende
+    if not APP_DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        iniciar_servicios(app)
+    app.run(host=APP_HOST, port=APP_PORT, debug=APP_DEBUG)
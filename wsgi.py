@@ -0,0 +1,5 @@
+# Punto de entrada WSGI para producción: gunicorn wsgi:app (configuración en gunicorn.conf.py)
+from app import create_app, iniciar_servicios
+
+app = create_app()
+iniciar_servicios(app)  # cada worker importa este módulo después del fork (preload_app = False)